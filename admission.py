@@ -0,0 +1,102 @@
+import logging
+from typing import Dict, List, Optional
+from config import (
+    RESOLUTIONS, MAX_DURATION, MAX_FILE_SIZE, UPLOAD_SIZE_LIMIT,
+    ENCODE_SPEED, USER_COMPUTE_BUDGET, COMPUTE_BUDGET_WINDOW
+)
+from database import DatabaseManager
+from content_analysis import parse_bitrate
+from video_processor import TARGET_AUDIO_BITRATE
+from utils import format_bytes, format_duration
+
+logger = logging.getLogger(__name__)
+
+# Encode cost is expressed relative to a 1080p rendition
+REFERENCE_PIXELS = RESOLUTIONS['1080p']['width'] * RESOLUTIONS['1080p']['height']
+
+class AdmissionControl:
+    """Check a video against duration, size and the user's compute budget before it is offered"""
+
+    def __init__(self, db: DatabaseManager, max_duration: int = MAX_DURATION, max_size: int = MAX_FILE_SIZE,
+                 encode_speed: float = ENCODE_SPEED, budget: int = USER_COMPUTE_BUDGET,
+                 window: int = COMPUTE_BUDGET_WINDOW):
+        self.db = db
+        self.max_duration = max_duration
+        self.max_size = max_size
+        self.encode_speed = encode_speed  # seconds of 1080p video encoded per second
+        self.budget = budget  # encode seconds a user may queue per window, 0 = unlimited
+        self.window = window
+
+    def estimate(self, duration: float, resolution: str) -> Dict:
+        """Get the encode cost (seconds) and maximum output size (bytes) of one rendition"""
+        params = RESOLUTIONS[resolution]
+        pixels = params['width'] * params['height']
+        return {
+            'cost': duration * pixels / REFERENCE_PIXELS / self.encode_speed,
+            'size': int(duration * (parse_bitrate(params['bitrate']) + TARGET_AUDIO_BITRATE) / 8)
+        }
+
+    async def remaining_budget(self, user_id: int) -> Optional[float]:
+        """Encode seconds the user can still queue in the current window; None if unlimited"""
+        if not self.budget:
+            return None
+        used = await self.db.get_user_compute_used(user_id, self.window)
+        return max(0.0, self.budget - used)
+
+    async def review(self, user_id: int, media: Dict, resolutions: List[str] = None) -> Dict:
+        """Decide whether a video (``duration``, ``size``) may be queued and which resolutions to offer, with cost estimates"""
+        resolutions = resolutions or list(RESOLUTIONS)
+        duration = media.get('duration') or 0
+        review = {'allowed': False, 'reason': None, 'offer': [], 'estimates': {}, 'total_cost': 0.0,
+                  'remaining': None, 'warnings': []}
+
+        if media.get('size', 0) > self.max_size:
+            review['reason'] = f"File too large! Maximum size: {format_bytes(self.max_size)}"
+            return review
+        if duration > self.max_duration:
+            review['reason'] = (
+                f"Video too long! {format_duration(duration)} exceeds the "
+                f"{format_duration(self.max_duration)} limit."
+            )
+            return review
+        if not duration:
+            review['warnings'].append("Duration unknown until download; it is checked before encoding.")
+
+        review['remaining'] = await self.remaining_budget(user_id)
+        for resolution in resolutions:
+            estimate = self.estimate(duration, resolution)
+            review['estimates'][resolution] = estimate
+            if review['remaining'] is not None and estimate['cost'] > review['remaining']:
+                continue
+            review['offer'].append(resolution)
+            if estimate['size'] > UPLOAD_SIZE_LIMIT:
+                review['warnings'].append(f"{resolution} may exceed {format_bytes(UPLOAD_SIZE_LIMIT)} and arrive in parts.")
+        review['total_cost'] = sum(review['estimates'][resolution]['cost'] for resolution in review['offer'])
+
+        if not review['offer']:
+            review['reason'] = (
+                f"Compute budget exhausted: {format_duration(review['remaining'])} of encoding left, "
+                f"this video needs at least {format_duration(min(e['cost'] for e in review['estimates'].values()))}."
+            )
+            return review
+        if len(review['offer']) < len(resolutions):
+            review['warnings'].append(
+                f"Only {', '.join(review['offer'])} fit your remaining compute budget "
+                f"({format_duration(review['remaining'])})."
+            )
+
+        review['allowed'] = True
+        return review
+
+    async def admit(self, user_id: int, media: Dict, resolutions: List[str]) -> Optional[str]:
+        """Re-check a selection as it is queued; returns why it is refused, or None"""
+        review = await self.review(user_id, media, resolutions)
+        if not review['allowed']:
+            return review['reason']
+        cost = sum(review['estimates'][resolution]['cost'] for resolution in resolutions)
+        if review['remaining'] is not None and cost > review['remaining']:
+            return (
+                f"Not enough compute budget left for {', '.join(resolutions)}: "
+                f"needs {format_duration(cost)}, {format_duration(review['remaining'])} left."
+            )
+        return None
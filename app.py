@@ -1,13 +1,22 @@
 import os
 import logging
-from pyrogram import Client
+from pyrogram import Client, filters, idle
 from pyrogram.handlers import MessageHandler, CallbackQueryHandler
-from config import API_ID, API_HASH, BOT_TOKEN, SESSION_NAME, UPLOAD_CHANNEL_ID
+import config
+from config import (
+    API_ID, API_HASH, BOT_TOKEN, SESSION_NAME, UPLOAD_CHANNEL_ID, UPLOAD_BOT_TOKENS, STORAGE_CHANNEL_IDS,
+    METRICS_HOST, METRICS_PORT, LOOP_LAG_THRESHOLD
+)
 from database import DatabaseManager
 from auth_manager import AuthManager
 from queue_manager import QueueManager
 from handlers import MessageHandlers
-from utils import check_ffmpeg, ensure_temp_dir
+from video_processor import VideoProcessor
+from channel_uploader import ChannelUploader
+from utils import ensure_temp_dir, split_list
+from ffmpeg_capabilities import probe_capabilities, missing_requirements
+from metrics import MetricsServer
+from diagnostics import LoopLagMonitor
 import asyncio
 
 # Configure logging
@@ -20,9 +29,14 @@ logger = logging.getLogger(__name__)
 
 async def main():
     # Check prerequisites
-    if not await check_ffmpeg():
+    capabilities = await probe_capabilities()
+    if not capabilities:
         logger.error("FFmpeg is not installed or not in PATH. Please install FFmpeg first.")
         return
+    missing = missing_requirements(capabilities)
+    if missing:
+        logger.error(f"The installed FFmpeg lacks {', '.join(missing)}. Please install a full FFmpeg build.")
+        return
 
     # Validate configuration
     if not API_ID or not API_HASH or not BOT_TOKEN or not UPLOAD_CHANNEL_ID:
@@ -46,12 +60,17 @@ async def main():
 
     # Initialize managers
     auth_manager = AuthManager(db_manager)
-    processor = VideoProcessor()
-    uploader = ChannelUploader(app, UPLOAD_CHANNEL_ID)
+    processor = VideoProcessor(capabilities)
+    # Extra bots only upload; users keep talking to the main one
+    upload_clients = [
+        Client(f"{SESSION_NAME}_upload{i}", api_id=API_ID, api_hash=API_HASH, bot_token=token, no_updates=True)
+        for i, token in enumerate(split_list(UPLOAD_BOT_TOKENS), 1)
+    ]
+    uploader = ChannelUploader(app, UPLOAD_CHANNEL_ID, upload_clients, split_list(STORAGE_CHANNEL_IDS))
     queue_manager = QueueManager(db_manager, processor, uploader)
 
     # Initialize handlers
-    handlers = MessageHandlers(app, db_manager, auth_manager, queue_manager)
+    handlers = MessageHandlers(app, db_manager, auth_manager, queue_manager, processor, uploader)
 
     # Register handlers
     app.add_handler(MessageHandler(handlers.start_command, filters.command("start")))
@@ -60,6 +79,9 @@ async def main():
     app.add_handler(MessageHandler(handlers.queue_command, filters.command("queue")))
     app.add_handler(MessageHandler(handlers.jobs_command, filters.command("jobs")))
     app.add_handler(MessageHandler(handlers.progress_command, filters.command("progress")))
+    app.add_handler(MessageHandler(handlers.cancel_command, filters.command("cancel")))
+    app.add_handler(MessageHandler(handlers.stats_command, filters.command("stats")))
+    app.add_handler(MessageHandler(handlers.profile_command, filters.command("profile")))
     app.add_handler(MessageHandler(
         handlers.handle_video, 
         filters.video | (filters.document & filters.create(lambda _, __, m: m.document.mime_type.startswith('video')))
@@ -69,13 +91,25 @@ async def main():
     logger.info("Bot started successfully on VPS!")
     logger.info(f"Supporting files up to {config.MAX_FILE_SIZE / (1024*1024*1024):.1f} GB")
     
-    # Start queue processing
-    await queue_manager.start_processing()
+    # Log a stack trace whenever something blocks the event loop
+    lag_monitor = None
+    if LOOP_LAG_THRESHOLD > 0:
+        lag_monitor = LoopLagMonitor()
+        await lag_monitor.start()
+    
+    # Optional local metrics endpoint
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT, queue_manager.collect_metrics)
+        await metrics_server.start()
     
     try:
         await app.start()
+        await uploader.start_clients()
+        # Workers resume released jobs at once, so the clients must be up first
+        await queue_manager.start_processing()
         logger.info("Bot is running on VPS...")
-        await app.idle()  # Keep the bot running
+        await idle()  # Keep the bot running
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
@@ -83,6 +117,11 @@ async def main():
     finally:
         # Stop queue processing
         await queue_manager.stop_processing()
+        await uploader.stop_clients()
+        if metrics_server:
+            await metrics_server.stop()
+        if lag_monitor:
+            await lag_monitor.stop()
         await app.stop()
         logger.info("Bot stopped")
 
@@ -1,66 +1,146 @@
-from typing import Dict, Optional
+from typing import Dict, Optional, Set, Tuple
+from collections import OrderedDict
 from database import DatabaseManager
+import config
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+STATUS_GRANTED = {
+    'authorized': True,
+    'message': 'Access granted'
+}
+STATUS_DENIED = {
+    'authorized': False,
+    'message': 'Access denied. Contact admin for authorization.'
+}
+STATUS_NOT_REGISTERED = {
+    'authorized': False,
+    'message': 'User not registered'
+}
+
+def parse_user_ids(value: str) -> Set[int]:
+    """Parse a comma-separated list of user IDs"""
+    ids = set()
+    for part in value.split(','):
+        part = part.strip()
+        if part.isdigit():
+            ids.add(int(part))
+        elif part:
+            logger.warning(f"Ignoring invalid user ID in configuration: {part!r}")
+    return ids
+
 class AuthManager:
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
+        # Parsed once; membership checks on the hot path are set lookups
+        self.admin_ids = parse_user_ids(config.ADMIN_USERS)
+        self.configured_ids = parse_user_ids(config.AUTHORIZED_USERS) | self.admin_ids
+        # user_id -> (status, expires_at); LRU ordered, oldest first
+        self.cache: OrderedDict[int, Tuple[Dict, float]] = OrderedDict()
+        self.cache_ttl = config.AUTH_CACHE_TTL
+        self.cache_size = config.AUTH_CACHE_SIZE
+        # user_id -> (username, first_name, last_name) last written; LRU ordered
+        self.seen_profiles: OrderedDict[int, Tuple] = OrderedDict()
+        self._prewarm()
+
+    def _prewarm(self):
+        """Cache configured users as authorized so they never hit the database"""
+        for user_id in self.configured_ids:
+            self._cache_status(user_id, STATUS_GRANTED, ttl=float('inf'))
+
+    def _cache_status(self, user_id: int, status: Dict, ttl: float = None):
+        ttl = self.cache_ttl if ttl is None else ttl
+        self.cache[user_id] = (status, time.monotonic() + ttl)
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _cached_status(self, user_id: int) -> Optional[Dict]:
+        entry = self.cache.get(user_id)
+        if not entry:
+            return None
+        status, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self.cache[user_id]
+            return None
+        self.cache.move_to_end(user_id)
+        return status
+
+    def invalidate(self, user_id: int):
+        """Drop a cached decision so the next check reads the database"""
+        self.cache.pop(user_id, None)
 
     async def is_user_authorized(self, user_id: int) -> bool:
         """Check if user is authorized"""
         if not config.REQUIRE_AUTHENTICATION:
             return True
-        return await self.db.is_user_authorized(user_id)
+        status = await self.get_authorization_status(user_id)
+        return status['authorized']
 
     async def register_user(self, user_data: Dict) -> bool:
-        """Register user and check authorization"""
-        # Add user to database
-        await self.db.add_user(user_data)
-        
-        # Check if user is in authorized list
-        if str(user_data['id']) in config.AUTHORIZED_USERS:
-            await self.db.authorize_user(user_data['id'], True)
-            return True
-        
-        return config.REQUIRE_AUTHENTICATION
+        """Register or refresh a user, skipping the write for repeat senders; True if the database was written"""
+        user_id = user_data['id']
+        profile = (user_data.get('username'), user_data.get('first_name'), user_data.get('last_name'))
+        if self.seen_profiles.get(user_id) == profile:
+            self.seen_profiles.move_to_end(user_id)
+            return False
+
+        if user_id in self.configured_ids:
+            user_data = {**user_data, 'is_authorized': True}
+        written = await self.db.add_user(user_data)
+
+        self.seen_profiles[user_id] = profile
+        self.seen_profiles.move_to_end(user_id)
+        while len(self.seen_profiles) > self.cache_size:
+            self.seen_profiles.popitem(last=False)
+        return written
 
     async def get_authorization_status(self, user_id: int) -> Dict:
-        """Get user authorization status"""
+        """Get user authorization status, served from cache when possible"""
+        status = self._cached_status(user_id)
+        if status is not None:
+            return status
+
         user = await self.db.get_user(user_id)
-        if not user:
-            return {
-                'authorized': False,
-                'message': 'User not registered'
-            }
-        
-        is_auth = user.get('is_authorized', False)
-        if not is_auth and config.REQUIRE_AUTHENTICATION:
-            return {
-                'authorized': False,
-                'message': 'Access denied. Contact admin for authorization.'
-            }
-        
-        return {
-            'authorized': True,
-            'message': 'Access granted'
-        }
+        if user_id in self.configured_ids:
+            status = STATUS_GRANTED
+        elif not user:
+            status = STATUS_NOT_REGISTERED
+        elif not user.get('is_authorized', False) and config.REQUIRE_AUTHENTICATION:
+            status = STATUS_DENIED
+        else:
+            status = STATUS_GRANTED
+
+        # Unregistered users are about to be added by the handler; don't pin that
+        if status is not STATUS_NOT_REGISTERED:
+            self._cache_status(user_id, status)
+        return status
+
+    def is_admin(self, user_id: int) -> bool:
+        """Check if user is an admin"""
+        return user_id in self.admin_ids
+
+    async def authorize_user(self, user_id: int, authorized: bool = True):
+        """Authorize or unauthorize a user and drop any cached decision"""
+        await self.db.authorize_user(user_id, authorized)
+        self.invalidate(user_id)
 
     async def add_authorized_user(self, admin_user_id: int, target_user_id: int) -> bool:
         """Admin function to add authorized user"""
         # Check if admin
-        if str(admin_user_id) not in config.ADMIN_USERS:
+        if not self.is_admin(admin_user_id):
             return False
-        
-        await self.db.authorize_user(target_user_id, True)
+
+        await self.authorize_user(target_user_id, True)
         return True
 
     async def remove_authorized_user(self, admin_user_id: int, target_user_id: int) -> bool:
-        """Admin function to remove authorized user"""
+        """Admin function to remove authorized user (configured users stay authorized)"""
         # Check if admin
-        if str(admin_user_id) not in config.ADMIN_USERS:
+        if not self.is_admin(admin_user_id):
             return False
-        
-        await self.db.authorize_user(target_user_id, False)
+
+        await self.authorize_user(target_user_id, False)
         return True
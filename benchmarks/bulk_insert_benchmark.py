@@ -0,0 +1,76 @@
+"""Bulk job insertion benchmark.
+
+Inserts batches of jobs into a throwaway SQLite database, once through
+repeated ``QueueManager.add_job`` calls and once through a single
+``QueueManager.add_jobs`` call, and compares the time per batch.
+
+    python benchmarks/bulk_insert_benchmark.py --batch 1000 --rounds 5
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import RESOLUTIONS  # noqa: E402
+from database import DatabaseManager  # noqa: E402
+from queue_manager import QueueManager  # noqa: E402
+from storage_manager import StorageManager  # noqa: E402
+
+def make_batch(batch: int, offset: int) -> List[Dict]:
+    resolutions = list(RESOLUTIONS)
+    return [
+        {
+            'user_id': 1 + (offset + i) % 100,
+            'file_id': f"file_{offset + i}",
+            'filename': f"video_{offset + i}.mp4",
+            'size': 10 * 1024 * 1024,
+            'resolution': resolutions[i % len(resolutions)]
+        }
+        for i in range(batch)
+    ]
+
+async def insert_one_by_one(queue: QueueManager, jobs: List[Dict]) -> List[int]:
+    return [
+        await queue.add_job(job['user_id'], job['file_id'], job['filename'], job['size'], job['resolution'])
+        for job in jobs
+    ]
+
+async def run(args):
+    with tempfile.TemporaryDirectory(prefix='bulk_bench_') as work_dir:
+        db = DatabaseManager()
+        db.db_path = str(Path(work_dir) / 'bench.db')
+        await db.initialize()
+        storage = StorageManager(temp_dir=str(Path(work_dir) / 'temp'), min_free_space=0)
+        queue = QueueManager(db, None, None, storage)
+
+        results = {'add_job': [], 'add_jobs': []}
+        offset = 0
+        for _ in range(args.rounds):
+            for name, insert in (('add_job', insert_one_by_one), ('add_jobs', QueueManager.add_jobs)):
+                jobs = make_batch(args.batch, offset)
+                offset += args.batch
+                start = time.perf_counter()
+                job_ids = await insert(queue, jobs)
+                results[name].append(time.perf_counter() - start)
+                assert len(job_ids) == len(jobs)
+
+    print(f"{args.rounds} rounds of {args.batch}-job batches")
+    print(f"{'method':<12} {'best s':>9} {'mean s':>9} {'jobs/s':>10}")
+    for name, samples in results.items():
+        mean = sum(samples) / len(samples)
+        print(f"{name:<12} {min(samples):>9.3f} {mean:>9.3f} {args.batch / mean:>10.0f}")
+    print(f"speedup: {sum(results['add_job']) / sum(results['add_jobs']):.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch', type=int, default=1000, help='Jobs per batch')
+    parser.add_argument('--rounds', type=int, default=5, help='Batches per method')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Reproducible encode benchmark.
+
+Generates deterministic clips with FFmpeg's lavfi sources, runs them through
+VideoProcessor for every rendition and mode, and records throughput and
+resource usage. Runs offline; only FFmpeg is required.
+
+    python benchmarks/encode_benchmark.py --output results.json
+    python benchmarks/encode_benchmark.py --baseline results.json
+    python benchmarks/encode_benchmark.py --preset veryfast --crf-offset 2 --threads 4
+
+Each case runs in a fresh process so CPU time and peak RSS of the FFmpeg
+children belong to that case alone.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import RESOLUTIONS  # noqa: E402
+
+# lavfi sources: a synthetic pattern (easy) and a fractal zoom (hard to compress)
+SOURCES = {
+    'testsrc2': 'testsrc2=size={size}:rate={rate}:duration={duration}',
+    'mandelbrot': 'mandelbrot=size={size}:rate={rate},trim=duration={duration}'
+}
+MODES = ['single', 'all']
+
+# Metrics compared against the baseline and whether higher is better
+COMPARED_METRICS = {'fps': True, 'cpu_seconds': False, 'peak_rss_mb': False, 'output_bytes': False}
+
+def generate_clip(source: str, path: Path, size: str, rate: int, duration: int):
+    """Render a deterministic test clip with a sine audio track"""
+    video = SOURCES[source].format(size=size, rate=rate, duration=duration)
+    subprocess.run([
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', video,
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-shortest', '-fflags', '+bitexact', str(path)
+    ], check=True)
+
+def _run_case(input_path: str, output_dir: str, rendition: str, encoder_settings: Dict,
+              results: multiprocessing.Queue):
+    """Child process body: encode once and report timings and rusage"""
+    from video_processor import VideoProcessor
+
+    processor = VideoProcessor()
+    start = time.perf_counter()
+    outputs = asyncio.run(processor.process_video_with_progress(
+        input_path,
+        None if rendition == 'all' else rendition,
+        output_dir=output_dir,
+        encoder_settings=encoder_settings
+    ))
+    wall = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    results.put({
+        'wall_seconds': wall,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+        'output_bytes': sum(output['size'] for output in outputs),
+        'outputs': len(outputs)
+    })
+
+def wait_for_result(process: multiprocessing.Process, results: multiprocessing.Queue,
+                    timeout: Optional[float]) -> Dict:
+    """Get the child's result; raise RuntimeError if it dies without one or runs over ``timeout``"""
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # The result may have been queued just before the child exited
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                raise RuntimeError(f"case exited with code {process.exitcode} without a result")
+        if deadline and time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError(f"case ran over {timeout:.0f}s and was killed")
+
+def run_case(input_path: Path, rendition: str, frames: int, encoder_settings: Dict,
+             timeout: Optional[float] = None) -> Dict:
+    """Run one benchmark case in a fresh process"""
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    with tempfile.TemporaryDirectory(prefix='bench_out_') as output_dir:
+        process = ctx.Process(
+            target=_run_case, args=(str(input_path), output_dir, rendition, encoder_settings, results)
+        )
+        process.start()
+        try:
+            result = wait_for_result(process, results, timeout)
+        finally:
+            process.join()
+
+    renditions = len(RESOLUTIONS) if rendition == 'all' else 1
+    result['fps'] = frames * renditions / result['wall_seconds'] if result['wall_seconds'] else 0.0
+    return result
+
+def build_cases(renditions: List[str], modes: List[str]) -> List[str]:
+    """Expand modes into the rendition argument passed to the processor"""
+    cases = []
+    if 'single' in modes:
+        cases.extend(renditions)
+    if 'all' in modes:
+        cases.append('all')
+    return cases
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Return human readable regressions beyond ``threshold`` percent"""
+    regressions = []
+    for key, current in results['cases'].items():
+        previous = baseline.get('cases', {}).get(key)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            print(f"  {key:<28} {metric:<13} {old:>12.2f} -> {new:>12.2f} ({change:+.1f}%)")
+            worse = change < -threshold if higher_is_better else change > threshold
+            if worse:
+                regressions.append(f"{key} {metric} {change:+.1f}%")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sources', default=','.join(SOURCES), help='Comma-separated lavfi sources')
+    parser.add_argument('--renditions', default=','.join(RESOLUTIONS), help='Comma-separated renditions')
+    parser.add_argument('--modes', default=','.join(MODES), help='single (one rendition per run), all (every rendition in one run)')
+    parser.add_argument('--size', default='1920x1080', help='Source clip size')
+    parser.add_argument('--rate', type=int, default=30, help='Source clip frame rate')
+    parser.add_argument('--duration', type=int, default=10, help='Source clip duration in seconds')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case; the fastest is kept')
+    parser.add_argument('--preset', default='medium', help='x264 preset')
+    parser.add_argument('--crf-offset', type=int, default=0, help='Added to the CRF the processor chooses')
+    parser.add_argument('--threads', type=int, help='x264 threads per encode (default: the processor\'s)')
+    parser.add_argument('--case-timeout', type=float, default=1800, help='Seconds before a case is killed (0 = none)')
+    parser.add_argument('--output', default='encode_results.json', help='Results file')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    parser.add_argument('--threshold', type=float, default=5.0, help='Regression threshold in percent')
+    args = parser.parse_args()
+
+    frames = args.rate * args.duration
+    cases = build_cases(args.renditions.split(','), args.modes.split(','))
+    encoder_settings = {'preset': args.preset, 'crf_offset': args.crf_offset}
+    if args.threads:
+        encoder_settings['threads'] = args.threads
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'params': {'size': args.size, 'rate': args.rate, 'duration': args.duration, **encoder_settings},
+        'cases': {}
+    }
+    failures = []
+
+    with tempfile.TemporaryDirectory(prefix='bench_src_') as work_dir:
+        for source in args.sources.split(','):
+            clip = Path(work_dir) / f"{source}.mp4"
+            generate_clip(source, clip, args.size, args.rate, args.duration)
+            for rendition in cases:
+                key = f"{source}/{rendition}"
+                try:
+                    runs = [
+                        run_case(clip, rendition, frames, encoder_settings, args.case_timeout)
+                        for _ in range(args.repeat)
+                    ]
+                except RuntimeError as e:
+                    print(f"{key:<28} FAILED: {e}")
+                    failures.append(key)
+                    continue
+                best = max(runs, key=lambda run: run['fps'])
+                results['cases'][key] = best
+                print(f"{key:<28} {best['fps']:8.1f} fps  {best['cpu_seconds']:8.1f} cpu-s  "
+                      f"{best['peak_rss_mb']:8.1f} MB  {best['output_bytes']:>12} bytes")
+
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+    if failures:
+        print(f"Failed cases: {', '.join(failures)}")
+        sys.exit(1)
+
+    if args.baseline:
+        print(f"Comparing against {args.baseline}:")
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.threshold)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions")
+
+if __name__ == '__main__':
+    main()
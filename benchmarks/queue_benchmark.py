@@ -0,0 +1,191 @@
+"""Queue and database load benchmark.
+
+Seeds a throwaway SQLite database with many jobs across many users, then
+drives enqueue, claim, progress and query workloads concurrently through
+the real DatabaseManager and QueueManager. The processor and uploader are
+no-ops, so only the queue and database paths are measured.
+
+    python benchmarks/queue_benchmark.py --jobs 50000 --users 5000 --seconds 30
+"""
+import argparse
+import asyncio
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import RESOLUTIONS  # noqa: E402
+from database import DatabaseManager  # noqa: E402
+from queue_manager import QueueManager  # noqa: E402
+from storage_manager import StorageManager  # noqa: E402
+
+# DatabaseManager methods whose latency is recorded
+TIMED_OPERATIONS = [
+    'add_to_queue', 'add_jobs', 'get_pending_jobs', 'claim_job', 'update_job_status',
+    'get_user_jobs', 'get_user_queue_count', 'get_job_by_id',
+    'set_job_channel_message', 'get_active_job_count_for_file', 'add_job_event',
+    'get_pending_summary', 'set_job_encoder_settings', 'get_active_jobs', 'get_jobs'
+]
+
+class NoopUploader:
+    def __init__(self):
+        self.next_message_id = 0
+
+    async def download(self, file_id: str, file_path: str, progress=None) -> str:
+        Path(file_path).touch()
+        return file_path
+
+    async def upload_to_channel(self, file_path: str, caption: str = "", progress_callback=None, metadata=None,
+                                placements=None):
+        self.next_message_id += 1
+        if placements is not None:
+            placements.append({'message_id': self.next_message_id, 'channel': 0, 'client': 'noop'})
+        return SimpleNamespace(id=self.next_message_id)
+
+    async def send_media_group_to_user(self, messages, user_chat_id: int, additional_caption: str = ""):
+        return []
+
+class NoopProcessor:
+    def __init__(self, progress_ticks: int):
+        self.progress_ticks = progress_ticks
+
+    async def process_video_with_progress(self, input_path: str, target_resolution: str = None,
+                                          progress_callback=None, output_dir: str = None,
+                                          encoder_settings: Dict = None, heartbeat=None) -> List[Dict]:
+        for tick in range(1, self.progress_ticks + 1):
+            if progress_callback:
+                progress_callback(tick * 100.0 / (self.progress_ticks + 1))
+            await asyncio.sleep(0)
+        return [{'path': input_path, 'thumbnail': None, 'duration': 1, 'width': 0, 'height': 0,
+                 'size': 0, 'resolution': target_resolution}]
+
+def seed_database(db_path: str, jobs: int, users: int, pending_ratio: float):
+    """Bulk-load users and jobs directly; seeding is setup, not measured"""
+    rng = random.Random(42)
+    resolutions = list(RESOLUTIONS)
+    with sqlite3.connect(db_path) as db:
+        db.executemany(
+            'INSERT OR IGNORE INTO users (id, username, is_authorized) VALUES (?, ?, 1)',
+            [(user_id, f"user{user_id}") for user_id in range(1, users + 1)]
+        )
+        rows = []
+        for i in range(jobs):
+            pending = rng.random() < pending_ratio
+            rows.append((
+                rng.randint(1, users), f"file_{i}", f"video_{i}.mp4", rng.randint(1, 50) * 1024 * 1024,
+                rng.choice(resolutions), 'pending' if pending else rng.choice(['completed', 'completed', 'failed']),
+                0.0 if pending else 100.0
+            ))
+        db.executemany('''
+            INSERT INTO video_queue (user_id, file_id, original_filename, original_size, target_resolution, status, progress)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+def instrument(db: DatabaseManager, latencies: Dict[str, List[float]]):
+    """Wrap DatabaseManager methods so every call records its latency"""
+    for name in TIMED_OPERATIONS:
+        original = getattr(db, name)
+
+        async def timed(*args, _name=name, _original=original, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await _original(*args, **kwargs)
+            finally:
+                latencies[_name].append(time.perf_counter() - start)
+
+        setattr(db, name, timed)
+
+async def enqueue_load(queue: QueueManager, users: int, deadline: float, rng: random.Random, counter: Dict):
+    while time.perf_counter() < deadline:
+        user_id = rng.randint(1, users)
+        await queue.add_job(user_id, f"new_{counter['enqueued']}", "bench.mp4", 10 * 1024 * 1024, rng.choice(list(RESOLUTIONS)))
+        counter['enqueued'] += 1
+
+async def worker_load(queue: QueueManager, deadline: float, counter: Dict):
+    while time.perf_counter() < deadline:
+        job = await queue.claim_next_job(await queue.db.get_pending_jobs())
+        if not job:
+            await asyncio.sleep(0.01)
+            continue
+        await queue.process_job(job)
+        counter['processed'] += 1
+
+async def reader_load(queue: QueueManager, users: int, deadline: float, rng: random.Random, counter: Dict):
+    # Mirrors /jobs, /progress and /queue
+    while time.perf_counter() < deadline:
+        user_id = rng.randint(1, users)
+        user_jobs = await queue.view.user_jobs(user_id)
+        await queue.db.get_user_queue_count(user_id)
+        for job in user_jobs:
+            if job['status'] == 'pending':
+                await queue.get_user_queue_position(user_id, job['id'])
+        counter['queries'] += 1
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+async def run(args):
+    with tempfile.TemporaryDirectory(prefix='queue_bench_') as work_dir:
+        db = DatabaseManager()
+        db.db_path = str(Path(work_dir) / 'bench.db')
+        await db.initialize()
+
+        print(f"Seeding {args.jobs} jobs across {args.users} users...")
+        seed_database(db.db_path, args.jobs, args.users, args.pending_ratio)
+        # Planner statistics, as the maintenance task would have them
+        await db.optimize()
+
+        latencies = defaultdict(list)
+        instrument(db, latencies)
+        storage = StorageManager(temp_dir=str(Path(work_dir) / 'temp'), min_free_space=0)
+        queue = QueueManager(db, NoopProcessor(args.progress_ticks), NoopUploader(), storage)
+        await queue.view.load()
+
+        rng = random.Random(7)
+        counter = defaultdict(int)
+        start = time.perf_counter()
+        deadline = start + args.seconds
+        tasks = (
+            [enqueue_load(queue, args.users, deadline, rng, counter) for _ in range(args.enqueuers)] +
+            [worker_load(queue, deadline, counter) for _ in range(args.workers)] +
+            [reader_load(queue, args.users, deadline, rng, counter) for _ in range(args.readers)]
+        )
+        await asyncio.gather(*tasks)
+        # Let fire-and-forget progress writes finish before the database goes away
+        await asyncio.sleep(0.5)
+        elapsed = time.perf_counter() - start
+
+    print(f"\nRan for {elapsed:.1f}s: {counter['enqueued']} enqueued, "
+          f"{counter['processed']} processed, {counter['queries']} user queries")
+    print(f"{'operation':<32} {'calls':>8} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name in TIMED_OPERATIONS:
+        samples = latencies.get(name)
+        if not samples:
+            continue
+        print(f"{name:<32} {len(samples):>8} {len(samples) / elapsed:>9.1f} "
+              f"{percentile(samples, 50) * 1000:>9.2f} {percentile(samples, 99) * 1000:>9.2f} "
+              f"{max(samples) * 1000:>9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=20000, help='Jobs to seed')
+    parser.add_argument('--users', type=int, default=2000, help='Users to seed')
+    parser.add_argument('--pending-ratio', type=float, default=0.05, help='Fraction of seeded jobs left pending')
+    parser.add_argument('--seconds', type=float, default=20, help='Duration of the concurrent phase')
+    parser.add_argument('--enqueuers', type=int, default=2, help='Concurrent enqueue loops')
+    parser.add_argument('--workers', type=int, default=2, help='Concurrent claim/process loops')
+    parser.add_argument('--readers', type=int, default=4, help='Concurrent user query loops')
+    parser.add_argument('--progress-ticks', type=int, default=10, help='Progress updates per processed job')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Parallel part upload benchmark against a local fake Telegram endpoint.
+
+Writes a throwaway file and uploads it through MultipartUpload with each
+combination of parallelism, part size and connection count. Each fake
+connection adds a round trip per part and sends parts one at a time at a
+fixed bandwidth, and a share of the requests fails to exercise retries.
+Every upload is reassembled on the fake side and checked against the
+file, so only the part scheduling is measured.
+
+    python benchmarks/upload_benchmark.py --size-mb 256 --parallelism 1,4,8 --connections 1,2
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from multipart_upload import MultipartUpload  # noqa: E402
+
+class FakeEndpoint:
+    """Collects the parts of uploaded files, like upload.saveBigFilePart"""
+
+    def __init__(self, failure_rate: float, rng: random.Random):
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.files: Dict[int, Dict[int, bytes]] = {}
+        self.total_parts: Dict[int, int] = {}
+        self.requests = 0
+        self.failures = 0
+
+    def save(self, request) -> bool:
+        self.requests += 1
+        if self.rng.random() < self.failure_rate:
+            self.failures += 1
+            raise ConnectionError("fake connection reset")
+        if self.total_parts.setdefault(request.file_id, request.file_total_parts) != request.file_total_parts:
+            return False
+        self.files.setdefault(request.file_id, {})[request.file_part] = request.bytes
+        return True
+
+    def digest(self, file_id: int) -> str:
+        parts = self.files.pop(file_id)
+        if sorted(parts) != list(range(self.total_parts.pop(file_id))):
+            raise AssertionError(f"file {file_id} is missing parts")
+        sha = hashlib.sha256()
+        for part in sorted(parts):
+            sha.update(parts[part])
+        return sha.hexdigest()
+
+class FakeConnection:
+    """One media session: parts go out one at a time, then wait a round trip for the answer"""
+
+    def __init__(self, endpoint: FakeEndpoint, rtt: float, bandwidth: float):
+        self.endpoint = endpoint
+        self.rtt = rtt
+        self.bandwidth = bandwidth
+        self.wire = asyncio.Lock()
+
+    async def invoke(self, request):
+        async with self.wire:
+            await asyncio.sleep(len(request.bytes) / self.bandwidth)
+        await asyncio.sleep(self.rtt)
+        return self.endpoint.save(request)
+
+def write_file(path: str, size: int):
+    chunk = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size // len(chunk)):
+            f.write(chunk)
+        f.write(chunk[:size % len(chunk)])
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def parse_ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item]
+
+async def run(args):
+    rng = random.Random(7)
+    endpoint = FakeEndpoint(args.failure_rate, rng)
+    with tempfile.TemporaryDirectory(prefix='upload_bench_') as work_dir:
+        path = str(Path(work_dir) / 'output.mp4')
+        print(f"Writing {args.size_mb} MiB test file...")
+        write_file(path, args.size_mb * 1024 * 1024)
+        expected = file_digest(path)
+
+        print(f"Per connection: {args.rtt * 1000:.0f} ms round trip, {args.bandwidth_mbps:g} Mbit/s, "
+              f"{args.failure_rate:.1%} failed requests\n")
+        print(f"{'parallel':>8} {'part KiB':>9} {'conns':>6} {'parts':>6} {'seconds':>8} {'MiB/s':>8} {'retries':>8}")
+        file_id = 0
+        for connections in parse_ints(args.connections):
+            for part_size in parse_ints(args.part_sizes):
+                for parallelism in parse_ints(args.parallelism):
+                    file_id += 1
+                    links = [
+                        FakeConnection(endpoint, args.rtt, args.bandwidth_mbps * 1_000_000 / 8)
+                        for _ in range(connections)
+                    ]
+                    upload = MultipartUpload([link.invoke for link in links], parallelism, part_size)
+                    failures = endpoint.failures
+                    stats = await upload.upload(path, file_id)
+                    if endpoint.digest(file_id) != expected:
+                        raise AssertionError("reassembled upload differs from the file")
+                    print(f"{parallelism:>8} {stats['part_size'] // 1024:>9} {connections:>6} {stats['parts']:>6} "
+                          f"{stats['seconds']:>8.2f} {stats['throughput'] / 2 ** 20:>8.2f} "
+                          f"{endpoint.failures - failures:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=64, help='Size of the uploaded file (MiB)')
+    parser.add_argument('--parallelism', default='1,2,4,8', help='Comma-separated parts in flight to try')
+    parser.add_argument('--part-sizes', default='131072,524288', help='Comma-separated part sizes (bytes) to try')
+    parser.add_argument('--connections', default='1,2', help='Comma-separated connection counts to try')
+    parser.add_argument('--rtt', type=float, default=0.05, help='Round trip per part (seconds)')
+    parser.add_argument('--bandwidth-mbps', type=float, default=200, help='Bandwidth per connection (Mbit/s)')
+    parser.add_argument('--failure-rate', type=float, default=0.01, help='Share of part requests that fail')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,246 @@
 import os
 import asyncio
-from pyrogram import Client
-from pyrogram.types import Message
-from typing import List, Tuple
+from pyrogram import Client, raw, types, utils as pyrogram_utils
+from pyrogram.session import Session
+from pyrogram.types import Message, InputMediaVideo
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 from pathlib import Path
+from pyrogram.errors import (
+    FloodWait, FilePartMissing, ChatWriteForbidden, ChatAdminRequired, ChannelPrivate, ChannelInvalid, PeerIdInvalid
+)
+from config import UPLOAD_PARALLELISM, UPLOAD_PART_SIZE, UPLOAD_CONNECTIONS
+from multipart_upload import MultipartUpload, BIG_FILE_SIZE, PART_ATTEMPTS, check_part_size
+from upload_pool import UploadPool
 from utils import format_bytes
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Telegram accepts at most 10 items per album
+MEDIA_GROUP_LIMIT = 10
+
+# Errors meaning an upload client can't post to a storage channel (not an admin, channel gone)
+CHANNEL_ERRORS = (ChatWriteForbidden, ChatAdminRequired, ChannelPrivate, ChannelInvalid, PeerIdInvalid)
+
 class ChannelUploader:
-    def __init__(self, app: Client, upload_channel_id: str):
+    """Transfers between Telegram and the storage channels; uploads are spread over a pool of bots and channels"""
+
+    def __init__(self, app: Client, upload_channel_id: str, upload_clients: List[Client] = (),
+                 storage_channels: List[str] = (), parallelism: int = UPLOAD_PARALLELISM,
+                 part_size: int = UPLOAD_PART_SIZE, connections: int = UPLOAD_CONNECTIONS):
+        if parallelism:
+            check_part_size(part_size)
         self.app = app
+        # Files over 10 MiB go through MultipartUpload; parallelism 0 leaves them to Pyrogram
+        self.parallelism = parallelism
+        self.part_size = part_size
+        self.connections = max(1, connections)
+        self.media_sessions: Dict[str, List[Session]] = {}  # client name -> open upload sessions
+        self.media_sessions_lock = asyncio.Lock()
         self.upload_channel_id = upload_channel_id
+        self.upload_clients = list(upload_clients)
+        self.pool = UploadPool(
+            [(client.name, client) for client in [app] + self.upload_clients],
+            [upload_channel_id] + [channel for channel in storage_channels if channel != upload_channel_id]
+        )
+
+    async def start_clients(self):
+        """Start the extra upload clients; one that fails to start is left out of the pool"""
+        for client in list(self.upload_clients):
+            try:
+                await client.start()
+                logger.info(f"Upload client {client.name} started")
+            except Exception as e:
+                logger.error(f"Upload client {client.name} failed to start, not using it: {e}")
+                self.upload_clients.remove(client)
+                self.pool.remove_client(client.name)
+
+    async def stop_clients(self):
+        """Close the upload media sessions and stop the extra upload clients"""
+        sessions = [session for client_sessions in self.media_sessions.values() for session in client_sessions]
+        self.media_sessions.clear()
+        await asyncio.gather(*(session.stop() for session in sessions), return_exceptions=True)
+        for client in self.upload_clients:
+            try:
+                await client.stop()
+            except Exception as e:
+                logger.warning(f"Upload client {client.name} did not stop cleanly: {e}")
 
-    async def upload_to_channel(self, file_path: str, caption: str = "", progress_callback=None) -> Message:
-        """Upload file to channel with progress tracking"""
+    async def _api_call(self, method: str, client: Client = None, **kwargs):
+        """Call a Client method (of ``app`` by default), counting calls and FloodWaits for metrics"""
+        metrics.TELEGRAM_CALLS.inc(method=method)
+        try:
+            return await getattr(client or self.app, method)(**kwargs)
+        except FloodWait:
+            metrics.TELEGRAM_FLOOD_WAITS.inc(method=method)
+            raise
+
+    async def download(self, file_id: str, file_path: str, progress=None) -> str:
+        """Download a user's file from Telegram"""
+        path = await self._api_call('download_media', message=file_id, file_name=file_path, progress=progress)
+        metrics.BYTES_IN.inc(os.path.getsize(path))
+        return path
+
+    async def download_head(self, message: Message, chunks: int = 1) -> bytes:
+        """Download the first ``chunks`` MiB of a message's file, for header-only probes"""
+        metrics.TELEGRAM_CALLS.inc(method='stream_media')
+        data = bytearray()
+        async for chunk in self.app.stream_media(message, limit=chunks):
+            data += chunk
+        metrics.BYTES_IN.inc(len(data))
+        return bytes(data)
+
+    async def upload_to_channel(self, file_path: str, caption: str = "", progress_callback=None,
+                                metadata: Optional[Dict] = None, placements: Optional[List[Dict]] = None) -> Message:
+        """Upload file to a storage channel picked from the pool, moving on after a FloodWait or channel error"""
         try:
             logger.info(f"Uploading to channel: {file_path}")
+            # Encoder metadata lets clients play and preview without waiting for Telegram to inspect the file
+            metadata = metadata or {}
+            tried_clients, tried_channels = [], []
+            while True:
+                client = self.pool.pick(self.pool.clients, tried_clients)
+                channel = self.pool.pick(self.pool.channels, tried_channels)
+                client.active += 1
+                channel.active += 1
+                try:
+                    if self.parallelism and os.path.getsize(file_path) > BIG_FILE_SIZE:
+                        message = await self._send_video_in_parts(
+                            client.value, channel.value, file_path, caption, metadata, progress_callback
+                        )
+                    else:
+                        message = await self._api_call(
+                            'send_video',
+                            client=client.value,
+                            chat_id=channel.value,
+                            video=file_path,
+                            caption=caption,
+                            duration=int(metadata.get('duration', 0)),
+                            width=metadata.get('width', 0),
+                            height=metadata.get('height', 0),
+                            thumb=metadata.get('thumbnail'),
+                            supports_streaming=True,
+                            progress=progress_callback
+                        )
+                    break
+                except FloodWait as e:
+                    self.pool.bench(client, e.value)
+                    tried_clients.append(client)
+                    if not self.pool.has_alternative(self.pool.clients, tried_clients):
+                        raise
+                    logger.warning(f"Upload client {client.name} must wait {e.value}s, trying another client")
+                except CHANNEL_ERRORS as e:
+                    self.pool.bench(channel)
+                    tried_channels.append(channel)
+                    if not self.pool.has_alternative(self.pool.channels, tried_channels):
+                        raise
+                    logger.warning(f"Client {client.name} can't post to channel {channel.name} ({e}), trying another channel")
+                finally:
+                    client.active -= 1
+                    channel.active -= 1
             
-            # Upload to channel
-            message = await self.app.send_video(
-                chat_id=self.upload_channel_id,
-                video=file_path,
-                caption=caption,
-                supports_streaming=True,
-                progress=progress_callback
-            )
+            self.pool.succeeded(client, channel)
+            metrics.BYTES_OUT.inc(os.path.getsize(file_path))
+            metrics.UPLOADS.inc(client=client.name, channel=channel.name)
+            logger.info(f"Uploaded successfully to channel {channel.name} via {client.name}. Message ID: {message.id}")
             
-            logger.info(f"Uploaded successfully to channel. Message ID: {message.id}")
+            # File IDs only work for the bot that fetched them; deliveries go through app
+            if client.value is not self.app:
+                message = await self._api_call('get_messages', chat_id=message.chat.id, message_ids=message.id)
+            if placements is not None:
+                placements.append({'message_id': message.id, 'channel': message.chat.id, 'client': client.name})
             return message
             
         except Exception as e:
             logger.error(f"Upload to channel failed: {e}")
             raise
 
-    async def upload_multiple_to_channel(self, file_paths: List[str], base_caption: str = "") -> List[Message]:
-        """Upload multiple files to channel"""
+    async def _upload_sessions(self, client: Client) -> List[Session]:
+        """Get ``client``'s upload media sessions, opening them on first use"""
+        async with self.media_sessions_lock:
+            sessions = self.media_sessions.get(client.name)
+            if sessions is None:
+                sessions = [
+                    Session(client, await client.storage.dc_id(), await client.storage.auth_key(),
+                            await client.storage.test_mode(), is_media=True)
+                    for _ in range(self.connections)
+                ]
+                try:
+                    await asyncio.gather(*(session.start() for session in sessions))
+                except BaseException:
+                    await asyncio.gather(*(session.stop() for session in sessions), return_exceptions=True)
+                    raise
+                self.media_sessions[client.name] = sessions
+            return sessions
+
+    async def _send_video_in_parts(self, client: Client, chat_id: Union[int, str], file_path: str, caption: str,
+                                   metadata: Dict, progress_callback=None) -> Message:
+        """What ``send_video`` does, with the file uploaded by ``MultipartUpload``"""
+        sessions = await self._upload_sessions(client)
+        file_id = client.rnd_id()
+        upload = MultipartUpload([session.invoke for session in sessions], self.parallelism, self.part_size)
+        metrics.TELEGRAM_CALLS.inc(method='save_big_file')
+        stats = await upload.upload(file_path, file_id, progress_callback)
+        metrics.UPLOAD_THROUGHPUT.observe(stats['throughput'])
+        logger.info(
+            f"Uploaded {file_path} in {stats['parts']} parts of {format_bytes(stats['part_size'])} "
+            f"({stats['parallelism']} in flight) in {stats['seconds']:.1f}s: {format_bytes(stats['throughput'])}/s"
+        )
+        
+        media = raw.types.InputMediaUploadedDocument(
+            mime_type=client.guess_mime_type(file_path) or 'video/mp4',
+            file=stats['input_file'],
+            thumb=await client.save_file(metadata.get('thumbnail')),
+            attributes=[
+                raw.types.DocumentAttributeVideo(
+                    supports_streaming=True,
+                    duration=int(metadata.get('duration', 0)),
+                    w=metadata.get('width', 0),
+                    h=metadata.get('height', 0)
+                ),
+                raw.types.DocumentAttributeFilename(file_name=os.path.basename(file_path))
+            ]
+        )
+        for attempt in range(PART_ATTEMPTS):
+            try:
+                result = await self._api_call(
+                    'invoke',
+                    client=client,
+                    query=raw.functions.messages.SendMedia(
+                        peer=await client.resolve_peer(chat_id),
+                        media=media,
+                        random_id=client.rnd_id(),
+                        **await pyrogram_utils.parse_text_entities(client, caption, None, None)
+                    )
+                )
+                break
+            except FilePartMissing as e:
+                if attempt == PART_ATTEMPTS - 1:
+                    raise
+                await upload.upload_parts(file_path, file_id, [e.value])
+        
+        for update in result.updates:
+            if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+                return await types.Message._parse(
+                    client, update.message, {user.id: user for user in result.users},
+                    {chat.id: chat for chat in result.chats}
+                )
+        raise ConnectionError(f"Telegram sent no message for {file_path}")
+
+    async def upload_multiple_to_channel(self, file_paths: List[str], base_caption: str = "",
+                                         metadata: Optional[List[Dict]] = None,
+                                         progress_callback=None, placements: Optional[List[Dict]] = None) -> List[Message]:
+        """Upload multiple files to channel, with optional per-file encoder ``metadata``"""
         messages = []
         
         for i, file_path in enumerate(file_paths):
             try:
                 caption = f"{base_caption}\n\nPart {i+1}/{len(file_paths)}"
-                message = await self.upload_to_channel(file_path, caption)
+                message = await self.upload_to_channel(
+                    file_path, caption, progress_callback, metadata=metadata[i] if metadata else None,
+                    placements=placements
+                )
                 messages.append(message)
             except Exception as e:
                 logger.error(f"Failed to upload {file_path}: {e}")
@@ -50,30 +248,70 @@ class ChannelUploader:
         
         return messages
 
-    async def get_file_from_channel(self, message_id: int) -> Message:
-        """Retrieve a file from channel by message ID"""
+    async def delete_from_channel(self, placements: List[Dict]):
+        """Delete messages recorded in ``placements``, each through the client that posted it"""
+        clients = {client.name: client.value for client in self.pool.clients}
+        grouped = {}
+        for placement in placements:
+            grouped.setdefault((placement['client'], placement['channel']), []).append(placement['message_id'])
+        for (client_name, channel), message_ids in grouped.items():
+            try:
+                await self._api_call(
+                    'delete_messages', client=clients.get(client_name, self.app), chat_id=channel, message_ids=message_ids
+                )
+            except Exception as e:
+                logger.error(f"Failed to delete messages {message_ids} from channel {channel}: {e}")
+
+    async def get_file_from_channel(self, message_id: int, channel_id: Union[int, str] = None) -> Message:
+        """Retrieve a file by message ID from a storage channel (the main one by default)"""
         try:
-            message = await self.app.get_messages(chat_id=self.upload_channel_id, message_ids=message_id)
+            message = await self._api_call(
+                'get_messages', chat_id=channel_id or self.upload_channel_id, message_ids=message_id
+            )
             return message
         except Exception as e:
             logger.error(f"Failed to retrieve message {message_id}: {e}")
             return None
 
-    async def send_from_channel_to_user(self, message: Message, user_chat_id: int, additional_caption: str = ""):
-        """Forward a message from channel to user"""
+    async def send_from_channel_to_user(self, message: Message, user_chat_id: int, additional_caption: str = "") -> Message:
+        """Copy a message from channel to user without re-uploading the file"""
         try:
-            if message.video:
-                await self.app.send_video(
-                    chat_id=user_chat_id,
-                    video=message.video.file_id,
-                    caption=f"{additional_caption}\n\nFrom channel: {message.caption or ''}" if additional_caption else message.caption
-                )
-            elif message.document:
-                await self.app.send_document(
-                    chat_id=user_chat_id,
-                    document=message.document.file_id,
-                    caption=f"{additional_caption}\n\nFrom channel: {message.caption or ''}" if additional_caption else message.caption
-                )
+            return await self._api_call(
+                'copy_message',
+                chat_id=user_chat_id,
+                from_chat_id=message.chat.id,
+                message_id=message.id,
+                caption=f"{additional_caption}\n\nFrom channel: {message.caption or ''}" if additional_caption else message.caption
+            )
         except Exception as e:
             logger.error(f"Failed to send from channel to user: {e}")
             raise
+
+    async def send_media_group_to_user(self, messages: List[Message], user_chat_id: int, additional_caption: str = "") -> List[Message]:
+        """Send several channel videos to user as albums, reusing their file IDs"""
+        if len(messages) == 1 or not all(message.video for message in messages):
+            sent = []
+            for message in messages:
+                sent.append(await self.send_from_channel_to_user(message, user_chat_id, additional_caption))
+            return sent
+        
+        try:
+            sent = []
+            for start in range(0, len(messages), MEDIA_GROUP_LIMIT):
+                media = [
+                    InputMediaVideo(
+                        message.video.file_id,
+                        # Telegram shows the first item's caption for the whole album
+                        caption=additional_caption if start == 0 and i == 0 else (message.caption or ""),
+                        width=message.video.width,
+                        height=message.video.height,
+                        duration=message.video.duration,
+                        supports_streaming=True
+                    )
+                    for i, message in enumerate(messages[start:start + MEDIA_GROUP_LIMIT])
+                ]
+                sent.extend(await self._api_call('send_media_group', chat_id=user_chat_id, media=media))
+            return sent
+        except Exception as e:
+            logger.error(f"Failed to send media group to user: {e}")
+            raise
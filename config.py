@@ -1,441 +1,107 @@
 import os
-import asyncio
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from video_processor import VideoProcessor
-from channel_uploader import ChannelUploader
-from utils import get_video_info, format_bytes, format_duration, format_queue_position, ensure_temp_dir
-from config import MAX_FILE_SIZE, SUPPORTED_FORMATS, UPLOAD_CHANNEL_ID, REQUIRE_AUTHENTICATION, QUEUE_LIMIT_PER_USER, RESOLUTIONS
-from database import DatabaseManager
-from auth_manager import AuthManager
-from queue_manager import QueueManager
-import logging
-from pathlib import Path
-
-logger = logging.getLogger(__name__)
-
-class MessageHandlers:
-    def __init__(self, app: Client, db_manager: DatabaseManager, auth_manager: AuthManager, queue_manager: QueueManager):
-        self.app = app
-        self.db = db_manager
-        self.auth = auth_manager
-        self.queue = queue_manager
-        self.processor = VideoProcessor()
-        self.uploader = ChannelUploader(app, UPLOAD_CHANNEL_ID)
-        self.active_progress_messages = {}  # Track progress messages
-
-    async def start_command(self, client: Client, message: Message):
-        """Handle /start command"""
-        # Register user
-        user_data = {
-            'id': message.from_user.id,
-            'username': message.from_user.username,
-            'first_name': message.from_user.first_name,
-            'last_name': message.from_user.last_name
-        }
-        await self.db.add_user(user_data)
-
-        # Check authorization
-        auth_status = await self.auth.get_authorization_status(message.from_user.id)
-        
-        welcome_text = f"""
-🎬 **Advanced Video Queue Processor Bot**
-
-🤖 **Features:**
-• Queue-based processing (no waiting in line)
-• Multi-resolution compression (1080p, 720p, 480p, 360p)
-• Large video support (up to 2GB)
-• Memory-efficient processing
-• Channel-based storage
-• Automatic delivery when complete• **Real-time progress updates: Processed 0% → 100%**
-
-{auth_status['message']}
-
-📝 **How it works:**
-1. Send any video file to the bot
-2. Job gets added to queue
-3. Bot processes with live progress updates
-4. Bot automatically sends processed video when done
-
-💡 **Commands:**
-• /start - Show this message
-• /help - Get help
-• /info - Get video information
-• /queue - Check your position in queue
-• /jobs - View your recent jobs
-• /progress - Check progress of your current jobs
-
-🔧 **Supported Formats:** MP4, AVI, MOV, MKV, WMV, FLV, WEBM
-        """
-        await message.reply_text(welcome_text, disable_web_page_preview=True)
-
-    async def progress_command(self, client: Client, message: Message):
-        """Handle /progress command - show progress of current jobs"""
-        user_jobs = await self.db.get_user_jobs(message.from_user.id)
-        
-        active_jobs = [job for job in user_jobs if job['status'] in ['processing', 'pending'] and job['progress'] < 100]
-        
-        if not active_jobs:
-            await message.reply_text("📊 No active jobs in progress. Send a video to start processing!")
-            return
-        
-        response = "📊 Your active jobs:\n\n"
-        for job in active_jobs:
-            progress_bar = "█" * int(job['progress']/5) + "░" * (20 - int(job['progress']/5))
-            response += f"Job #{job['id']}: {job['target_resolution']}\n"
-            response += f"Status: {job['status']}\n"
-            response += f"Progress: [{progress_bar}] {job['progress']:.1f}%\n"
-            response += f"Created: {job['created_at']}\n\n"
-        
-        await message.reply_text(response)
-
-    async def help_command(self, client: Client, message: Message):
-        """Handle /help command"""
-        help_text = """
-📚 **Help - Video Queue Processor Bot**
-
-**How It Works:**
-1. Upload video to bot
-2. Job enters processing queue3. Bot processes with live progress (0% → 100%)
-4. Bot automatically delivers processed video
-5. No need to wait around!
-
-**Progress Tracking:**
-• Real-time percentage updates
-• Visual progress bars
-• Live status updates
-• Progress command to check current jobs
-
-**Queue System:**
-• Jobs processed in order received
-• Limited concurrent processing
-• Automatic notifications when complete
-
-**Supported Formats:** MP4, AVI, MOV, MKV, WMV, FLV, WEBM
-
-**Compression Options:**
-• 1080p: Full HD, highest quality
-• 720p: HD, good balance
-• 480p: SD, smaller file
-• 360p: Low quality, smallest file
-
-**Commands:**
-• /progress - Check current job progress
-• /queue - Check your position in processing queue
-• /jobs - View your recent processing jobs
-
-**Limitations:**
-• Max file size: 2GB
-• Max duration: 1 hour
-• Queue limit: 5 jobs per user
-        """
-        await message.reply_text(help_text)
-
-    async def queue_command(self, client: Client, message: Message):
-        """Handle /queue command - show user's position in queue"""
-        pending_jobs = await self.db.get_pending_jobs()
-        user_jobs = [job for job in pending_jobs if job['user_id'] == message.from_user.id]
-        
-        if not user_jobs:
-            await message.reply_text("📋 Your queue is empty. Send a video to start processing!")
-            return
-        
-        response = "📋 Your jobs in queue:\n\n"
-        for job in user_jobs:
-            # Find position
-            position = None
-            for i, pending_job in enumerate(pending_jobs):
-                if pending_job['id'] == job['id']:                    position = i + 1
-                    break
-            
-            progress_bar = "█" * int(job['progress']/5) + "░" * (20 - int(job['progress']/5))
-            response += f"Job #{job['id']}: {job['target_resolution']}\n"
-            response += f"Status: {job['status']}\n"
-            response += f"Progress: [{progress_bar}] {job['progress']:.1f}%\n"
-            response += f"Position: {position}/{len(pending_jobs)}\n\n"
-        
-        await message.reply_text(response)
-
-    async def jobs_command(self, client: Client, message: Message):
-        """Handle /jobs command - show user's recent jobs"""
-        user_jobs = await self.db.get_user_jobs(message.from_user.id)
-        
-        if not user_jobs:
-            await message.reply_text("📋 You have no processing jobs yet. Send a video to start!")
-            return
-        
-        response = "📋 Your recent jobs:\n\n"
-        for job in user_jobs[:10]:  # Show last 10 jobs
-            progress_bar = "█" * int(job['progress']/5) + "░" * (20 - int(job['progress']/5))
-            response += f"Job #{job['id']}: {job['target_resolution']}\n"
-            response += f"Status: {job['status']}\n"
-            response += f"Progress: [{progress_bar}] {job['progress']:.1f}%\n"
-            response += f"Created: {job['created_at']}\n"
-            if job['completed_at']:
-                response += f"Completed: {job['completed_at']}\n"
-            response += "\n"
-        
-        await message.reply_text(response)
-
-    async def handle_video(self, client: Client, message: Message):
-        """Handle incoming video messages"""
-        # Check authorization
-        if REQUIRE_AUTHENTICATION:
-            auth_status = await self.auth.get_authorization_status(message.from_user.id)
-            if not auth_status['authorized']:
-                await message.reply_text(auth_status['message'])
-                return
-
-        if not (message.video or message.document):
-            return
-
-        # Register user if not already registered
-        user_data = {
-            'id': message.from_user.id,
-            'username': message.from_user.username,
-            'first_name': message.from_user.first_name,
-            'last_name': message.from_user.last_name        }
-        await self.db.add_user(user_data)
-
-        # Determine if it's a video or document
-        if message.video:
-            file_id = message.video.file_id
-            file_size = message.video.file_size
-            mime_type = message.video.mime_type
-            original_filename = f"video_{file_id}.mp4"
-        elif message.document and message.document.mime_type.startswith('video'):
-            file_id = message.document.file_id
-            file_size = message.document.file_size
-            mime_type = message.document.mime_type
-            original_filename = message.document.file_name or f"video_{file_id}.mp4"
-        else:
-            return
-
-        # Validate file size
-        if file_size > MAX_FILE_SIZE:
-            await message.reply_text(f"❌ File too large! Maximum size: {format_bytes(MAX_FILE_SIZE)}")
-            return
-
-        # Validate file format
-        ext = mime_type.split('/')[-1] if '/' in mime_type else 'unknown'
-        if ext not in SUPPORTED_FORMATS:
-            await message.reply_text(f"❌ Unsupported format: {ext}\nSupported: {', '.join(SUPPORTED_FORMATS)}")
-            return
-
-        # Check queue limit per user
-        user_queue_count = await self.db.get_user_queue_count(message.from_user.id)
-        if user_queue_count >= QUEUE_LIMIT_PER_USER:
-            await message.reply_text(f"❌ Queue limit reached! You can have max {QUEUE_LIMIT_PER_USER} jobs in queue.")
-            return
-
-        # Show options for resolution
-        keyboard = [
-            [
-                InlineKeyboardButton("1080p", callback_data="queue_1080p"),
-                InlineKeyboardButton("720p", callback_data="queue_720p")
-            ],
-            [
-                InlineKeyboardButton("480p", callback_data="queue_480p"),
-                InlineKeyboardButton("360p", callback_data="queue_360p")
-            ],
-            [
-                InlineKeyboardButton("All Resolutions", callback_data="queue_all")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-                await message.reply_text(
-            f"🎯 Choose compression resolution for your video:\n\n"
-            f"📁 File: {original_filename}\n"
-            f"📦 Size: {format_bytes(file_size)}\n\n"
-            f"Select an option below:",
-            reply_markup=reply_markup
-        )
-
-    async def process_video_selection(self, client: Client, callback_query):
-        """Handle compression selection and add to queue"""
-        data = callback_query.data
-        message = callback_query.message
-        original_message = callback_query.message.reply_to_message
-        
-        if not original_message or not (original_message.video or original_message.document):
-            await callback_query.answer("❌ No video found!", show_alert=True)
-            return
-
-        # Get file info
-        if original_message.video:
-            file_id = original_message.video.file_id
-            file_size = original_message.video.file_size
-            mime_type = original_message.video.mime_type
-            original_filename = f"video_{file_id}.mp4"
-        else:
-            file_id = original_message.document.file_id
-            file_size = original_message.document.file_size
-            mime_type = original_message.document.mime_type
-            original_filename = original_message.document.file_name or f"video_{file_id}.mp4"
-
-        # Validate file format
-        ext = mime_type.split('/')[-1] if '/' in mime_type else 'mp4'
-        if ext not in SUPPORTED_FORMATS:
-            await callback_query.answer(f"❌ Unsupported format: {ext}", show_alert=True)
-            return
-
-        # Determine target resolution
-        if data == "queue_all":
-            target_resolution = "all"
-        else:
-            target_resolution = data.replace("queue_", "")
-
-        try:
-            if target_resolution == "all":
-                # Add separate jobs for each resolution
-                job_ids = []
-                for res_name in RESOLUTIONS.keys():
-                    job_id = await self.queue.add_job(
-                        original_message.from_user.id,
-                        file_id,                        original_filename,
-                        file_size,
-                        res_name
-                    )
-                    job_ids.append(job_id)
-                
-                await callback_query.answer(f"✅ Added {len(job_ids)} jobs to queue!", show_alert=True)
-                
-                # Send confirmation message
-                await original_message.reply_text(
-                    f"✅ Added {len(job_ids)} jobs to queue!\n"
-                    f"Each resolution will be processed separately.\n"
-                    f"Use /progress to check status."
-                )
-            else:
-                # Add single job
-                job_id = await self.queue.add_job(
-                    original_message.from_user.id,
-                    file_id,
-                    original_filename,
-                    file_size,
-                    target_resolution
-                )
-                
-                # Get position in queue
-                position, total = await self.queue.get_user_queue_position(original_message.from_user.id, job_id)
-                
-                # Send progress message
-                progress_msg = await original_message.reply_text(
-                    f"✅ Added to queue! Position: {position}/{total}\n"
-                    f"🎯 Starting processing: 0% complete\n"
-                    f"📊 Progress: [░░░░░░░░░░░░░░░░░░░░] 0.0%\n"
-                    f"You'll receive the processed video automatically when ready."
-                )
-                
-                # Store progress message ID for updates
-                self.active_progress_messages[job_id] = progress_msg.id
-                
-                # Update progress periodically
-                await self.monitor_progress(job_id, original_message.from_user.id, progress_msg.id)
-                
-        except Exception as e:
-            logger.error(f"Error adding to queue: {e}")
-            await callback_query.answer(f"❌ Error adding to queue: {str(e)}", show_alert=True)
-
-    async def monitor_progress(self, job_id: int, user_id: int, progress_msg_id: int):
-        """Monitor and update progress message"""
-        try:
-            while True:
-                job = await self.db.get_job_by_id(job_id)                if not job:
-                    break
-                
-                if job['status'] == 'completed':
-                    # Update final progress message
-                    await self.app.edit_message_text(
-                        chat_id=user_id,
-                        message_id=progress_msg_id,
-                        text=(
-                            f"✅ Processing completed!\n"
-                            f"🎯 Status: 100% complete\n"
-                            f"📊 Progress: [████████████████████] 100.0%\n"
-                            f"Your video will be delivered shortly."
-                        )
-                    )
-                    break
-                elif job['status'] == 'failed':
-                    await self.app.edit_message_text(
-                        chat_id=user_id,
-                        message_id=progress_msg_id,
-                        text=(
-                            f"❌ Processing failed!\n"
-                            f"Error: {job['error_message']}\n"
-                            f"Please try again."
-                        )
-                    )
-                    break
-                else:
-                    # Update progress bar
-                    progress = job['progress']
-                    progress_bar = "█" * int(progress/5) + "░" * (20 - int(progress/5))
-                    
-                    await self.app.edit_message_text(
-                        chat_id=user_id,
-                        message_id=progress_msg_id,
-                        text=(
-                            f"🎯 Processing: {progress:.1f}% complete\n"
-                            f"📊 Progress: [{progress_bar}] {progress:.1f}%\n"
-                            f"Status: {job['status']}\n"
-                            f"Resolution: {job['target_resolution']}"
-                        )
-                    )
-                
-                await asyncio.sleep(5)  # Update every 5 seconds
-                
-        except Exception as e:
-            logger.error(f"Error monitoring progress: {e}")
-
-    async def info_command(self, client: Client, message: Message):
-        """Handle /info command - get video info without processing"""        if not message.reply_to_message or not (message.reply_to_message.video or message.reply_to_message.document):
-            await message.reply_text("❌ Reply to a video message to get its information.")
-            return
-
-        video_msg = message.reply_to_message
-        if video_msg.video:
-            file_id = video_msg.video.file_id
-            file_size = video_msg.video.file_size
-            mime_type = video_msg.video.mime_type
-        elif video_msg.document:
-            file_id = video_msg.document.file_id
-            file_size = video_msg.document.file_size
-            mime_type = video_msg.document.mime_type
-        else:
-            await message.reply_text("❌ This doesn't appear to be a video file.")
-            return
-
-        # Validate file type
-        ext = mime_type.split('/')[-1] if '/' in mime_type else 'unknown'
-        if ext not in SUPPORTED_FORMATS:
-            await message.reply_text(f"❌ Unsupported format: {ext}\nSupported: {', '.join(SUPPORTED_FORMATS)}")
-            return
-
-        # Download file temporarily
-        temp_path = self.processor.temp_dir / f"temp_info_{file_id}.{ext}"
-        try:
-            await message.reply_text("🔍 Analyzing video...")
-            await video_msg.download(str(temp_path))
-            
-            # Get video info
-            info = get_video_info(str(temp_path))
-            
-            info_text = f"""
-📊 **Video Information**
-
-📁 File Size: {format_bytes(file_size)}
-⏱️ Duration: {format_duration(info.get('duration', 0))}
-📏 Resolution: {info.get('width', 'Unknown')} x {info.get('height', 'Unknown')}
-🎞️ Codec: {info.get('codec', 'Unknown')}
-📊 Bit Rate: {info.get('bit_rate', 'Unknown')}
-            """
-            await message.reply_text(info_text)
-            
-        except Exception as e:
-            await message.reply_text(f"❌ Error analyzing video: {str(e)}")
-        finally:
-            # Cleanup
-            if temp_path.exists():
-                temp_path.unlink()
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Telegram credentials
+API_ID = os.getenv('API_ID')
+API_HASH = os.getenv('API_HASH')
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+SESSION_NAME = os.getenv('SESSION_NAME', 'queue_processor_session')
+
+# Private channel used as storage for processed videos
+UPLOAD_CHANNEL_ID = os.getenv('UPLOAD_CHANNEL_ID')
+
+# Upload pool (comma-separated): extra bots that upload and extra storage channels uploads are
+# spread over. Every bot, including BOT_TOKEN's, must be an admin of every storage channel.
+UPLOAD_BOT_TOKENS = os.getenv('UPLOAD_BOT_TOKENS', '')
+STORAGE_CHANNEL_IDS = os.getenv('STORAGE_CHANNEL_IDS', '')
+UPLOAD_COOLDOWN = int(os.getenv('UPLOAD_COOLDOWN', 300))  # seconds a channel that rejected an upload is skipped
+
+# Parallel part upload of files over 10 MiB (0 = Pyrogram's built-in upload)
+UPLOAD_PARALLELISM = int(os.getenv('UPLOAD_PARALLELISM', 8))  # parts in flight per file
+UPLOAD_PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', 512 * 1024))  # bytes, power of two from 1 KiB to 512 KiB
+UPLOAD_CONNECTIONS = int(os.getenv('UPLOAD_CONNECTIONS', 4))  # media sessions per upload client the parts are spread over
+
+# Limits
+MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 2 * 1024 * 1024 * 1024))  # 2GB
+MAX_DURATION = int(os.getenv('MAX_DURATION', 3600))  # 1 hour
+MAX_CONCURRENT_PROCESSES = int(os.getenv('MAX_CONCURRENT_PROCESSES', 2))
+QUEUE_LIMIT_PER_USER = int(os.getenv('QUEUE_LIMIT_PER_USER', 5))
+UPLOAD_SIZE_LIMIT = int(os.getenv('UPLOAD_SIZE_LIMIT', 2000 * 1024 * 1024))  # bytes per message; larger outputs are split
+
+# Admission control: encode cost is estimated from the duration before a job is offered
+ENCODE_SPEED = float(os.getenv('ENCODE_SPEED', 1.0))  # seconds of 1080p video encoded per second
+USER_COMPUTE_BUDGET = int(os.getenv('USER_COMPUTE_BUDGET', 0))  # encode seconds per user and window, 0 = unlimited
+COMPUTE_BUDGET_WINDOW = int(os.getenv('COMPUTE_BUDGET_WINDOW', 86400))  # seconds
+
+# Users whose recent jobs are kept in memory for /jobs, /progress and /queue
+JOB_VIEW_USERS = int(os.getenv('JOB_VIEW_USERS', 1000))
+
+# Storage
+TEMP_DIR = os.getenv('TEMP_DIR', './temp')
+TEMP_DISK_QUOTA = int(os.getenv('TEMP_DISK_QUOTA', 0))  # bytes, 0 = limited only by free space
+TEMP_MIN_FREE_SPACE = int(os.getenv('TEMP_MIN_FREE_SPACE', 1024 * 1024 * 1024))  # 1GB kept free
+TEMP_ORPHAN_TTL = int(os.getenv('TEMP_ORPHAN_TTL', 6 * 3600))  # seconds
+TEMP_SWEEP_INTERVAL = int(os.getenv('TEMP_SWEEP_INTERVAL', 600))  # seconds
+DATABASE_PATH = os.getenv('DATABASE_PATH', './database.db')
+FFMPEG_CAPABILITIES_CACHE = os.getenv('FFMPEG_CAPABILITIES_CACHE', './ffmpeg_capabilities.json')  # empty disables
+JOB_ARCHIVE_AGE = int(os.getenv('JOB_ARCHIVE_AGE', 7 * 86400))  # seconds after completion
+JOB_ARCHIVE_RETENTION = int(os.getenv('JOB_ARCHIVE_RETENTION', 0))  # seconds, 0 = keep forever
+DB_MAINTENANCE_INTERVAL = int(os.getenv('DB_MAINTENANCE_INTERVAL', 3600))  # seconds, 0 disables
+
+# Encoder speed policy: x264 presets get faster as backlog or wait exceed their SLOs
+ENCODER_PRESET = os.getenv('ENCODER_PRESET', 'medium')  # baseline x264 preset
+ENCODER_ADAPTIVE = os.getenv('ENCODER_ADAPTIVE', 'true').lower() == 'true'
+ENCODER_BACKLOG_SLO = int(os.getenv('ENCODER_BACKLOG_SLO', 10))  # pending jobs, 0 ignores backlog
+ENCODER_WAIT_SLO = int(os.getenv('ENCODER_WAIT_SLO', 900))  # seconds, 0 ignores wait
+ENCODER_CRF_STEP = int(os.getenv('ENCODER_CRF_STEP', 0))  # CRF added per step faster than baseline
+
+# Stall watchdog and retries of transient failures
+STALL_TIMEOUT = int(os.getenv('STALL_TIMEOUT', 300))  # seconds without progress before a stage is killed, 0 disables
+MAX_JOB_ATTEMPTS = int(os.getenv('MAX_JOB_ATTEMPTS', 3))  # attempts per job, including the first
+RETRY_BASE_DELAY = int(os.getenv('RETRY_BASE_DELAY', 60))  # seconds before the first retry, doubled per attempt
+RETRY_MAX_DELAY = int(os.getenv('RETRY_MAX_DELAY', 3600))  # seconds
+
+# Shutdown: running jobs get this long to finish before they are released back to pending
+SHUTDOWN_GRACE_PERIOD = int(os.getenv('SHUTDOWN_GRACE_PERIOD', 300))  # seconds, 0 releases at once
+
+# Preemption: admins' jobs run first and may requeue a running lower-priority job
+PREEMPTION = os.getenv('PREEMPTION', 'true').lower() == 'true'
+PREEMPT_MAX_PROGRESS = float(os.getenv('PREEMPT_MAX_PROGRESS', 50))  # percent; jobs further along finish
+MAX_PREEMPTIONS = int(os.getenv('MAX_PREEMPTIONS', 2))  # times one job may be requeued
+
+# Content-aware rate control from short sample encodes of the source
+CONTENT_ANALYSIS = os.getenv('CONTENT_ANALYSIS', 'true').lower() == 'true'
+ANALYSIS_SAMPLES = int(os.getenv('ANALYSIS_SAMPLES', 3))  # windows per source
+ANALYSIS_SAMPLE_SECONDS = float(os.getenv('ANALYSIS_SAMPLE_SECONDS', 2))  # seconds per window
+
+# Metrics endpoint (Prometheus text format); disabled when METRICS_PORT is 0
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Event loop diagnostics; a stall longer than the threshold logs the loop's stack (0 disables)
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', 0.5))  # seconds
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.1))  # seconds
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', 300))
+
+# Authentication (comma-separated user IDs)
+AUTHORIZED_USERS = os.getenv('AUTHORIZED_USERS', '')
+ADMIN_USERS = os.getenv('ADMIN_USERS', '')
+REQUIRE_AUTHENTICATION = os.getenv('REQUIRE_AUTHENTICATION', 'false').lower() == 'true'
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 300))  # seconds
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 10000))  # users
+
+# Accepted formats (MIME subtypes as reported by Telegram)
+SUPPORTED_FORMATS = [
+    'mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv', 'webm', 'm4v', '3gp',
+    'quicktime', 'x-matroska', 'x-msvideo', 'x-ms-wmv', 'x-flv', '3gpp'
+]
+
+# Output renditions
+RESOLUTIONS = {
+    '1080p': {'width': 1920, 'height': 1080, 'bitrate': '8M'},
+    '720p': {'width': 1280, 'height': 720, 'bitrate': '5M'},
+    '480p': {'width': 854, 'height': 480, 'bitrate': '3M'},
+    '360p': {'width': 640, 'height': 360, 'bitrate': '1.5M'}
+}
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import re
+from typing import Dict, List, Optional
+import ffmpeg
+from utils import kill_process
+from config import CONTENT_ANALYSIS, ANALYSIS_SAMPLES, ANALYSIS_SAMPLE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Sample encodes run at this height with a fixed CRF, so sizes are comparable across titles
+ANALYSIS_HEIGHT = 360
+REFERENCE_CRF = 23
+
+# Inter/intra frame size ratio below which content is treated as static (screen recordings, slides)
+STATIC_TEMPORAL = 0.03
+# Intra bits per pixel below which content is treated as spatially simple
+SIMPLE_SPATIAL = 0.1
+
+# CRF added for easy content, on top of the rendition's base CRF
+STATIC_CRF_OFFSET = 3
+SIMPLE_CRF_OFFSET = 1
+
+# Bitrate cap relative to the predicted rate (the pixel scaling underestimates
+# detailed content at higher resolutions), and never below this
+CAP_HEADROOM = 2.5
+MIN_MAXRATE = 250_000  # bits/s
+
+FRAME_STATS = re.compile(r'frame ([IPB]):(\d+)\s+Avg QP:\s*[\d.]+\s+size:\s*(\d+)')
+
+def parse_bitrate(bitrate: str) -> int:
+    """Convert an FFmpeg bitrate string such as '1.5M' or '800k' to bits/s"""
+    units = {'k': 1_000, 'M': 1_000_000}
+    if bitrate and bitrate[-1] in units:
+        return int(float(bitrate[:-1]) * units[bitrate[-1]])
+    return int(float(bitrate))
+
+class ContentAnalyzer:
+    """Estimate spatial and temporal complexity of a source from the frame sizes of a few short sample encodes"""
+
+    def __init__(self, enabled: bool = CONTENT_ANALYSIS, samples: int = ANALYSIS_SAMPLES,
+                 sample_seconds: float = ANALYSIS_SAMPLE_SECONDS):
+        self.enabled = enabled
+        self.samples = max(1, samples)
+        self.sample_seconds = sample_seconds
+
+    def sample_windows(self, duration: float) -> List[tuple]:
+        """Get (start, length) of the windows to sample, spread over the source"""
+        if duration <= 0 or duration <= self.samples * self.sample_seconds:
+            return [(0.0, min(duration, self.samples * self.sample_seconds) or self.sample_seconds)]
+        return [
+            (duration * (i + 1) / (self.samples + 1) - self.sample_seconds / 2, self.sample_seconds)
+            for i in range(self.samples)
+        ]
+
+    async def analyze(self, input_path: str, video_info: Dict) -> Optional[Dict]:
+        """Measure spatial and temporal complexity; None if disabled or it failed"""
+        if not self.enabled:
+            return None
+
+        width, height = video_info.get('width') or 16, video_info.get('height') or 9
+        analysis_width = max(2, round(ANALYSIS_HEIGHT * width / height / 2) * 2)
+        pixels = analysis_width * ANALYSIS_HEIGHT
+
+        frames = {'I': [0, 0], 'P': [0, 0], 'B': [0, 0]}  # type -> [count, total bytes]
+        seconds = 0.0
+        try:
+            for start, length in self.sample_windows(video_info.get('duration', 0)):
+                for frame_type, count, size in await self._sample(input_path, start, length, analysis_width):
+                    frames[frame_type][0] += count
+                    frames[frame_type][1] += count * size
+                seconds += length
+        except Exception as e:
+            logger.warning(f"Content analysis failed, using default rate control: {e}")
+            return None
+
+        intra_count, intra_bytes = frames['I']
+        inter_count = frames['P'][0] + frames['B'][0]
+        inter_bytes = frames['P'][1] + frames['B'][1]
+        if not intra_count:
+            return None
+
+        intra_size = intra_bytes / intra_count
+        return {
+            'spatial': round(intra_size * 8 / pixels, 4),  # intra bits per pixel: detail and texture
+            'temporal': round((inter_bytes / inter_count) / intra_size, 4) if inter_count else 0.0,  # motion
+            'bitrate': int((intra_bytes + inter_bytes) * 8 / seconds),  # at the reference CRF and analysis size
+            'pixels': pixels
+        }
+
+    async def _sample(self, input_path: str, start: float, length: float, width: int) -> List[tuple]:
+        """Encode one window and return x264's (frame type, count, avg size) lines"""
+        cmd = (
+            ffmpeg.input(input_path, ss=max(0.0, start), t=length)
+            .filter('scale', width, ANALYSIS_HEIGHT)
+            .output('-', format='null', vcodec='libx264', preset='veryfast', crf=REFERENCE_CRF, an=None, threads=2)
+            .global_args('-nostats', '-loglevel', 'info')
+            .compile()
+        )
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            await kill_process(process)
+            raise
+        if process.returncode != 0:
+            raise Exception(f"sample encode exited with {process.returncode}")
+        return [
+            (frame_type, int(count), int(size))
+            for frame_type, count, size in FRAME_STATS.findall(stderr.decode(errors='replace'))
+        ]
+
+    def choose_rate_control(self, complexity: Optional[Dict], base_crf: int, bitrate: str,
+                            width: int, height: int) -> Dict:
+        """Pick CRF and a VBV cap for one rendition, easing simple content and never exceeding the ladder bitrate"""
+        ladder_rate = parse_bitrate(bitrate)
+        if not complexity:
+            return {'crf': base_crf, 'maxrate': ladder_rate, 'content_offset': 0}
+
+        offset = 0
+        if complexity['temporal'] < STATIC_TEMPORAL:
+            offset += STATIC_CRF_OFFSET
+        if complexity['spatial'] < SIMPLE_SPATIAL:
+            offset += SIMPLE_CRF_OFFSET
+        crf = base_crf + offset
+
+        # x264 roughly halves the rate every +6 CRF; scale by pixel count
+        predicted = complexity['bitrate'] * (width * height / complexity['pixels']) * 2 ** ((REFERENCE_CRF - crf) / 6)
+        maxrate = int(min(ladder_rate, max(MIN_MAXRATE, predicted * CAP_HEADROOM)))
+        return {'crf': crf, 'maxrate': maxrate, 'content_offset': offset}
@@ -1,18 +1,92 @@
 import aiosqlite
+import asyncio
+import json
+import math
 import sqlite3
+import time
 from typing import List, Dict, Optional
 import logging
-from config import DATABASE_PATH
+from config import DATABASE_PATH, JOB_ARCHIVE_AGE, JOB_ARCHIVE_RETENTION, DB_MAINTENANCE_INTERVAL
+from metrics import timed_sqlite
 
 logger = logging.getLogger(__name__)
 
+# Columns added to video_queue after the original schema, in creation order.
+# They are appended by ALTER TABLE so existing databases keep working.
+JOB_EXTRA_COLUMNS = [
+    ('channel_message_id', 'INTEGER'),
+    ('encoder_settings', 'TEXT'),
+    ('file_unique_id', 'TEXT'),
+    ('priority', 'INTEGER DEFAULT 0'),
+    ('attempts', 'INTEGER DEFAULT 0'),
+    ('retry_at', 'TIMESTAMP'),
+    ('estimated_cost', 'REAL'),
+    ('storage_messages', 'TEXT'),
+    ('delivered_at', 'TIMESTAMP')
+]
+
+# Statuses of jobs that will not run again
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+# Spelled out rather than bound: SQLite only uses a partial index when the query repeats its WHERE terms
+FINISHED_FILTER = f"status IN ({', '.join(repr(status) for status in FINISHED_STATUSES)})"
+
+# Claim order of the queue, served by idx_pending_priority
+PENDING_JOBS_QUERY = '''
+    SELECT * FROM video_queue
+    WHERE status = 'pending'
+    ORDER BY priority DESC, created_at ASC
+'''
+
+# Pipeline stages recorded in job_events, in pipeline order
+JOB_STAGES = ['queue_wait', 'download', 'encode', 'upload']
+
+# Rows moved or deleted per transaction during maintenance, so writers
+# on the hot path never wait long for the lock
+MAINTENANCE_BATCH = 500
+
+def _row_to_job(row) -> Dict:
+    """Convert a video_queue row into a job dict"""
+    return {
+        'id': row[0],
+        'user_id': row[1],
+        'file_id': row[2],
+        'original_filename': row[3],
+        'original_size': row[4],
+        'target_resolution': row[5],
+        'status': row[6],
+        'progress': row[7],
+        'error_message': row[8],
+        'created_at': row[9],
+        'started_at': row[10],
+        'completed_at': row[11],
+        'channel_message_id': row[12],
+        'encoder_settings': json.loads(row[13]) if row[13] else None,
+        'file_unique_id': row[14],
+        'priority': row[15] or 0,
+        'attempts': row[16] or 0,
+        'retry_at': row[17],
+        'estimated_cost': row[18],
+        'storage_messages': json.loads(row[19]) if row[19] else None,
+        'delivered_at': row[20]
+    }
+
 class DatabaseManager:
     def __init__(self):
         self.db_path = DATABASE_PATH
+        self.maintenance_task: Optional[asyncio.Task] = None
 
     async def initialize(self):
         """Initialize the database and create tables"""
         async with aiosqlite.connect(self.db_path) as db:
+            # Readers don't block the writer, and freed pages can be returned
+            # in small steps by the maintenance task
+            await db.execute('PRAGMA journal_mode=WAL')
+            cursor = await db.execute('PRAGMA auto_vacuum')
+            if (await cursor.fetchone())[0] != 2:
+                logger.info("Enabling incremental auto-vacuum (one-time VACUUM)")
+                await db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                await db.execute('VACUUM')
+            
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     id INTEGER PRIMARY KEY,
@@ -41,26 +115,152 @@ class DatabaseManager:
                 )
             ''')
             
+            added = await self._add_missing_columns(db, 'video_queue', JOB_EXTRA_COLUMNS)
+            if 'delivered_at' in added:
+                # Jobs that finished before deliveries were recorded have been sent already
+                await db.execute("UPDATE video_queue SET delivered_at = completed_at WHERE status = 'completed'")
+            # Jobs queued before file_unique_id existed are keyed by file_id
+            await db.execute('''
+                UPDATE video_queue SET file_unique_id = file_id
+                WHERE file_unique_id IS NULL AND status IN ('pending', 'processing')
+            ''')
+            
+            # Finished jobs older than JOB_ARCHIVE_AGE; same columns as video_queue
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS video_queue_archive (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    file_id TEXT,
+                    original_filename TEXT,
+                    original_size INTEGER,
+                    target_resolution TEXT,
+                    status TEXT,
+                    progress REAL,
+                    error_message TEXT,
+                    created_at TIMESTAMP,
+                    started_at TIMESTAMP,
+                    completed_at TIMESTAMP
+                )
+            ''')
+            
+            await self._add_missing_columns(db, 'video_queue_archive', JOB_EXTRA_COLUMNS)
+            
+            # Full-table status indexes are replaced by partial ones
+            for index in ('idx_status', 'idx_status_created', 'idx_user_id', 'idx_status_completed'):
+                await db.execute(f'DROP INDEX IF EXISTS {index}')
+            
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_pending_created ON video_queue(created_at)
+                WHERE status = 'pending'
+            ''')
+            
+            # Pending jobs are claimed highest priority first, then oldest first
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_pending_priority ON video_queue(priority DESC, created_at)
+                WHERE status = 'pending'
+            ''')
+            
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_active_user ON video_queue(user_id, status)
+                WHERE status IN ('pending', 'processing')
+            ''')
+            
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_user_created ON video_queue(user_id, created_at)
+            ''')
+            
+            # Finished jobs by age, for archiving; a full (status, completed_at) index
+            # would also match status = 'pending' and win over idx_pending_priority
+            await db.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_finished_completed ON video_queue(completed_at)
+                WHERE {FINISHED_FILTER}
+            ''')
+            
+            # Identical in-flight requests attach to one job (see add_jobs)
             await db.execute('''
-                CREATE INDEX IF NOT EXISTS idx_status ON video_queue(status)
+                CREATE INDEX IF NOT EXISTS idx_active_source ON video_queue(file_unique_id, target_resolution)
+                WHERE status IN ('pending', 'processing')
             ''')
             
             await db.execute('''
-                CREATE INDEX IF NOT EXISTS idx_user_id ON video_queue(user_id)
-            ''')            
+                CREATE TABLE IF NOT EXISTS job_subscribers (
+                    job_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    delivered_at TIMESTAMP,
+                    PRIMARY KEY (job_id, user_id)
+                )
+            ''')
+            
+            if await self._add_missing_columns(db, 'job_subscribers', [('delivered_at', 'TIMESTAMP')]):
+                await db.execute('''
+                    UPDATE job_subscribers SET delivered_at = CURRENT_TIMESTAMP WHERE job_id IN (
+                        SELECT id FROM video_queue WHERE status = 'completed'
+                        UNION ALL SELECT id FROM video_queue_archive
+                    )
+                ''')
+            
             await db.execute('''
-                CREATE INDEX IF NOT EXISTS idx_status_created ON video_queue(status, created_at)
+                CREATE INDEX IF NOT EXISTS idx_subscribers_user ON job_subscribers(user_id)
+            ''')
+            
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_archive_user_created ON video_queue_archive(user_id, created_at)
+            ''')
+            
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_archive_completed ON video_queue_archive(completed_at)
+            ''')
+            
+            # One row per finished pipeline stage of a job (unix timestamps)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL,
+                    stage TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    ended_at REAL NOT NULL,
+                    duration REAL NOT NULL,
+                    bytes INTEGER
+                )
+            ''')
+            
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_events_job ON job_events(job_id)
+            ''')
+            
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_events_stage_ended ON job_events(stage, ended_at)
             ''')
             
             await db.commit()
             logger.info("Database initialized successfully")
 
-    async def add_user(self, user_ Dict):
-        """Add or update user information"""
+    async def _add_missing_columns(self, db: aiosqlite.Connection, table: str, columns: List[tuple]) -> List[str]:
+        """Add columns that are missing from an existing table; returns the names added"""
+        cursor = await db.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in await cursor.fetchall()}
+        added = []
+        for name, definition in columns:
+            if name not in existing:
+                await db.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+                added.append(name)
+        return added
+
+    @timed_sqlite
+    async def add_user(self, user_data: Dict) -> bool:
+        """Add or update user information; True if the user is new or a profile field changed"""
         async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                INSERT OR REPLACE INTO users (id, username, first_name, last_name, is_authorized)
+            cursor = await db.execute('''
+                INSERT INTO users (id, username, first_name, last_name, is_authorized)
                 VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name
+                WHERE username IS NOT excluded.username
+                   OR first_name IS NOT excluded.first_name
+                   OR last_name IS NOT excluded.last_name
             ''', (
                 user_data['id'],
                 user_data.get('username'),
@@ -68,8 +268,12 @@ class DatabaseManager:
                 user_data.get('last_name'),
                 user_data.get('is_authorized', False)
             ))
+            if cursor.rowcount == 0:
+                return False
             await db.commit()
+            return True
 
+    @timed_sqlite
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user information"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -86,6 +290,7 @@ class DatabaseManager:
                 }
             return None
 
+    @timed_sqlite
     async def is_user_authorized(self, user_id: int) -> bool:
         """Check if user is authorized"""
         user = await self.get_user(user_id)
@@ -93,43 +298,134 @@ class DatabaseManager:
             return False
         return user.get('is_authorized', False)
 
-    async def add_to_queue(self, user_id: int, file_id: str, filename: str, size: int, resolution: str) -> int:
-        """Add video processing job to queue"""
+    @timed_sqlite
+    async def add_to_queue(self, user_id: int, file_id: str, filename: str, size: int, resolution: str,
+                           file_unique_id: str = None, priority: int = 0, estimated_cost: float = None) -> int:
+        """Add video processing job to queue (see ``add_jobs`` for deduplication)"""
         async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('''                INSERT INTO video_queue (user_id, file_id, original_filename, original_size, target_resolution)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, file_id, filename, size, resolution))
-            job_id = cursor.lastrowid
+            await db.execute('BEGIN IMMEDIATE')
+            job_id = await self._enqueue(db, {
+                'user_id': user_id, 'file_id': file_id, 'filename': filename, 'size': size,
+                'resolution': resolution, 'file_unique_id': file_unique_id, 'priority': priority,
+                'estimated_cost': estimated_cost
+            })
             await db.commit()
             return job_id
 
-    async def get_pending_jobs(self) -> List[Dict]:
-        """Get pending jobs ordered by creation time"""
+    @timed_sqlite
+    async def add_jobs(self, jobs: List[Dict]) -> List[int]:
+        """Add many jobs in a single transaction; returns the job ids (new or attached to) in input order"""
+        job_ids = []
         async with aiosqlite.connect(self.db_path) as db:
+            # Take the write lock up front so concurrent enqueues can't both miss the lookup
+            await db.execute('BEGIN IMMEDIATE')
+            for job in jobs:
+                job_ids.append(await self._enqueue(db, job))
+            await db.commit()
+        return job_ids
+
+    async def _enqueue(self, db: aiosqlite.Connection, job: Dict) -> int:
+        """Insert a job, or subscribe the user to an identical in-flight one"""
+        # file_id differs per recipient; file_unique_id identifies the file itself
+        source_key = job.get('file_unique_id') or job['file_id']
+        priority = job.get('priority', 0)
+        cursor = await db.execute('''
+            SELECT id, user_id FROM video_queue
+            WHERE file_unique_id = ? AND target_resolution = ? AND status IN ('pending', 'processing')
+            ORDER BY id LIMIT 1
+        ''', (source_key, job['resolution']))
+        existing = await cursor.fetchone()
+        if existing:
+            job_id, owner_id = existing
+            if owner_id != job['user_id']:
+                await db.execute(
+                    'INSERT OR IGNORE INTO job_subscribers (job_id, user_id) VALUES (?, ?)',
+                    (job_id, job['user_id'])
+                )
+            await db.execute(
+                'UPDATE video_queue SET priority = ? WHERE id = ? AND priority < ?', (priority, job_id, priority)
+            )
+            logger.info(f"User {job['user_id']} attached to in-flight job {job_id}")
+            return job_id
+        
+        cursor = await db.execute('''
+            INSERT INTO video_queue (user_id, file_id, original_filename, original_size, target_resolution,
+                                     file_unique_id, priority, estimated_cost)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (job['user_id'], job['file_id'], job['filename'], job['size'], job['resolution'], source_key, priority,
+              job.get('estimated_cost')))
+        return cursor.lastrowid
+
+    @timed_sqlite
+    async def get_job_subscribers(self, job_id: int) -> List[int]:
+        """Get users attached to a job besides its owner"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                'SELECT user_id FROM job_subscribers WHERE job_id = ? ORDER BY created_at', (job_id,)
+            )
+            return [row[0] for row in await cursor.fetchall()]
+
+    @timed_sqlite
+    async def remove_job_subscriber(self, job_id: int, user_id: int) -> bool:
+        """Detach a subscriber from a job; False if they were not subscribed"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                'DELETE FROM job_subscribers WHERE job_id = ? AND user_id = ?', (job_id, user_id)
+            )
+            await db.commit()
+            return cursor.rowcount == 1
+
+    @timed_sqlite
+    async def transfer_job_owner(self, job_id: int) -> Optional[int]:
+        """Hand an active job to its earliest subscriber; returns the new owner or None"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('BEGIN IMMEDIATE')
+            cursor = await db.execute(
+                'SELECT user_id FROM job_subscribers WHERE job_id = ? ORDER BY created_at LIMIT 1', (job_id,)
+            )
+            row = await cursor.fetchone()
+            if not row:
+                await db.rollback()
+                return None
             cursor = await db.execute('''
-                SELECT * FROM video_queue 
-                WHERE status = 'pending' 
-                ORDER BY created_at ASC
-            ''')
+                UPDATE video_queue SET user_id = ?
+                WHERE id = ? AND status IN ('pending', 'processing')
+            ''', (row[0], job_id))
+            if cursor.rowcount == 0:
+                await db.rollback()
+                return None
+            await db.execute('DELETE FROM job_subscribers WHERE job_id = ? AND user_id = ?', (job_id, row[0]))
+            await db.commit()
+            return row[0]
+
+    @timed_sqlite
+    async def get_pending_jobs(self) -> List[Dict]:
+        """Get pending jobs, highest priority first, then by creation time"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(PENDING_JOBS_QUERY)
             rows = await cursor.fetchall()
-            return [
-                {
-                    'id': row[0],
-                    'user_id': row[1],
-                    'file_id': row[2],
-                    'original_filename': row[3],
-                    'original_size': row[4],
-                    'target_resolution': row[5],
-                    'status': row[6],
-                    'progress': row[7],
-                    'error_message': row[8],
-                    'created_at': row[9],
-                    'started_at': row[10],
-                    'completed_at': row[11]
-                }
-                for row in rows
-            ]
+            return [_row_to_job(row) for row in rows]
+
+    @timed_sqlite
+    async def get_active_jobs(self) -> List[Dict]:
+        """Get all pending and processing jobs"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT * FROM video_queue WHERE status IN ('pending', 'processing')"
+            )
+            return [_row_to_job(row) for row in await cursor.fetchall()]
 
+    @timed_sqlite
+    async def get_jobs(self, job_ids: List[int]) -> List[Dict]:
+        """Get several jobs by ID (active table only), in no particular order"""
+        if not job_ids:
+            return []
+        async with aiosqlite.connect(self.db_path) as db:
+            placeholders = ', '.join('?' * len(job_ids))
+            cursor = await db.execute(f'SELECT * FROM video_queue WHERE id IN ({placeholders})', job_ids)
+            return [_row_to_job(row) for row in await cursor.fetchall()]
+
+    @timed_sqlite
     async def get_user_queue_count(self, user_id: int) -> int:
         """Get number of jobs in queue for a user"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -140,27 +436,87 @@ class DatabaseManager:
             count = await cursor.fetchone()
             return count[0]
 
+    @timed_sqlite
+    async def get_user_compute_used(self, user_id: int, window: int) -> float:
+        """Get the estimated encode seconds of jobs a user queued in the last ``window`` seconds"""
+        async with aiosqlite.connect(self.db_path) as db:
+            # Cancelled jobs are refunded; the rest counts whether it finished or not
+            cursor = await db.execute('''
+                SELECT COALESCE(SUM(estimated_cost), 0) FROM video_queue
+                WHERE user_id = ? AND created_at >= datetime('now', ?) AND status != 'cancelled'
+            ''', (user_id, f'-{window} seconds'))
+            return (await cursor.fetchone())[0]
+
+    @timed_sqlite
     async def get_job_by_id(self, job_id: int) -> Optional[Dict]:
         """Get job by ID"""
         async with aiosqlite.connect(self.db_path) as db:
             cursor = await db.execute('SELECT * FROM video_queue WHERE id = ?', (job_id,))
             row = await cursor.fetchone()
-            if row:                return {
-                    'id': row[0],
-                    'user_id': row[1],
-                    'file_id': row[2],
-                    'original_filename': row[3],
-                    'original_size': row[4],
-                    'target_resolution': row[5],
-                    'status': row[6],
-                    'progress': row[7],
-                    'error_message': row[8],
-                    'created_at': row[9],
-                    'started_at': row[10],
-                    'completed_at': row[11]
-                }
+            if not row:
+                cursor = await db.execute('SELECT * FROM video_queue_archive WHERE id = ?', (job_id,))
+                row = await cursor.fetchone()
+            if row:
+                return _row_to_job(row)
             return None
 
+    @timed_sqlite
+    async def claim_job(self, job_id: int) -> bool:
+        """Atomically move a pending job to processing; False if another worker got it first"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                UPDATE video_queue SET status = 'processing', progress = 0.0, started_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'pending'
+            ''', (job_id,))
+            await db.commit()
+            return cursor.rowcount == 1
+
+    @timed_sqlite
+    async def release_processing_jobs(self) -> int:
+        """Put every processing job back in the queue; returns how many there were"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                UPDATE video_queue SET status = 'pending', progress = 0.0, started_at = NULL
+                WHERE status = 'processing'
+            ''')
+            await db.commit()
+            return cursor.rowcount
+
+    @timed_sqlite
+    async def cancel_pending_job(self, job_id: int, reason: str) -> bool:
+        """Cancel a job that no worker has claimed; False if it is no longer pending"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                UPDATE video_queue SET status = 'cancelled', error_message = ?, completed_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'pending'
+            ''', (reason, job_id))
+            await db.commit()
+            return cursor.rowcount == 1
+
+    @timed_sqlite
+    async def requeue_job(self, job_id: int) -> bool:
+        """Put a processing job back in the queue, keeping its place by creation time"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                UPDATE video_queue SET status = 'pending', progress = 0.0, started_at = NULL
+                WHERE id = ? AND status = 'processing'
+            ''', (job_id,))
+            await db.commit()
+            return cursor.rowcount == 1
+
+    @timed_sqlite
+    async def retry_job(self, job_id: int, delay: float, error: str) -> bool:
+        """Put a failed processing job back in the queue, claimable after ``delay`` seconds"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                UPDATE video_queue SET status = 'pending', progress = 0.0, started_at = NULL,
+                    attempts = attempts + 1, retry_at = datetime('now', ?), error_message = ?
+                WHERE id = ? AND status = 'processing'
+            ''', (f'+{int(delay)} seconds', error, job_id))
+            await db.commit()
+            return cursor.rowcount == 1
+
+    @timed_sqlite
     async def update_job_status(self, job_id: int, status: str, progress: float = None, error: str = None):
         """Update job status"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -179,45 +535,312 @@ class DatabaseManager:
                 params.append(error)
             
             if status == 'processing':
-                update_fields.append('started_at = CURRENT_TIMESTAMP')
-            elif status in ['completed', 'failed']:
+                # Keep the original start time across progress updates
+                update_fields.append('started_at = COALESCE(started_at, CURRENT_TIMESTAMP)')
+            elif status in FINISHED_STATUSES:
                 update_fields.append('completed_at = CURRENT_TIMESTAMP')
             
             query = f"UPDATE video_queue SET {', '.join(update_fields)} WHERE id = ?"
             params.append(job_id)
+            if status == 'processing':
+                # A late progress report must not revive a cancelled or requeued job
+                query += " AND status = 'processing'"
             
             await db.execute(query, params)
             await db.commit()
 
-    async def get_user_jobs(self, user_id: int) -> List[Dict]:
-        """Get all jobs for a user"""
+    @timed_sqlite
+    async def get_user_jobs(self, user_id: int, limit: int = 20) -> List[Dict]:
+        """Get a user's most recent jobs, owned or subscribed, topped up from the archive"""
         async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('''
-                SELECT * FROM video_queue 
-                WHERE user_id = ?                 ORDER BY created_at DESC
-                LIMIT 20
-            ''', (user_id,))
-            rows = await cursor.fetchall()
-            return [
-                {
-                    'id': row[0],
-                    'user_id': row[1],
-                    'file_id': row[2],
-                    'original_filename': row[3],
-                    'original_size': row[4],
-                    'target_resolution': row[5],
-                    'status': row[6],
-                    'progress': row[7],
-                    'error_message': row[8],
-                    'created_at': row[9],
-                    'started_at': row[10],
-                    'completed_at': row[11]
-                }
-                for row in rows
-            ]
+            rows = []
+            for table in ('video_queue', 'video_queue_archive'):
+                cursor = await db.execute(f'''
+                    SELECT * FROM {table} WHERE user_id = ?
+                    UNION ALL
+                    SELECT {table}.* FROM {table}
+                    JOIN job_subscribers ON job_subscribers.job_id = {table}.id
+                    WHERE job_subscribers.user_id = ?
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                ''', (user_id, user_id, limit - len(rows)))
+                rows += await cursor.fetchall()
+                if len(rows) >= limit:
+                    break
+            return [_row_to_job(row) for row in rows]
 
+    @timed_sqlite
     async def authorize_user(self, user_id: int, authorized: bool = True):
         """Authorize or unauthorize a user"""
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute('UPDATE users SET is_authorized = ? WHERE id = ?', (authorized, user_id))
             await db.commit()
+
+    @timed_sqlite
+    async def set_job_channel_message(self, job_id: int, channel_message_id: int, storage_messages: List[Dict] = None):
+        """Record a job's first channel message and all of its ``storage_messages`` (message_id, channel, client)"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                'UPDATE video_queue SET channel_message_id = ?, storage_messages = ? WHERE id = ?',
+                (channel_message_id, json.dumps(storage_messages) if storage_messages else None, job_id)
+            )
+            await db.commit()
+
+    @timed_sqlite
+    async def get_undelivered_jobs(self) -> List[tuple]:
+        """Get (user_id, job) for completed jobs not yet sent to their owner or a subscriber, oldest first"""
+        async with aiosqlite.connect(self.db_path) as db:
+            # Jobs archived after JOB_ARCHIVE_AGE are not sent anymore
+            cursor = await db.execute('''
+                SELECT user_id, * FROM video_queue WHERE status = 'completed' AND delivered_at IS NULL
+                UNION ALL
+                SELECT s.user_id, q.* FROM job_subscribers s JOIN video_queue q ON q.id = s.job_id
+                WHERE q.status = 'completed' AND s.delivered_at IS NULL
+                ORDER BY completed_at, id
+            ''')
+            return [(row[0], _row_to_job(row[1:])) for row in await cursor.fetchall()]
+
+    @timed_sqlite
+    async def mark_jobs_delivered(self, user_id: int, job_ids: List[int]):
+        """Record that the output of jobs was sent to a user, as owner or subscriber"""
+        async with aiosqlite.connect(self.db_path) as db:
+            placeholders = ', '.join('?' * len(job_ids))
+            await db.execute(f'''
+                UPDATE video_queue SET delivered_at = CURRENT_TIMESTAMP
+                WHERE user_id = ? AND id IN ({placeholders})
+            ''', [user_id] + job_ids)
+            await db.execute(f'''
+                UPDATE job_subscribers SET delivered_at = CURRENT_TIMESTAMP
+                WHERE user_id = ? AND job_id IN ({placeholders})
+            ''', [user_id] + job_ids)
+            await db.commit()
+
+    @timed_sqlite
+    async def set_job_encoder_settings(self, job_id: int, settings: Dict):
+        """Record the encoder preset/CRF decision made for a job"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('UPDATE video_queue SET encoder_settings = ? WHERE id = ?', (json.dumps(settings), job_id))
+            await db.commit()
+
+    @timed_sqlite
+    async def get_pending_summary(self) -> Dict:
+        """Get the number of pending jobs and the oldest pending submission time"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                SELECT COUNT(*), MIN(created_at) FROM video_queue WHERE status = 'pending'
+            ''')
+            count, oldest = await cursor.fetchone()
+            return {'count': count, 'oldest_created_at': oldest}
+
+    @timed_sqlite
+    async def get_active_job_count_for_file(self, user_id: int, file_unique_id: str) -> int:
+        """Get number of pending or processing jobs of one source file a user owns or is subscribed to"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                SELECT COUNT(*) FROM video_queue 
+                WHERE file_unique_id = ? AND status IN ('pending', 'processing')
+                  AND (user_id = ? OR id IN (SELECT job_id FROM job_subscribers WHERE user_id = ?))
+            ''', (file_unique_id, user_id, user_id))
+            count = await cursor.fetchone()
+            return count[0]
+
+    @timed_sqlite
+    async def get_status_counts(self) -> Dict[str, int]:
+        """Get number of jobs per status"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('SELECT status, COUNT(*) FROM video_queue GROUP BY status')
+            return {status: count for status, count in await cursor.fetchall()}
+
+    @timed_sqlite
+    async def add_job_event(self, job_id: int, stage: str, started_at: float, ended_at: float, bytes_count: int = None):
+        """Record a finished stage of a job"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                INSERT INTO job_events (job_id, stage, started_at, ended_at, duration, bytes)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (job_id, stage, started_at, ended_at, ended_at - started_at, bytes_count))
+            await db.commit()
+
+    @timed_sqlite
+    async def get_job_events(self, job_ids: List[int]) -> Dict[int, List[Dict]]:
+        """Get the stage timeline of several jobs"""
+        if not job_ids:
+            return {}
+        async with aiosqlite.connect(self.db_path) as db:
+            placeholders = ', '.join('?' * len(job_ids))
+            cursor = await db.execute(f'''
+                SELECT job_id, stage, started_at, ended_at, duration, bytes FROM job_events
+                WHERE job_id IN ({placeholders})
+                ORDER BY started_at
+            ''', job_ids)
+            events = {}
+            for job_id, stage, started_at, ended_at, duration, bytes_count in await cursor.fetchall():
+                events.setdefault(job_id, []).append({
+                    'stage': stage,
+                    'started_at': started_at,
+                    'ended_at': ended_at,
+                    'duration': duration,
+                    'bytes': bytes_count
+                })
+            return events
+
+    @timed_sqlite
+    async def get_stage_percentiles(self, since: float, percentiles: tuple = (50, 90, 99)) -> Dict[str, Dict]:
+        """Get run counts and duration percentiles per stage, ``{stage: {'count': n, 'percentiles': {pct: seconds}}}``, since ``since``"""
+        async with aiosqlite.connect(self.db_path) as db:
+            stats = {}
+            for stage in JOB_STAGES:
+                # Range scan on idx_events_stage_ended; the nearest-rank row of each percentile
+                cursor = await db.execute(f'''
+                    WITH ranked AS (
+                        SELECT duration,
+                               ROW_NUMBER() OVER (ORDER BY duration) - 1 AS position,
+                               COUNT(*) OVER () AS count
+                        FROM job_events
+                        WHERE stage = ? AND ended_at >= ?
+                    ),
+                    wanted (pct) AS (VALUES {', '.join('(?)' for _ in percentiles)})
+                    SELECT pct, duration, count FROM ranked JOIN wanted
+                    ON position = MIN(count - 1, CAST(count * pct / 100 AS INTEGER))
+                ''', (stage, since, *percentiles))
+                rows = await cursor.fetchall()
+                if rows:
+                    stats[stage] = {'count': rows[0][2], 'percentiles': {pct: duration for pct, duration, _ in rows}}
+            return stats
+
+    @timed_sqlite
+    async def get_slowest_jobs(self, hours: int = 24, limit: int = 5) -> List[Dict]:
+        """Get completed jobs, archived or not, with the longest submit-to-completion time"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('PRAGMA table_info(video_queue)')
+            columns = ', '.join(row[1] for row in await cursor.fetchall())
+            total_seconds = '(julianday(completed_at) - julianday(created_at)) * 86400'
+            # Each side is a range scan over the window (idx_finished_completed, idx_archive_completed)
+            cursor = await db.execute(f'''
+                SELECT {columns}, {total_seconds} AS total_seconds
+                FROM video_queue
+                WHERE {FINISHED_FILTER} AND status = 'completed' AND completed_at >= datetime('now', ?)
+                UNION ALL
+                SELECT {columns}, {total_seconds} AS total_seconds
+                FROM video_queue_archive
+                WHERE status = 'completed' AND completed_at >= datetime('now', ?)
+                ORDER BY total_seconds DESC
+                LIMIT ?
+            ''', (f'-{hours} hours', f'-{hours} hours', limit))
+            jobs = []
+            for row in await cursor.fetchall():
+                job = _row_to_job(row)
+                job['total_seconds'] = row[-1]
+                jobs.append(job)
+            return jobs
+
+    @timed_sqlite
+    async def archive_jobs(self, age: int = JOB_ARCHIVE_AGE) -> int:
+        """Move jobs that finished more than ``age`` seconds ago to the archive"""
+        moved = 0
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('PRAGMA table_info(video_queue)')
+            columns = ', '.join(row[1] for row in await cursor.fetchall())
+            while True:
+                cursor = await db.execute(f'''
+                    SELECT id FROM video_queue
+                    WHERE {FINISHED_FILTER} AND completed_at < datetime('now', ?)
+                    LIMIT ?
+                ''', (f'-{age} seconds', MAINTENANCE_BATCH))
+                job_ids = [row[0] for row in await cursor.fetchall()]
+                if not job_ids:
+                    break
+                placeholders = ', '.join('?' * len(job_ids))
+                await db.execute(f'''
+                    INSERT OR REPLACE INTO video_queue_archive ({columns})
+                    SELECT {columns} FROM video_queue WHERE id IN ({placeholders})
+                ''', job_ids)
+                await db.execute(f'DELETE FROM video_queue WHERE id IN ({placeholders})', job_ids)
+                await db.commit()
+                moved += len(job_ids)
+                await asyncio.sleep(0)
+        return moved
+
+    @timed_sqlite
+    async def purge_archive(self, retention: int = JOB_ARCHIVE_RETENTION) -> int:
+        """Delete archived jobs and stage events older than ``retention`` seconds"""
+        if not retention:
+            return 0
+        purged = 0
+        async with aiosqlite.connect(self.db_path) as db:
+            while True:
+                cursor = await db.execute('''
+                    DELETE FROM video_queue_archive WHERE id IN (
+                        SELECT id FROM video_queue_archive
+                        WHERE completed_at < datetime('now', ?)
+                        LIMIT ?
+                    )
+                ''', (f'-{retention} seconds', MAINTENANCE_BATCH))
+                await db.commit()
+                purged += cursor.rowcount
+                if cursor.rowcount < MAINTENANCE_BATCH:
+                    break
+                await asyncio.sleep(0)
+            await db.execute('DELETE FROM job_events WHERE ended_at < ?', (time.time() - retention,))
+            await db.execute('''
+                DELETE FROM job_subscribers WHERE job_id NOT IN (
+                    SELECT id FROM video_queue UNION ALL SELECT id FROM video_queue_archive
+                )
+            ''')
+            await db.commit()
+        return purged
+
+    @timed_sqlite
+    async def optimize(self):
+        """Refresh planner statistics, checkpoint the WAL and return free pages"""
+        async with aiosqlite.connect(self.db_path) as db:
+            # Partial indexes are only chosen once the planner has statistics
+            await db.execute('PRAGMA analysis_limit=1000')
+            await db.execute('ANALYZE')
+            await db.commit()
+            
+            cursor = await db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            busy, _, _ = await cursor.fetchone()
+            if busy:
+                logger.debug("WAL checkpoint could not complete; readers still active")
+            
+            cursor = await db.execute('PRAGMA auto_vacuum')
+            if (await cursor.fetchone())[0] != 2:
+                # Without incremental auto-vacuum the pragma is a no-op and the freelist never shrinks
+                logger.warning("Incremental auto-vacuum is off; free pages are not returned")
+                return
+            cursor = await db.execute('PRAGMA freelist_count')
+            free_pages = (await cursor.fetchone())[0]
+            # Bounded by today's freelist; pages freed meanwhile wait for the next run.
+            # executescript steps the pragma to the end: a single execute() step frees one page.
+            for _ in range(math.ceil(free_pages / MAINTENANCE_BATCH)):
+                await db.executescript(f'PRAGMA incremental_vacuum({MAINTENANCE_BATCH})')
+                await asyncio.sleep(0)
+
+    async def run_maintenance(self):
+        """Archive old jobs, apply retention and optimize the database file"""
+        moved = await self.archive_jobs()
+        purged = await self.purge_archive()
+        await self.optimize()
+        if moved or purged:
+            logger.info(f"Database maintenance: archived {moved} job(s), purged {purged}")
+
+    async def start_maintenance(self, interval: int = DB_MAINTENANCE_INTERVAL):
+        """Start the background maintenance task"""
+        if self.maintenance_task is None and interval > 0:
+            self.maintenance_task = asyncio.create_task(self._maintenance_loop(interval))
+
+    async def stop_maintenance(self):
+        """Stop the background maintenance task"""
+        if self.maintenance_task:
+            self.maintenance_task.cancel()
+            await asyncio.gather(self.maintenance_task, return_exceptions=True)
+            self.maintenance_task = None
+
+    async def _maintenance_loop(self, interval: int):
+        while True:
+            try:
+                await self.run_maintenance()
+            except Exception as e:
+                logger.error(f"Database maintenance failed: {e}")
+            await asyncio.sleep(interval)
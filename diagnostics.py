@@ -0,0 +1,109 @@
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import traceback
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+from config import LOOP_LAG_THRESHOLD, LOOP_LAG_INTERVAL, TEMP_DIR
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class LoopLagMonitor:
+    """Log the loop thread's stack whenever the event loop is blocked for longer than ``threshold`` seconds"""
+
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.heartbeat = time.monotonic()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stop_event.clear()
+        self.task = asyncio.create_task(self._beat())
+        self.thread = threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True)
+        self.thread.start()
+        logger.info(f"Event loop lag monitor started (threshold {self.threshold}s)")
+
+    async def stop(self):
+        self.stop_event.set()
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.thread:
+            await asyncio.to_thread(self.thread.join, 1)
+            self.thread = None
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            metrics.EVENT_LOOP_LAG.observe(max(0.0, now - expected))
+            self.heartbeat = now
+
+    def _watch(self):
+        stalled_since = None
+        while not self.stop_event.wait(self.interval):
+            blocked = time.monotonic() - self.heartbeat - self.interval
+            if blocked > self.threshold:
+                if stalled_since is None:
+                    stalled_since = self.heartbeat
+                    self._report_stall(blocked)
+            elif stalled_since is not None:
+                logger.warning(f"Event loop resumed after a stall of {time.monotonic() - stalled_since:.2f}s")
+                stalled_since = None
+
+    def _report_stall(self, blocked: float):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame else '<stack unavailable>\n'
+        task = asyncio.current_task(self.loop) if self.loop else None
+        task_name = f"{task.get_name()} ({task.get_coro().__qualname__})" if task else 'no running task'
+        logger.warning(
+            f"Event loop blocked for more than {blocked:.2f}s in {task_name}. "
+            f"Loop thread stack:\n{stack}"
+        )
+
+class Profiler:
+    """On-demand cProfile window over the event loop thread"""
+
+    def __init__(self, output_dir: str = TEMP_DIR):
+        self.output_dir = Path(output_dir)
+        self.running = False
+
+    async def profile(self, seconds: float, limit: int = 25) -> Tuple[str, str]:
+        """Profile the loop for ``seconds``; returns a summary of the hottest functions and the path of the .prof dump"""
+        if self.running:
+            raise RuntimeError("A profiling window is already running")
+
+        profile = cProfile.Profile()
+        self.running = True
+        # Enabled from a coroutine, so it hooks the loop thread itself
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self.running = False
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / f"profile_{int(time.time())}.prof"
+        profile.dump_stats(str(path))
+
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.strip_dirs().sort_stats('tottime').print_stats(limit)
+        return stream.getvalue(), str(path)
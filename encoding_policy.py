@@ -0,0 +1,58 @@
+import logging
+from typing import Dict, List
+from config import (
+    ENCODER_PRESET, ENCODER_ADAPTIVE, ENCODER_BACKLOG_SLO, ENCODER_WAIT_SLO, ENCODER_CRF_STEP
+)
+
+logger = logging.getLogger(__name__)
+
+# x264 presets from best compression to fastest encode
+PRESET_LADDER = ['slower', 'slow', 'medium', 'fast', 'faster', 'veryfast', 'superfast']
+
+# Below this fraction of both SLOs the system counts as idle
+IDLE_PRESSURE = 0.1
+
+class EncodingPolicy:
+    """Pick the x264 preset and CRF offset for a job from backlog and wait relative to their SLOs"""
+
+    def __init__(self, baseline: str = ENCODER_PRESET, adaptive: bool = ENCODER_ADAPTIVE,
+                 backlog_slo: int = ENCODER_BACKLOG_SLO, wait_slo: float = ENCODER_WAIT_SLO,
+                 crf_step: int = ENCODER_CRF_STEP, ladder: List[str] = PRESET_LADDER):
+        if baseline not in ladder:
+            raise ValueError(f"Unknown x264 preset: {baseline}")
+        self.ladder = ladder
+        self.baseline = ladder.index(baseline)
+        self.adaptive = adaptive
+        self.backlog_slo = backlog_slo
+        self.wait_slo = wait_slo
+        self.crf_step = crf_step
+
+    def pressure(self, backlog: int, wait: float) -> float:
+        ratios = []
+        if self.backlog_slo > 0:
+            ratios.append(backlog / self.backlog_slo)
+        if self.wait_slo > 0:
+            ratios.append(wait / self.wait_slo)
+        return max(ratios, default=0.0)
+
+    def decide(self, backlog: int, wait: float) -> Dict:
+        """Return the encoder settings for ``backlog`` pending jobs and the longest ``wait`` (seconds), and why"""
+        pressure = self.pressure(backlog, wait) if self.adaptive else 0.0
+        level = self.baseline
+        reason = 'baseline'
+        if self.adaptive:
+            if pressure >= 1:
+                level = min(len(self.ladder) - 1, self.baseline + int(pressure))
+                reason = 'over SLO'
+            elif pressure < IDLE_PRESSURE:
+                level = max(0, self.baseline - 1)
+                reason = 'idle'
+
+        return {
+            'preset': self.ladder[level],
+            'crf_offset': max(0, level - self.baseline) * self.crf_step,
+            'reason': reason,
+            'backlog': backlog,
+            'wait': round(wait, 1),
+            'pressure': round(pressure, 2)
+        }
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+from typing import Dict, List, Optional
+from config import FFMPEG_CAPABILITIES_CACHE, STALL_TIMEOUT
+from utils import kill_process
+
+logger = logging.getLogger(__name__)
+
+# Encoders and filters the encode pipeline (VideoProcessor, ContentAnalyzer) can't run without;
+# VideoProcessor falls back to the first frame for thumbnails without the thumbnail filter
+REQUIRED_ENCODERS = ('libx264', 'aac')
+REQUIRED_FILTERS = ('scale', 'split')
+
+# Encoders worth reporting even though nothing requires them yet
+OPTIONAL_ENCODERS = ('libx265', 'libsvtav1', 'libopus')
+
+VERSION = re.compile(r'version (\S+)')
+# " V....D libx264   libx264 H.264 ..." (the legend lines have '=' instead of a name)
+ENCODER_LINE = re.compile(r'^\s*([VAS])[F.][S.][X.][B.][D.]\s+(?!=)(\S+)', re.MULTILINE)
+# " TSC scale   V->V   Scale the input video size..." (older builds print two flag columns)
+FILTER_LINE = re.compile(r'^\s*[T.][S.][C.]?\s+(\S+)\s+\S*->\S*\s', re.MULTILINE)
+
+def _binary_key(name: str) -> Optional[Dict]:
+    """Identify an installed binary by resolved path, mtime and size; None if not on PATH"""
+    path = shutil.which(name)
+    if not path:
+        return None
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return {'path': path, 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+async def _run(binary: str, *args: str) -> str:
+    process = await asyncio.create_subprocess_exec(
+        binary, '-hide_banner', *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), STALL_TIMEOUT or None)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        await kill_process(process)
+        raise
+    return stdout.decode(errors='replace')
+
+async def _version(binary: str) -> str:
+    match = VERSION.search(await _run(binary, '-version'))
+    return match.group(1) if match else 'unknown'
+
+async def _discover(key: Dict) -> Dict:
+    """Run the (slow) probes; each one is a separate FFmpeg start, so run them together"""
+    ffmpeg_path = key['ffmpeg']['path']
+    ffprobe_path = key['ffprobe']['path'] if key['ffprobe'] else None
+    ffmpeg_version, ffprobe_version, encoders, filters = await asyncio.gather(
+        _version(ffmpeg_path),
+        _version(ffprobe_path) if ffprobe_path else asyncio.sleep(0),
+        _run(ffmpeg_path, '-encoders'),
+        _run(ffmpeg_path, '-filters')
+    )
+    return {
+        'ffmpeg': {'path': ffmpeg_path, 'version': ffmpeg_version},
+        'ffprobe': {'path': ffprobe_path, 'version': ffprobe_version} if ffprobe_path else None,
+        'encoders': {name: kind for kind, name in ENCODER_LINE.findall(encoders)},
+        'filters': sorted(set(FILTER_LINE.findall(filters)))
+    }
+
+def _read_cache(cache_path: str, key: Dict) -> Optional[Dict]:
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cached.get('capabilities') if cached.get('key') == key else None
+
+def _write_cache(cache_path: str, key: Dict, capabilities: Dict):
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'capabilities': capabilities}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not cache FFmpeg capabilities: {e}")
+
+async def probe_capabilities(cache_path: str = FFMPEG_CAPABILITIES_CACHE) -> Optional[Dict]:
+    """Find FFmpeg, ffprobe and the build's encoders and filters, cached per binary; None if FFmpeg is missing"""
+    key = {'ffmpeg': _binary_key('ffmpeg'), 'ffprobe': _binary_key('ffprobe')}
+    if not key['ffmpeg']:
+        return None
+
+    # Reused while both binaries keep their path, mtime and size, so a restart doesn't run FFmpeg
+    capabilities = _read_cache(cache_path, key) if cache_path else None
+    if capabilities:
+        logger.info(f"Using cached FFmpeg capabilities for {key['ffmpeg']['path']}")
+        return capabilities
+
+    capabilities = await _discover(key)
+    optional = [name for name in OPTIONAL_ENCODERS if name in capabilities['encoders']]
+    logger.info(
+        f"FFmpeg {capabilities['ffmpeg']['version']}: {len(capabilities['encoders'])} encoders, "
+        f"{len(capabilities['filters'])} filters; optional encoders: {', '.join(optional) or 'none'}"
+    )
+    if cache_path:
+        _write_cache(cache_path, key, capabilities)
+    return capabilities
+
+def missing_requirements(capabilities: Dict) -> List[str]:
+    """Get what the encode pipeline needs but this FFmpeg installation lacks"""
+    missing = [] if capabilities['ffprobe'] else ['ffprobe']
+    missing += [f"encoder {name}" for name in REQUIRED_ENCODERS if name not in capabilities['encoders']]
+    missing += [f"filter {name}" for name in REQUIRED_FILTERS if name not in capabilities['filters']]
+    return missing
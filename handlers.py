@@ -1,28 +1,43 @@
 import os
 import asyncio
 from pyrogram import Client, filters
+from pyrogram.enums import ParseMode
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from video_processor import VideoProcessor
 from channel_uploader import ChannelUploader
-from utils import get_video_info, format_bytes, format_duration, format_queue_position, ensure_temp_dir
-from config import MAX_FILE_SIZE, SUPPORTED_FORMATS, UPLOAD_CHANNEL_ID, REQUIRE_AUTHENTICATION, QUEUE_LIMIT_PER_USER, RESOLUTIONS
-from database import DatabaseManager
+from utils import get_video_info, probe_header, format_bytes, format_duration, format_queue_position, ensure_temp_dir
+from config import SUPPORTED_FORMATS, REQUIRE_AUTHENTICATION, QUEUE_LIMIT_PER_USER, RESOLUTIONS, PROFILE_MAX_SECONDS, STALL_TIMEOUT
+from database import DatabaseManager, JOB_STAGES
 from auth_manager import AuthManager
-from queue_manager import QueueManager
+from queue_manager import QueueManager, CANCEL_STOPPED, CANCEL_DETACHED, CANCEL_NOT_ACTIVE
+from preemption import PRIORITY_NORMAL, PRIORITY_HIGH
+from diagnostics import Profiler
+from admission import AdmissionControl
+from collections import OrderedDict
 import logging
+import time
+from typing import Dict
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Source media attributes remembered between showing the keyboard and the tap
+MEDIA_INFO_CACHE_SIZE = 1000
+
 class MessageHandlers:
-    def __init__(self, app: Client, db_manager: DatabaseManager, auth_manager: AuthManager, queue_manager: QueueManager):
+    def __init__(self, app: Client, db_manager: DatabaseManager, auth_manager: AuthManager, queue_manager: QueueManager,
+                 processor: VideoProcessor, uploader: ChannelUploader):
         self.app = app
         self.db = db_manager
         self.auth = auth_manager
         self.queue = queue_manager
-        self.processor = VideoProcessor()
-        self.uploader = ChannelUploader(app, UPLOAD_CHANNEL_ID)
-        self.active_progress_messages = {}  # Track progress messages
+        # Shared with the queue: probed FFmpeg capabilities and the upload client pool
+        self.processor = processor
+        self.uploader = uploader
+        self.active_progress_messages = {}  # job_id -> {user_id: progress message id}
+        self.profiler = Profiler()
+        self.admission = AdmissionControl(db_manager)
+        self.media_info = OrderedDict()  # file_unique_id -> {'duration', 'size'}
 
     async def start_command(self, client: Client, message: Message):
         """Handle /start command"""
@@ -33,7 +48,7 @@ class MessageHandlers:
             'first_name': message.from_user.first_name,
             'last_name': message.from_user.last_name
         }
-        await self.db.add_user(user_data)
+        await self.auth.register_user(user_data)
 
         # Check authorization
         auth_status = await self.auth.get_authorization_status(message.from_user.id)
@@ -47,7 +62,8 @@ class MessageHandlers:
 • Large video support (up to 2GB)
 • Memory-efficient processing
 • Channel-based storage
-• Automatic delivery when complete• **Real-time progress updates: Processed 0% → 100%**
+• Automatic delivery when complete
+• **Real-time progress updates: Processed 0% → 100%**
 
 {auth_status['message']}
 
@@ -71,7 +87,7 @@ class MessageHandlers:
 
     async def progress_command(self, client: Client, message: Message):
         """Handle /progress command - show progress of current jobs"""
-        user_jobs = await self.db.get_user_jobs(message.from_user.id)
+        user_jobs = await self.queue.view.user_jobs(message.from_user.id)
         
         active_jobs = [job for job in user_jobs if job['status'] in ['processing', 'pending'] and job['progress'] < 100]
         
@@ -96,7 +112,8 @@ class MessageHandlers:
 
 **How It Works:**
 1. Upload video to bot
-2. Job enters processing queue3. Bot processes with live progress (0% → 100%)
+2. Job enters processing queue
+3. Bot processes with live progress (0% → 100%)
 4. Bot automatically delivers processed video
 5. No need to wait around!
 
@@ -107,7 +124,7 @@ class MessageHandlers:
 • Progress command to check current jobs
 
 **Queue System:**
-• Jobs processed in order received
+• Jobs processed in order received (admins first)
 • Limited concurrent processing
 • Automatic notifications when complete
 
@@ -123,6 +140,7 @@ class MessageHandlers:
 • /progress - Check current job progress
 • /queue - Check your position in processing queue
 • /jobs - View your recent processing jobs
+• /cancel <job_id> - Cancel one of your jobs
 
 **Limitations:**
 • Max file size: 2GB
@@ -133,8 +151,10 @@ class MessageHandlers:
 
     async def queue_command(self, client: Client, message: Message):
         """Handle /queue command - show user's position in queue"""
-        pending_jobs = await self.db.get_pending_jobs()
-        user_jobs = [job for job in pending_jobs if job['user_id'] == message.from_user.id]
+        view = self.queue.view
+        # Includes jobs the user is subscribed to, not only the ones they created
+        user_jobs = [job for job in await view.user_jobs(message.from_user.id) if job['status'] == 'pending']
+        user_jobs.sort(key=lambda job: view.queue_position(job['id']))
         
         if not user_jobs:
             await message.reply_text("📋 Your queue is empty. Send a video to start processing!")
@@ -142,23 +162,17 @@ class MessageHandlers:
         
         response = "📋 Your jobs in queue:\n\n"
         for job in user_jobs:
-            # Find position
-            position = None
-            for i, pending_job in enumerate(pending_jobs):
-                if pending_job['id'] == job['id']:                    position = i + 1
-                    break
-            
             progress_bar = "█" * int(job['progress']/5) + "░" * (20 - int(job['progress']/5))
             response += f"Job #{job['id']}: {job['target_resolution']}\n"
             response += f"Status: {job['status']}\n"
             response += f"Progress: [{progress_bar}] {job['progress']:.1f}%\n"
-            response += f"Position: {position}/{len(pending_jobs)}\n\n"
+            response += f"Position: {view.queue_position(job['id'])}/{view.pending_count}\n\n"
         
         await message.reply_text(response)
 
     async def jobs_command(self, client: Client, message: Message):
         """Handle /jobs command - show user's recent jobs"""
-        user_jobs = await self.db.get_user_jobs(message.from_user.id)
+        user_jobs = await self.queue.view.user_jobs(message.from_user.id)
         
         if not user_jobs:
             await message.reply_text("📋 You have no processing jobs yet. Send a video to start!")
@@ -173,10 +187,37 @@ class MessageHandlers:
             response += f"Created: {job['created_at']}\n"
             if job['completed_at']:
                 response += f"Completed: {job['completed_at']}\n"
+            if job['attempts']:
+                response += f"Retries: {job['attempts']} (last error: {job['error_message']})\n"
+            if job['encoder_settings']:
+                response += f"Encoder: {job['encoder_settings']['preset']} ({job['encoder_settings']['reason']})\n"
             response += "\n"
         
         await message.reply_text(response)
 
+    async def cancel_command(self, client: Client, message: Message):
+        """Handle /cancel <job_id> [force] - cancel a job; admins can force-stop any job"""
+        args = message.command[1:]
+        if not args or not args[0].isdigit():
+            await message.reply_text("Usage: /cancel <job_id>")
+            return
+        
+        job_id = int(args[0])
+        force = len(args) > 1 and args[1] == 'force'
+        if force and not self.auth.is_admin(message.from_user.id):
+            await message.reply_text("❌ Only admins can force-cancel jobs.")
+            return
+        
+        result = await self.queue.cancel_job(job_id, message.from_user.id, force)
+        if result == CANCEL_STOPPED:
+            await message.reply_text(f"🚫 Job #{job_id} cancelled.")
+        elif result == CANCEL_DETACHED:
+            await message.reply_text(f"🚫 Job #{job_id} cancelled for you. Other users still waiting for it will get their result.")
+        elif result == CANCEL_NOT_ACTIVE:
+            await message.reply_text(f"ℹ️ Job #{job_id} has already finished.")
+        else:
+            await message.reply_text(f"❌ Job #{job_id} not found.")
+
     async def handle_video(self, client: Client, message: Message):
         """Handle incoming video messages"""
         # Check authorization
@@ -194,8 +235,9 @@ class MessageHandlers:
             'id': message.from_user.id,
             'username': message.from_user.username,
             'first_name': message.from_user.first_name,
-            'last_name': message.from_user.last_name        }
-        await self.db.add_user(user_data)
+            'last_name': message.from_user.last_name
+        }
+        await self.auth.register_user(user_data)
 
         # Determine if it's a video or document
         if message.video:
@@ -211,11 +253,6 @@ class MessageHandlers:
         else:
             return
 
-        # Validate file size
-        if file_size > MAX_FILE_SIZE:
-            await message.reply_text(f"❌ File too large! Maximum size: {format_bytes(MAX_FILE_SIZE)}")
-            return
-
         # Validate file format
         ext = mime_type.split('/')[-1] if '/' in mime_type else 'unknown'
         if ext not in SUPPORTED_FORMATS:
@@ -228,28 +265,63 @@ class MessageHandlers:
             await message.reply_text(f"❌ Queue limit reached! You can have max {QUEUE_LIMIT_PER_USER} jobs in queue.")
             return
 
-        # Show options for resolution
-        keyboard = [
-            [
-                InlineKeyboardButton("1080p", callback_data="queue_1080p"),
-                InlineKeyboardButton("720p", callback_data="queue_720p")
-            ],
-            [
-                InlineKeyboardButton("480p", callback_data="queue_480p"),
-                InlineKeyboardButton("360p", callback_data="queue_360p")
-            ],
-            [
-                InlineKeyboardButton("All Resolutions", callback_data="queue_all")
-            ]
+        # Check duration, size and compute budget before offering anything
+        media = await self.media_attributes(message)
+        review = await self.admission.review(message.from_user.id, media)
+        if not review['allowed']:
+            await message.reply_text(f"❌ {review['reason']}")
+            return
+
+        # Show options for the resolutions that fit, with their maximum output size
+        buttons = [
+            InlineKeyboardButton(
+                f"{res} (≤{format_bytes(review['estimates'][res]['size'])})" if media['duration'] else res,
+                callback_data=f"queue_{res}"
+            )
+            for res in review['offer']
         ]
+        keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+        if len(review['offer']) == len(RESOLUTIONS) and (
+                review['remaining'] is None or review['total_cost'] <= review['remaining']):
+            keyboard.append([InlineKeyboardButton("All Resolutions", callback_data="queue_all")])
         reply_markup = InlineKeyboardMarkup(keyboard)
-                await message.reply_text(
+        
+        text = (
             f"🎯 Choose compression resolution for your video:\n\n"
             f"📁 File: {original_filename}\n"
-            f"📦 Size: {format_bytes(file_size)}\n\n"
-            f"Select an option below:",
-            reply_markup=reply_markup
+            f"📦 Size: {format_bytes(file_size)}\n"
         )
+        if media['duration']:
+            text += f"⏱ Duration: {format_duration(media['duration'])}\n"
+        if review['remaining'] is not None:
+            text += f"⚙️ Compute budget left: {format_duration(review['remaining'])}\n"
+        if review['warnings']:
+            text += "\n" + "".join(f"⚠️ {warning}\n" for warning in review['warnings'])
+        
+        await message.reply_text(f"{text}\nSelect an option below:", reply_markup=reply_markup)
+
+    async def media_attributes(self, message: Message) -> Dict:
+        """Get a source's duration and size without downloading it (duration 0 if the header doesn't say)"""
+        media = message.video or message.document
+        cached = self.media_info.get(media.file_unique_id)
+        if cached is not None:
+            self.media_info.move_to_end(media.file_unique_id)
+            return cached
+        
+        info = {'duration': 0, 'size': media.file_size or 0}
+        if message.video:
+            info['duration'] = message.video.duration or 0
+        else:
+            try:
+                probed = await probe_header(await self.uploader.download_head(message))
+                info['duration'] = probed.get('duration', 0)
+            except Exception as e:
+                logger.warning(f"Header probe failed for {media.file_unique_id}: {e}")
+        
+        self.media_info[media.file_unique_id] = info
+        if len(self.media_info) > MEDIA_INFO_CACHE_SIZE:
+            self.media_info.popitem(last=False)
+        return info
 
     async def process_video_selection(self, client: Client, callback_query):
         """Handle compression selection and add to queue"""
@@ -264,11 +336,13 @@ class MessageHandlers:
         # Get file info
         if original_message.video:
             file_id = original_message.video.file_id
+            file_unique_id = original_message.video.file_unique_id
             file_size = original_message.video.file_size
             mime_type = original_message.video.mime_type
             original_filename = f"video_{file_id}.mp4"
         else:
             file_id = original_message.document.file_id
+            file_unique_id = original_message.document.file_unique_id
             file_size = original_message.document.file_size
             mime_type = original_message.document.mime_type
             original_filename = original_message.document.file_name or f"video_{file_id}.mp4"
@@ -285,18 +359,34 @@ class MessageHandlers:
         else:
             target_resolution = data.replace("queue_", "")
 
+        # The budget may have been spent since the keyboard was shown
+        resolutions = list(RESOLUTIONS) if target_resolution == "all" else [target_resolution]
+        media = await self.media_attributes(original_message)
+        refusal = await self.admission.admit(original_message.from_user.id, media, resolutions)
+        if refusal:
+            await callback_query.answer(f"❌ {refusal}", show_alert=True)
+            return
+        costs = {res: self.admission.estimate(media['duration'], res)['cost'] for res in resolutions}
+
+        # Admins' jobs are claimed first and may preempt running jobs
+        priority = PRIORITY_HIGH if self.auth.is_admin(original_message.from_user.id) else PRIORITY_NORMAL
+
         try:
             if target_resolution == "all":
                 # Add separate jobs for each resolution
-                job_ids = []
-                for res_name in RESOLUTIONS.keys():
-                    job_id = await self.queue.add_job(
-                        original_message.from_user.id,
-                        file_id,                        original_filename,
-                        file_size,
-                        res_name
-                    )
-                    job_ids.append(job_id)
+                job_ids = await self.queue.add_jobs([
+                    {
+                        'user_id': original_message.from_user.id,
+                        'file_id': file_id,
+                        'file_unique_id': file_unique_id,
+                        'filename': original_filename,
+                        'size': file_size,
+                        'resolution': res_name,
+                        'priority': priority,
+                        'estimated_cost': costs[res_name]
+                    }
+                    for res_name in RESOLUTIONS.keys()
+                ])
                 
                 await callback_query.answer(f"✅ Added {len(job_ids)} jobs to queue!", show_alert=True)
                 
@@ -313,25 +403,41 @@ class MessageHandlers:
                     file_id,
                     original_filename,
                     file_size,
-                    target_resolution
+                    target_resolution,
+                    file_unique_id,
+                    priority,
+                    costs[target_resolution]
                 )
                 
-                # Get position in queue
-                position, total = await self.queue.get_user_queue_position(original_message.from_user.id, job_id)
+                # A double tap on the same button resolves to the job already being tracked.
+                # Check and claim with no await in between, so the second tap sees the claim.
+                user_id = original_message.from_user.id
+                watchers = self.active_progress_messages.setdefault(job_id, {})
+                if user_id in watchers:
+                    await callback_query.answer("⏳ This video is already in the queue.", show_alert=True)
+                    return
+                watchers[user_id] = None  # message ID once sent
                 
-                # Send progress message
-                progress_msg = await original_message.reply_text(
-                    f"✅ Added to queue! Position: {position}/{total}\n"
-                    f"🎯 Starting processing: 0% complete\n"
-                    f"📊 Progress: [░░░░░░░░░░░░░░░░░░░░] 0.0%\n"
-                    f"You'll receive the processed video automatically when ready."
-                )
+                try:
+                    # Get position in queue
+                    position, total = await self.queue.get_user_queue_position(user_id, job_id)
+                    
+                    # Send progress message
+                    progress_msg = await original_message.reply_text(
+                        f"✅ Added to queue! Position: {position}/{total}\n"
+                        f"🎯 Starting processing: 0% complete\n"
+                        f"📊 Progress: [░░░░░░░░░░░░░░░░░░░░] 0.0%\n"
+                        f"You'll receive the processed video automatically when ready."
+                    )
+                except BaseException:
+                    self.stop_watching(job_id, user_id)
+                    raise
                 
                 # Store progress message ID for updates
-                self.active_progress_messages[job_id] = progress_msg.id
+                watchers[user_id] = progress_msg.id
                 
                 # Update progress periodically
-                await self.monitor_progress(job_id, original_message.from_user.id, progress_msg.id)
+                await self.monitor_progress(job_id, user_id, progress_msg.id)
                 
         except Exception as e:
             logger.error(f"Error adding to queue: {e}")
@@ -341,7 +447,8 @@ class MessageHandlers:
         """Monitor and update progress message"""
         try:
             while True:
-                job = await self.db.get_job_by_id(job_id)                if not job:
+                job = self.queue.view.get(job_id) or await self.db.get_job_by_id(job_id)
+                if not job:
                     break
                 
                 if job['status'] == 'completed':
@@ -357,6 +464,13 @@ class MessageHandlers:
                         )
                     )
                     break
+                elif job['status'] == 'cancelled':
+                    await self.app.edit_message_text(
+                        chat_id=user_id,
+                        message_id=progress_msg_id,
+                        text=f"🚫 Job #{job_id} was cancelled."
+                    )
+                    break
                 elif job['status'] == 'failed':
                     await self.app.edit_message_text(
                         chat_id=user_id,
@@ -388,9 +502,91 @@ class MessageHandlers:
                 
         except Exception as e:
             logger.error(f"Error monitoring progress: {e}")
+        finally:
+            self.stop_watching(job_id, user_id)
+
+    def stop_watching(self, job_id: int, user_id: int):
+        """Forget a user's progress message for a job"""
+        watchers = self.active_progress_messages.get(job_id, {})
+        watchers.pop(user_id, None)
+        if not watchers:
+            self.active_progress_messages.pop(job_id, None)
+
+    async def stats_command(self, client: Client, message: Message):
+        """Handle /stats command - admin-only stage percentiles and slowest jobs"""
+        if not self.auth.is_admin(message.from_user.id):
+            await message.reply_text("❌ This command is for admins only.")
+            return
+        
+        hours = 24
+        stage_stats = await self.db.get_stage_percentiles(time.time() - hours * 3600)
+        slowest = await self.db.get_slowest_jobs(hours)
+        events = await self.db.get_job_events([job['id'] for job in slowest])
+        
+        response = f"📈 Stage timings (last {hours}h)\n\n"
+        capabilities = self.queue.processor.capabilities
+        if capabilities:
+            response = (
+                f"🎞 FFmpeg {capabilities['ffmpeg']['version']}, "
+                f"ffprobe {capabilities['ffprobe']['version']}\n\n" + response
+            )
+        for stage in JOB_STAGES:
+            stats = stage_stats.get(stage)
+            if not stats:
+                response += f"{stage}: no data\n"
+                continue
+            percentiles = stats['percentiles']
+            response += (
+                f"{stage}: n={stats['count']} "
+                f"p50 {format_duration(percentiles[50])} · "
+                f"p90 {format_duration(percentiles[90])} · "
+                f"p99 {format_duration(percentiles[99])}\n"
+            )
+        
+        response += "\n🐢 Slowest recent jobs:\n"
+        if not slowest:
+            response += "No completed jobs yet.\n"
+        for job in slowest:
+            breakdown = ", ".join(
+                f"{event['stage']} {format_duration(event['duration'])}"
+                for event in events.get(job['id'], [])
+            )
+            response += f"Job #{job['id']} ({job['target_resolution']}): {format_duration(job['total_seconds'])}\n"
+            if breakdown:
+                response += f"  {breakdown}\n"
+        
+        await message.reply_text(response)
+
+    async def profile_command(self, client: Client, message: Message):
+        """Handle /profile [seconds] command - admin-only cProfile window over the running bot"""
+        if not self.auth.is_admin(message.from_user.id):
+            await message.reply_text("❌ This command is for admins only.")
+            return
+        
+        args = message.text.split()[1:] if message.text else []
+        try:
+            seconds = min(int(args[0]), PROFILE_MAX_SECONDS) if args else 30
+        except ValueError:
+            await message.reply_text("Usage: /profile [seconds]")
+            return
+        
+        if self.profiler.running:
+            await message.reply_text("⏳ A profiling window is already running.")
+            return
+        
+        await message.reply_text(f"🔬 Profiling the bot for {seconds}s...")
+        summary, dump_path = await self.profiler.profile(seconds)
+        
+        # Telegram messages are limited to 4096 characters; the hottest functions come first.
+        # Plain text: markdown would eat the underscores and asterisks of function names.
+        if len(summary) > 3800:
+            summary = summary[:3800].rsplit('\n', 1)[0]
+        await message.reply_text(f"🔥 Hot spots (own time):\n{summary}", parse_mode=ParseMode.DISABLED)
+        await message.reply_document(dump_path, caption="Full cProfile dump (open with pstats or snakeviz)")
 
     async def info_command(self, client: Client, message: Message):
-        """Handle /info command - get video info without processing"""        if not message.reply_to_message or not (message.reply_to_message.video or message.reply_to_message.document):
+        """Handle /info command - get video info without processing"""
+        if not message.reply_to_message or not (message.reply_to_message.video or message.reply_to_message.document):
             await message.reply_text("❌ Reply to a video message to get its information.")
             return
 
@@ -420,7 +616,7 @@ class MessageHandlers:
             await video_msg.download(str(temp_path))
             
             # Get video info
-            info = get_video_info(str(temp_path))
+            info = await get_video_info(str(temp_path), STALL_TIMEOUT or None)
             
             info_text = f"""
 📊 **Video Information**
@@ -436,6 +632,5 @@ class MessageHandlers:
         except Exception as e:
             await message.reply_text(f"❌ Error analyzing video: {str(e)}")
         finally:
-            # Cleanup
-            if temp_path.exists():
-                temp_path.unlink()
+            # Large downloads can take a while to delete; keep it off the event loop
+            await asyncio.to_thread(temp_path.unlink, True)
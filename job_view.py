@@ -0,0 +1,155 @@
+import asyncio
+import bisect
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from config import JOB_VIEW_USERS
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('pending', 'processing')
+
+# Recent jobs kept per user, as many as DatabaseManager.get_user_jobs returns
+RECENT_JOBS = 20
+
+def _claim_key(job: Dict) -> tuple:
+    """Sort key matching the claim order of DatabaseManager.get_pending_jobs"""
+    return (-job['priority'], job['created_at'], job['id'])
+
+class JobView:
+    """In-memory copy of active jobs and recently seen users' jobs, updated by QueueManager after the database"""
+
+    def __init__(self, db: DatabaseManager, max_users: int = JOB_VIEW_USERS, recent: int = RECENT_JOBS):
+        self.db = db
+        self.max_users = max_users
+        self.recent = recent
+        self.jobs: Dict[int, Dict] = {}  # returned to callers as is: read-only outside the view
+        self.users = OrderedDict()  # user_id -> job ids, newest first
+        self.listed_by: Dict[int, set] = {}  # job_id -> loaded users whose list holds it
+        self.loading: Dict[int, asyncio.Task] = {}  # user_id -> task reading their jobs
+        self.pending: List[tuple] = []  # claim keys of pending jobs, in claim order
+        self.pending_keys: Dict[int, tuple] = {}
+
+    async def load(self):
+        """Read all active jobs; call once before the queue starts"""
+        for job in await self.db.get_active_jobs():
+            self.put(job)
+        logger.info(f"Job view loaded {len(self.jobs)} active job(s)")
+
+    def put(self, job: Dict):
+        """Store the latest version of a job"""
+        job_id = job['id']
+        self.jobs[job_id] = job
+        key = self.pending_keys.pop(job_id, None)
+        if key:
+            del self.pending[bisect.bisect_left(self.pending, key)]
+        if job['status'] == 'pending':
+            key = _claim_key(job)
+            bisect.insort(self.pending, key)
+            self.pending_keys[job_id] = key
+        self._forget_if_unused(job_id)
+
+    async def refresh(self, job_id: int):
+        """Re-read a job after a state change"""
+        job = await self.db.get_job_by_id(job_id)
+        if job:
+            self.put(job)
+
+    def update(self, job_id: int, **fields):
+        """Apply a change that doesn't affect status or queue order"""
+        job = self.jobs.get(job_id)
+        if job:
+            job.update(fields)
+
+    def set_progress(self, job_id: int, progress: float):
+        """Record progress of a running job (ignored once it stopped, like the database)"""
+        job = self.jobs.get(job_id)
+        if job and job['status'] == 'processing':
+            job['progress'] = progress
+
+    def add(self, job: Dict, user_id: int):
+        """Record a job a user just queued or attached to"""
+        self.put(job)
+        self._attach(user_id, job['id'])
+
+    def detach(self, user_id: int, job_id: int):
+        """Remove a job from a user's list (unsubscribed or handed over)"""
+        ids = self.users.get(user_id)
+        if ids and job_id in ids:
+            ids.remove(job_id)
+            self._unlist(user_id, job_id)
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        """Get a job if the view holds it (active, or listed for a loaded user)"""
+        return self.jobs.get(job_id)
+
+    async def user_jobs(self, user_id: int) -> List[Dict]:
+        """Get a user's recent jobs, owned or subscribed, newest first"""
+        if user_id not in self.users or user_id in self.loading:
+            if user_id not in self.loading:
+                self.loading[user_id] = asyncio.create_task(self._load_user(user_id))
+            await asyncio.shield(self.loading[user_id])
+        if user_id in self.users:
+            self.users.move_to_end(user_id)
+            return [self.jobs[job_id] for job_id in self.users[user_id]]
+        return []
+
+    def queue_position(self, job_id: int) -> Optional[int]:
+        """Get a pending job's 1-based position in claim order"""
+        key = self.pending_keys.get(job_id)
+        return bisect.bisect_left(self.pending, key) + 1 if key else None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self.pending)
+
+    async def _load_user(self, user_id: int):
+        # Jobs the user queues while this read runs are attached to this list too
+        self.users[user_id] = []
+        try:
+            for job in await self.db.get_user_jobs(user_id, self.recent):
+                # An active job in the view may be newer than this read
+                self.jobs.setdefault(job['id'], job)
+                self._attach(user_id, job['id'])
+        except Exception:
+            for job_id in self.users.pop(user_id, []):
+                self._unlist(user_id, job_id)
+            raise
+        finally:
+            del self.loading[user_id]
+        self._evict()
+
+    def _attach(self, user_id: int, job_id: int):
+        ids = self.users.get(user_id)
+        if ids is None or job_id in ids:
+            return  # Not loaded: read from the database on first access
+        ids.append(job_id)
+        ids.sort(key=lambda i: (self.jobs[i]['created_at'], i), reverse=True)
+        self.listed_by.setdefault(job_id, set()).add(user_id)
+        for dropped in ids[self.recent:]:
+            ids.remove(dropped)
+            self._unlist(user_id, dropped)
+
+    def _unlist(self, user_id: int, job_id: int):
+        users = self.listed_by.get(job_id)
+        if users:
+            users.discard(user_id)
+            if not users:
+                del self.listed_by[job_id]
+        self._forget_if_unused(job_id)
+
+    def _forget_if_unused(self, job_id: int):
+        job = self.jobs.get(job_id)
+        if job and job['status'] not in ACTIVE_STATUSES and job_id not in self.listed_by:
+            del self.jobs[job_id]
+
+    def _evict(self):
+        # Least recently seen users go first, with the finished jobs only they listed
+        for user_id in list(self.users):
+            if len(self.users) <= self.max_users:
+                break
+            if user_id in self.loading:
+                continue
+            for job_id in self.users.pop(user_id):
+                self._unlist(user_id, job_id)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+import logging
+import functools
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers fast SQLite calls up to hour-long encodes
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+
+REGISTRY: List['Metric'] = []
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """Base class for metrics exposed in Prometheus text format"""
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, float] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: Dict[Tuple, List[int]] = {}
+        self.sums: Dict[Tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1  # +Inf
+        self.sums[key] = self.sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, counts in self.counts.items():
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {self.sums[key]}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+def render() -> str:
+    """Render every registered metric in Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def timed_sqlite(func: Callable) -> Callable:
+    """Decorator recording the latency of a DatabaseManager coroutine"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with SQLITE_LATENCY.time(operation=func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+# Queue
+QUEUE_DEPTH = Gauge('video_queue_jobs', 'Jobs in the queue by status', ('status',))
+WORKERS_TOTAL = Gauge('video_queue_workers', 'Configured queue workers')
+WORKERS_BUSY = Gauge('video_queue_workers_busy', 'Queue workers currently processing a job')
+JOBS_CANCELLED = Counter('video_jobs_cancelled_total', 'Jobs cancelled before they finished')
+JOBS_PREEMPTED = Counter('video_jobs_preempted_total', 'Running jobs requeued for higher-priority work')
+JOBS_RELEASED = Counter('video_jobs_released_total', 'Running jobs requeued because the bot shut down')
+JOB_RETRIES = Counter('video_job_retries_total', 'Jobs requeued after a transient failure')
+JOB_STALLS = Counter('video_job_stalls_total', 'Stages killed by the watchdog for making no progress', ('stage',))
+
+# Pipeline stages
+STAGE_DURATION = Histogram('video_stage_duration_seconds', 'Time spent per processing stage', ('stage',))
+BYTES_IN = Counter('video_bytes_in_total', 'Bytes downloaded from Telegram')
+BYTES_OUT = Counter('video_bytes_out_total', 'Bytes uploaded to the storage channel')
+UPLOADS = Counter('video_uploads_total', 'Files uploaded by client and storage channel', ('client', 'channel'))
+UPLOAD_THROUGHPUT = Histogram('video_upload_throughput_bytes_per_second', 'Part upload throughput per file',
+                              buckets=(2 ** 18, 2 ** 19, 2 ** 20, 2 ** 21, 2 ** 22, 2 ** 23, 2 ** 24, 2 ** 25, 2 ** 26))
+ENCODER_DECISIONS = Counter('video_encoder_decisions_total', 'Encoder presets chosen by the speed policy', ('preset',))
+STREAM_DECISIONS = Counter('video_stream_decisions_total', 'Source streams transcoded, copied or dropped', ('type', 'action'))
+FFMPEG_FPS = Gauge('video_ffmpeg_fps', 'Latest FFmpeg encoding speed in frames per second', ('resolution',))
+
+# Event loop
+EVENT_LOOP_LAG = Histogram('video_event_loop_lag_seconds', 'Event loop scheduling delay',
+                           buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+# Storage
+SQLITE_LATENCY = Histogram('video_sqlite_operation_seconds', 'SQLite operation latency', ('operation',))
+
+# Telegram API
+TELEGRAM_CALLS = Counter('video_telegram_api_calls_total', 'Telegram API calls', ('method',))
+TELEGRAM_FLOOD_WAITS = Counter('video_telegram_flood_waits_total', 'FloodWait errors returned by Telegram', ('method',))
+
+class MetricsServer:
+    """Minimal HTTP server exposing ``/metrics`` for Prometheus scraping"""
+
+    def __init__(self, host: str, port: int, collect: Optional[Callable[[], Awaitable[None]]] = None):
+        self.host = host
+        self.port = port
+        self.collect = collect  # Refreshes scrape-time gauges such as queue depth
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain headers
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+
+            parts = request_line.decode(errors='replace').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                if self.collect:
+                    await self.collect()
+                status, body = '200 OK', render()
+            else:
+                status, body = '404 Not Found', 'Not Found\n'
+
+            payload = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
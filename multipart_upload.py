@@ -0,0 +1,123 @@
+import asyncio
+import inspect
+import logging
+import math
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List
+from pyrogram import raw
+from pyrogram.errors import BadRequest, FloodWait
+from config import UPLOAD_PARALLELISM, UPLOAD_PART_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Telegram's limits: parts are a power-of-two KiB up to 512 KiB, and a file has at most 4000 parts
+MIN_PART_SIZE = 1024
+MAX_PART_SIZE = 512 * 1024
+MAX_PARTS = 4000
+
+# Files above this must be sent as "big" files (upload.saveBigFilePart)
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+# Attempts per part after the session's own retries gave up, with doubling back-off
+PART_ATTEMPTS = 3
+PART_RETRY_DELAY = 0.5  # seconds
+
+def check_part_size(part_size: int):
+    """Raise ValueError unless Telegram accepts ``part_size``"""
+    if part_size < MIN_PART_SIZE or part_size > MAX_PART_SIZE or MAX_PART_SIZE % part_size:
+        raise ValueError(f"Upload part size must be a power of two between 1 KiB and 512 KiB, not {part_size}")
+
+def choose_part_size(file_size: int, part_size: int = UPLOAD_PART_SIZE) -> int:
+    """Get the part size to use for a file: ``part_size``, doubled until the file fits in MAX_PARTS"""
+    while math.ceil(file_size / part_size) > MAX_PARTS and part_size < MAX_PART_SIZE:
+        part_size *= 2
+    return part_size
+
+class MultipartUpload:
+    """Upload the parts of one big file concurrently over ``invokers`` (media sessions), retrying failed parts"""
+
+    def __init__(self, invokers: List[Callable[[object], Awaitable]], parallelism: int = UPLOAD_PARALLELISM,
+                 part_size: int = UPLOAD_PART_SIZE, attempts: int = PART_ATTEMPTS):
+        check_part_size(part_size)
+        if not invokers:
+            raise ValueError("MultipartUpload needs at least one invoker")
+        self.invokers = invokers
+        self.parallelism = max(1, parallelism)
+        self.part_size = part_size
+        self.attempts = max(1, attempts)
+
+    async def upload(self, path: str, file_id: int, progress: Callable[[int, int], None] = None) -> Dict:
+        """Upload every part of ``path`` under ``file_id``; returns the ``input_file`` to send and transfer stats"""
+        file_size = os.path.getsize(path)
+        if file_size <= BIG_FILE_SIZE:
+            raise ValueError(f"{path} is too small for a big file upload ({file_size} bytes)")
+        part_size = choose_part_size(file_size, self.part_size)
+        total_parts = math.ceil(file_size / part_size)
+        started = time.perf_counter()
+        await self.upload_parts(path, file_id, range(total_parts), file_size, part_size, progress)
+        seconds = time.perf_counter() - started
+        return {
+            'input_file': raw.types.InputFileBig(id=file_id, parts=total_parts, name=os.path.basename(path)),
+            'bytes': file_size,
+            'parts': total_parts,
+            'part_size': part_size,
+            'parallelism': self.parallelism,
+            'seconds': seconds,
+            'throughput': file_size / seconds if seconds > 0 else 0.0
+        }
+
+    async def upload_parts(self, path: str, file_id: int, parts: Iterable[int], file_size: int = None,
+                           part_size: int = None, progress: Callable[[int, int], None] = None):
+        """Upload the given part numbers (all of them, or ones Telegram reports missing)"""
+        file_size = file_size or os.path.getsize(path)
+        part_size = part_size or choose_part_size(file_size, self.part_size)
+        total_parts = math.ceil(file_size / part_size)
+        parts = iter(parts)
+        done = 0
+
+        async def worker(invoke):
+            nonlocal done
+            for part in parts:
+                # Positional reads: no shared file offset, at most one part in memory per worker
+                data = await asyncio.to_thread(os.pread, fd, part_size, part * part_size)
+                await self._save_part(invoke, file_id, part, total_parts, data)
+                done += len(data)
+                if progress:
+                    result = progress(done, file_size)
+                    if inspect.isawaitable(result):
+                        await result
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            workers = [
+                asyncio.create_task(worker(self.invokers[i % len(self.invokers)]))
+                for i in range(self.parallelism)
+            ]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                # One failed part fails the upload: stop the other workers before the file is closed
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            os.close(fd)
+
+    async def _save_part(self, invoke, file_id: int, part: int, total_parts: int, data: bytes):
+        request = raw.functions.upload.SaveBigFilePart(
+            file_id=file_id, file_part=part, file_total_parts=total_parts, bytes=data
+        )
+        for attempt in range(1, self.attempts + 1):
+            try:
+                if await invoke(request):
+                    return
+                error = f"Telegram did not accept part {part}"
+            except (FloodWait, BadRequest):
+                raise  # The caller moves to another client instead
+            except Exception as e:
+                error = f"part {part} failed: {e}"
+            if attempt < self.attempts:
+                logger.warning(f"Upload {error}, retrying (attempt {attempt}/{self.attempts})")
+                await asyncio.sleep(PART_RETRY_DELAY * 2 ** (attempt - 1))
+        raise ConnectionError(f"Upload {error} after {self.attempts} attempts")
@@ -0,0 +1,31 @@
+import logging
+from typing import Dict, List, Optional
+from config import PREEMPTION, PREEMPT_MAX_PROGRESS, MAX_PREEMPTIONS
+
+logger = logging.getLogger(__name__)
+
+# Job priorities; pending jobs are claimed highest first
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+
+class PreemptionPolicy:
+    """Pick the lower-priority running job with the least progress to requeue for more urgent work"""
+
+    def __init__(self, enabled: bool = PREEMPTION, max_progress: float = PREEMPT_MAX_PROGRESS,
+                 max_preemptions: int = MAX_PREEMPTIONS):
+        self.enabled = enabled
+        self.max_progress = max_progress
+        self.max_preemptions = max_preemptions
+
+    def choose_victim(self, running: List[Dict], priority: int) -> Optional[Dict]:
+        """Get the running job (dicts of id, priority, progress, preemptions) to requeue for ``priority``, or None"""
+        if not self.enabled:
+            return None
+        candidates = [
+            job for job in running
+            if job['priority'] < priority
+            and job['progress'] <= self.max_progress  # nearly finished work is cheaper to let finish
+            and job['preemptions'] < self.max_preemptions  # so low-priority jobs still finish eventually
+        ]
+        # The least progress loses the least work
+        return min(candidates, key=lambda job: (job['priority'], job['progress']), default=None)
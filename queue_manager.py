@@ -3,42 +3,125 @@ from typing import List, Dict, Optional, Callable
 from database import DatabaseManager
 from video_processor import VideoProcessor
 from channel_uploader import ChannelUploader
-from config import MAX_CONCURRENT_PROCESSES
+from storage_manager import StorageManager
+from encoding_policy import EncodingPolicy
+from preemption import PreemptionPolicy, PRIORITY_NORMAL
+from job_view import JobView
+from retry_policy import RetryPolicy, TransientJobError, PermanentJobError, StageStalled
+from config import MAX_CONCURRENT_PROCESSES, UPLOAD_SIZE_LIMIT, STALL_TIMEOUT, SHUTDOWN_GRACE_PERIOD
+from utils import format_bytes
+import metrics
+from pathlib import Path
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 import logging
+import os
 import time
 
 logger = logging.getLogger(__name__)
 
+# Results of QueueManager.cancel_job
+CANCEL_STOPPED = 'stopped'  # the job was cancelled (and its worker interrupted)
+CANCEL_DETACHED = 'detached'  # the user was detached; others still get the output
+CANCEL_NOT_FOUND = 'not_found'  # no such job, or not the user's
+CANCEL_NOT_ACTIVE = 'not_active'  # the job already finished
+
+# Seconds stop_processing waits for workers to leave their loop before cancelling them
+WORKER_EXIT_TIMEOUT = 10
+
+def _utc_timestamp(value: str) -> float:
+    """Convert an SQLite CURRENT_TIMESTAMP value (UTC) to a unix timestamp"""
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+
+class Heartbeat:
+    """Last sign of progress from a running job, checked by the stall watchdog"""
+
+    def __init__(self, stage: str = 'queue_wait'):
+        self.stage = stage
+        self.last = time.monotonic()
+
+    def beat(self, stage: str = None):
+        if stage:
+            self.stage = stage
+        self.last = time.monotonic()
+
+    async def progress(self, current: int, total: int):
+        """Pyrogram transfer progress callback"""
+        self.beat()
+
+    @property
+    def idle(self) -> float:
+        return time.monotonic() - self.last
+
 class QueueManager:
-    def __init__(self, db_manager: DatabaseManager, processor: VideoProcessor, uploader: ChannelUploader):
+    def __init__(self, db_manager: DatabaseManager, processor: VideoProcessor, uploader: ChannelUploader,
+                 storage: StorageManager = None, encoding_policy: EncodingPolicy = None,
+                 preemption_policy: PreemptionPolicy = None, retry_policy: RetryPolicy = None,
+                 stall_timeout: float = STALL_TIMEOUT, view: JobView = None):
         self.db = db_manager
         self.processor = processor
         self.uploader = uploader
+        self.storage = storage or StorageManager()
+        self.encoding_policy = encoding_policy or EncodingPolicy()
+        self.preemption_policy = preemption_policy or PreemptionPolicy()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.stall_timeout = stall_timeout
+        self.view = view or JobView(db_manager)  # Read model for commands; updated after every write
         self.active_workers = []
         self.running = False
         self.progress_callbacks = {}  # Store progress callbacks for jobs
+        self.pending_deliveries = {}  # user_id -> [(job, channel_messages)] awaiting delivery; see restore_deliveries
+        self.work_available = asyncio.Event()  # Set when new jobs are queued
+        self.running_jobs = {}  # job_id -> (job, task running process_job)
+        self.stop_requests = {}  # job_id -> (status, reason) to apply when its task stops
+        self.preemptions = {}  # job_id -> times requeued for higher-priority work
 
     async def start_processing(self):
         """Start the queue processing loop"""
         self.running = True
         logger.info("Queue manager started")
         
+        # Workers run in this process only, so processing jobs are leftovers of a run that didn't drain
+        released = await self.db.release_processing_jobs()
+        if released:
+            logger.warning(f"Requeued {released} job(s) left processing by the previous run")
+        await self.view.load()
+        await self.restore_deliveries()
+        
+        # Remove leftovers from jobs that died with a previous process
+        await self.storage.start_sweeper()
+        # Archive finished jobs and keep the database file lean
+        await self.db.start_maintenance()
+        
         # Start worker tasks
         for i in range(MAX_CONCURRENT_PROCESSES):
             worker_task = asyncio.create_task(self.worker(i))
             self.active_workers.append(worker_task)
         
+        metrics.WORKERS_TOTAL.set(MAX_CONCURRENT_PROCESSES)
         logger.info(f"Started {MAX_CONCURRENT_PROCESSES} worker(s)")
 
-    async def stop_processing(self):
-        """Stop the queue processing"""
+    async def stop_processing(self, grace_period: float = SHUTDOWN_GRACE_PERIOD):
+        """Drain the queue: claim nothing new, give running jobs ``grace_period`` seconds, then release the rest to pending"""
         self.running = False
-        # Wait for all workers to finish
+        self.work_available.set()  # Idle workers exit instead of waiting for work
+        tasks = [task for _, task in self.running_jobs.values()]
+        if tasks and grace_period > 0:
+            logger.info(f"Draining: waiting up to {grace_period:.0f}s for {len(tasks)} running job(s)")
+            await asyncio.wait(tasks, timeout=grace_period)
+        for job_id in list(self.running_jobs):
+            await self.stop_job(job_id, 'released', "Shut down before the job finished")
+        
+        # Workers exit on their own once their job has stopped; idle ones after at most their 5s back-off
+        if self.active_workers:
+            await asyncio.wait(self.active_workers, timeout=WORKER_EXIT_TIMEOUT)
         for worker in self.active_workers:
             if not worker.done():
                 worker.cancel()
         
         await asyncio.gather(*self.active_workers, return_exceptions=True)
+        await self.storage.stop_sweeper()
+        await self.db.stop_maintenance()
         logger.info("Queue manager stopped")
 
     async def worker(self, worker_id: int):
@@ -47,21 +130,29 @@ class QueueManager:
         
         while self.running:
             try:
-                # Get pending job                pending_jobs = await self.db.get_pending_jobs()
+                # Clear before reading so a job queued meanwhile still wakes us
+                self.work_available.clear()
+                pending_jobs = await self.db.get_pending_jobs()
+                if not self.running:
+                    break  # Draining
                 if not pending_jobs:
-                    await asyncio.sleep(5)  # Wait before checking again
+                    await self.wait_for_work(5)
                     continue
                 
-                # Get first job
-                job = pending_jobs[0]
-                
-                # Update status to processing
-                await self.db.update_job_status(job['id'], 'processing', 0.0)
+                job = await self.claim_next_job(pending_jobs)
+                if not job:
+                    # Nothing fits on disk or is due for retry; back off until that changes
+                    await asyncio.sleep(5)
+                    continue
                 
                 logger.info(f"Worker {worker_id} processing job {job['id']}")
                 
                 # Process the job
-                await self.process_job(job)
+                metrics.WORKERS_BUSY.inc()
+                try:
+                    await self.run_job(job)
+                finally:
+                    metrics.WORKERS_BUSY.dec()
                 
             except asyncio.CancelledError:
                 logger.info(f"Worker {worker_id} cancelled")
@@ -70,99 +161,438 @@ class QueueManager:
                 logger.error(f"Worker {worker_id} error: {e}")
                 await asyncio.sleep(5)
 
-    async def process_job(self, job: Dict):
-        """Process a single job with progress tracking"""
+    async def wait_for_work(self, timeout: float):
+        """Sleep until new jobs are queued or ``timeout`` seconds pass"""
         try:
+            await asyncio.wait_for(self.work_available.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def claim_next_job(self, pending_jobs: List[Dict]) -> Optional[Dict]:
+        """Reserve temp space for the oldest pending job that fits and claim it"""
+        now = time.time()
+        for job in pending_jobs:
+            if job['id'] in self.storage.reservations:
+                continue  # Being claimed by another worker
+            if job['retry_at'] and _utc_timestamp(job['retry_at']) > now:
+                continue  # Backing off after a transient failure
+            
+            needed = self.storage.estimate_job_bytes(job)
+            if not self.storage.can_ever_fit(needed):
+                # Through handle_failure so sibling renditions waiting on this job get delivered
+                await self.handle_failure(job, PermanentJobError(
+                    f"Not enough temp storage for this file (needs {format_bytes(needed)})"
+                ))
+                continue
+            
+            if not self.storage.reserve(job['id'], needed):
+                # Keep FIFO order: don't let smaller jobs starve the head of the queue
+                return None
+            
+            if await self.db.claim_job(job['id']):
+                await self.view.refresh(job['id'])
+                return job
+            await self.storage.release(job['id'])
+        
+        return None
+
+    async def run_job(self, job: Dict):
+        """Run a claimed job in its own task, which ``stop_job`` and the stall watchdog cancel to interrupt it"""
+        heartbeat = Heartbeat()
+        task = asyncio.create_task(self.process_job(job, heartbeat))
+        self.running_jobs[job['id']] = (job, task)
+        if job['id'] in self.stop_requests:
+            task.cancel()  # Stopped while it was being claimed
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=max(1.0, self.stall_timeout / 10) if self.stall_timeout else None)
+                if self.stall_timeout and not task.done() and heartbeat.idle > self.stall_timeout \
+                        and job['id'] not in self.stop_requests:
+                    logger.warning(f"Job {job['id']}: {heartbeat.stage} made no progress for {heartbeat.idle:.0f}s, killing it")
+                    metrics.JOB_STALLS.inc(stage=heartbeat.stage)
+                    self.stop_requests[job['id']] = (
+                        'stalled', f"{heartbeat.stage} made no progress for {heartbeat.idle:.0f}s"
+                    )
+                    task.cancel()
+        finally:
+            if not task.done():
+                # The worker itself is being cancelled: hand the job back rather than leave it processing
+                self.stop_requests.setdefault(job['id'], ('released', "Worker stopped"))
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            del self.running_jobs[job['id']]
+            
+            request = self.stop_requests.pop(job['id'], None)
+            if task.cancelled() and request:
+                # A task cancelled before it started never ran process_job's cleanup
+                await self.storage.release(job['id'])
+                await self.job_stopped(job, *request)
+            else:
+                self.preemptions.pop(job['id'], None)
+
+    async def stop_job(self, job_id: int, status: str, reason: str) -> bool:
+        """Stop a job: 'cancelled' ends it, 'pending' (preemption) and 'released' (shutdown) requeue it; False if not here"""
+        self.stop_requests[job_id] = (status, reason)
+        if job_id in self.running_jobs:
+            self.running_jobs[job_id][1].cancel()
+            return True
+        
+        if status == 'cancelled' and await self.db.cancel_pending_job(job_id, reason):
+            self.stop_requests.pop(job_id, None)
+            job = await self.db.get_job_by_id(job_id)
+            self.view.put(job)
+            await self.job_stopped(job, status, reason)
+            return True
+        
+        job = await self.db.get_job_by_id(job_id)
+        if job_id not in self.stop_requests or (job and job['status'] == 'processing'):
+            # Claimed by a worker meanwhile; run_job applies the request
+            return True
+        self.stop_requests.pop(job_id, None)
+        return False
+
+    async def job_stopped(self, job: Dict, status: str, reason: str):
+        """Record the outcome of a stopped job"""
+        if status == 'stalled':
+            await self.handle_failure(job, StageStalled(reason))
+            return
+        if status in ('pending', 'released'):
+            if await self.db.requeue_job(job['id']):
+                await self.view.refresh(job['id'])
+                (metrics.JOBS_PREEMPTED if status == 'pending' else metrics.JOBS_RELEASED).inc()
+                logger.info(f"Job {job['id']} requeued: {reason}")
+                self.work_available.set()
+            return
+        
+        # Pending jobs were already marked by cancel_pending_job
+        await self.update_status(job['id'], 'cancelled', error=reason)
+        metrics.JOBS_CANCELLED.inc()
+        logger.info(f"Job {job['id']} cancelled: {reason}")
+        # Sibling renditions may be waiting on this job before delivery
+        for user_id in await self.job_recipients(job):
+            await self.deliver_if_ready(user_id, job['file_unique_id'])
+
+    async def cancel_job(self, job_id: int, user_id: int, force: bool = False) -> str:
+        """Cancel a job for a user (a CANCEL_* result); unless ``force``, subscribers detach and owners hand it over"""
+        job = await self.db.get_job_by_id(job_id)
+        if not job:
+            return CANCEL_NOT_FOUND
+        subscribers = await self.db.get_job_subscribers(job_id)
+        if not force and user_id != job['user_id'] and user_id not in subscribers:
+            return CANCEL_NOT_FOUND
+        if job['status'] not in ('pending', 'processing'):
+            return CANCEL_NOT_ACTIVE
+        
+        if not force:
+            if user_id != job['user_id']:
+                await self.db.remove_job_subscriber(job_id, user_id)
+                self.view.detach(user_id, job_id)
+                return CANCEL_DETACHED
+            if subscribers and await self.db.transfer_job_owner(job_id):
+                self.view.detach(user_id, job_id)
+                await self.view.refresh(job_id)
+                return CANCEL_DETACHED
+        
+        if await self.stop_job(job_id, 'cancelled', f"Cancelled by user {user_id}"):
+            return CANCEL_STOPPED
+        return CANCEL_NOT_ACTIVE
+
+    async def preempt_for(self, priority: int):
+        """Requeue a running lower-priority job if every worker is busy"""
+        if len(self.running_jobs) < len(self.active_workers):
+            return  # An idle worker will pick the new job up
+        running = [
+            {
+                'id': job['id'],
+                'priority': job['priority'],
+                'progress': self.progress_callbacks.get(job['id'], 0.0),
+                'preemptions': self.preemptions.get(job['id'], 0)
+            }
+            for job, _ in self.running_jobs.values()
+            if job['id'] not in self.stop_requests
+        ]
+        victim = self.preemption_policy.choose_victim(running, priority)
+        if victim:
+            self.preemptions[victim['id']] = victim['preemptions'] + 1
+            await self.stop_job(victim['id'], 'pending', f"Preempted by priority {priority} work")
+
+    async def handle_failure(self, job: Dict, error: Exception):
+        """Requeue a transient failure with backoff; mark the job failed otherwise"""
+        attempts = job['attempts'] + 1
+        delay = self.retry_policy.retry_delay(error, attempts)
+        if delay is not None and await self.db.retry_job(job['id'], delay, str(error)):
+            await self.view.refresh(job['id'])
+            metrics.JOB_RETRIES.inc()
+            logger.warning(
+                f"Job {job['id']} attempt {attempts}/{self.retry_policy.max_attempts} failed, "
+                f"retrying in {delay:.0f}s: {error}"
+            )
+            return
+        
+        await self.update_status(job['id'], 'failed', 0.0, str(error))
+        # Sibling renditions may be waiting on this job before delivery
+        for user_id in await self.job_recipients(job):
+            await self.deliver_if_ready(user_id, job['file_unique_id'])
+
+    async def process_job(self, job: Dict, heartbeat: Heartbeat = None):
+        """Process a single job with progress tracking; stages report to ``heartbeat``"""
+        heartbeat = heartbeat or Heartbeat()
+        placements = []  # channel messages posted by this attempt
+        stored = False
+        try:
+            await self.record_queue_wait(job)
+            
             # Update progress
-            await self.db.update_job_status(job['id'], 'processing', 5.0)
+            await self.update_status(job['id'], 'processing', 5.0)
             
-            # Download original file
-            original_path = f"temp_{job['file_id']}.mp4"
+            # Download original file into the job's working directory
+            job_dir = self.storage.job_dir(job['id'])
+            original_path = str(job_dir / f"source{Path(job['original_filename']).suffix or '.mp4'}")
+            heartbeat.beat('download')
+            async with self.track_stage(job['id'], 'download') as span:
+                await self.uploader.download(job['file_id'], original_path, progress=heartbeat.progress)
+                span['bytes'] = os.path.getsize(original_path)
             
-            # Simulate download progress
-            await self.db.update_job_status(job['id'], 'processing', 10.0)
+            await self.update_status(job['id'], 'processing', 10.0)
             
             # Define progress callback to update database
             async def progress_callback(progress: float):
-                await self.db.update_job_status(job['id'], 'processing', progress)
+                await self.update_status(job['id'], 'processing', progress)
                 # Also store in memory for real-time updates if needed
                 self.progress_callbacks[job['id']] = progress
 
             # Process video with progress tracking
-            await self.db.update_job_status(job['id'], 'processing', 15.0)
+            await self.update_status(job['id'], 'processing', 15.0)
             
-            # Compress video
-            compressed_paths = await self.processor.process_video_with_progress(
-                original_path,
-                job['target_resolution'],
-                lambda p: asyncio.create_task(progress_callback(p))
-            )            
-            if not compressed_paths:
-                raise Exception("No compressed files were created")
+            encoder_settings = await self.choose_encoder_settings(job)
+            heartbeat.beat('encode')
+            
+            # Compress video (the processor reports its own probe/encode metrics)
+            async with self.track_stage(job['id'], 'encode', observe=False) as span:
+                outputs = await self.processor.process_video_with_progress(
+                    original_path,
+                    job['target_resolution'],
+                    lambda p: asyncio.create_task(progress_callback(p)),
+                    output_dir=str(job_dir),
+                    encoder_settings=encoder_settings,
+                    heartbeat=heartbeat.beat
+                )
+                span['bytes'] = sum(output['size'] for output in outputs)
+            
+            # Complete the recorded decision with the content-aware rate control
+            encoder_settings['complexity'] = outputs[0].get('complexity')
+            encoder_settings['rate_control'] = {output['resolution']: output.get('rate_control') for output in outputs}
+            encoder_settings['streams'] = outputs[0].get('streams')
+            await self.db.set_job_encoder_settings(job['id'], encoder_settings)
+            self.view.update(job['id'], encoder_settings=encoder_settings)
             
             # Update progress for upload
-            await self.db.update_job_status(job['id'], 'processing', 85.0)
+            await self.update_status(job['id'], 'processing', 85.0)
             
             # Upload to channel
-            for compressed_path in compressed_paths:
-                channel_message = await self.uploader.upload_to_channel(
-                    compressed_path,
-                    f"Processed: {job['original_filename']} - {job['target_resolution']}"
-                )
+            channel_messages = []
+            heartbeat.beat('upload')
+            async with self.track_stage(job['id'], 'upload') as span:
+                for output in outputs:
+                    caption = f"Processed: {job['original_filename']} - {output['resolution']}"
+                    if output['size'] <= UPLOAD_SIZE_LIMIT:
+                        channel_messages.append(await self.uploader.upload_to_channel(
+                            output['path'], caption, heartbeat.progress, metadata=output, placements=placements
+                        ))
+                        continue
+                    
+                    # Too large for one message: cut at keyframes and upload as parts
+                    parts = await self.processor.split_output(output, UPLOAD_SIZE_LIMIT, heartbeat=heartbeat.beat)
+                    part_messages = await self.uploader.upload_multiple_to_channel(
+                        [part['path'] for part in parts], caption, metadata=parts,
+                        progress_callback=heartbeat.progress, placements=placements
+                    )
+                    if len(part_messages) != len(parts):
+                        raise TransientJobError(f"Uploaded {len(part_messages)} of {len(parts)} parts of {output['resolution']}")
+                    channel_messages.extend(part_messages)
+                span['bytes'] = sum(output['size'] for output in outputs)
             
-            await self.db.update_job_status(job['id'], 'completed', 100.0)
+            await self.db.set_job_channel_message(job['id'], channel_messages[0].id, placements)
+            stored = True
+            self.view.update(job['id'], channel_message_id=channel_messages[0].id, storage_messages=placements)
+            await self.update_status(job['id'], 'completed', 100.0)
             
-            # Notify user
-            await self.notify_user_completion(job['user_id'], channel_message, job)
+            # Notify the owner and everyone who attached to this job
+            for user_id in await self.job_recipients(job):
+                await self.notify_user_completion(user_id, channel_messages, job)
+                
+            logger.info(f"Job {job['id']} completed successfully")
             
-            # Cleanup temp files
-            import os
-            if os.path.exists(original_path):
-                os.remove(original_path)
-            for compressed_path in compressed_paths:
-                if os.path.exists(compressed_path):
-                    os.remove(compressed_path)
+        except Exception as e:
+            logger.error(f"Error processing job {job['id']}: {e}")
+            await self.handle_failure(job, e)
+        finally:
+            if placements and not stored:
+                # Nothing refers to the posts of an unfinished attempt; a retry uploads everything again
+                await self.uploader.delete_from_channel(placements)
+            # Cleanup temp files and give the reserved space back
+            await self.storage.release(job['id'])
             
             # Remove progress callback
             if job['id'] in self.progress_callbacks:
                 del self.progress_callbacks[job['id']]
-                
-            logger.info(f"Job {job['id']} completed successfully")
-            
+
+    @asynccontextmanager
+    async def track_stage(self, job_id: int, stage: str, observe: bool = True):
+        """Record a stage in the job timeline; set ``span['bytes']`` inside the block"""
+        span = {'bytes': None}
+        started_at = time.time()
+        try:
+            yield span
+        finally:
+            ended_at = time.time()
+            if observe:
+                metrics.STAGE_DURATION.observe(ended_at - started_at, stage=stage)
+            try:
+                await self.db.add_job_event(job_id, stage, started_at, ended_at, span['bytes'])
+            except Exception as e:
+                logger.error(f"Failed to record {stage} for job {job_id}: {e}")
+
+    async def choose_encoder_settings(self, job: Dict) -> Dict:
+        """Pick the encoder preset from backlog and wait, and record it on the job"""
+        pending = await self.db.get_pending_summary()
+        oldest = pending['oldest_created_at'] or job['created_at']
+        wait = time.time() - min(_utc_timestamp(oldest), _utc_timestamp(job['created_at']))
+        settings = self.encoding_policy.decide(pending['count'], wait)
+        
+        metrics.ENCODER_DECISIONS.inc(preset=settings['preset'])
+        logger.info(
+            f"Job {job['id']}: preset {settings['preset']} CRF +{settings['crf_offset']} "
+            f"({settings['reason']}, backlog {settings['backlog']}, wait {settings['wait']}s)"
+        )
+        await self.db.set_job_encoder_settings(job['id'], settings)
+        self.view.update(job['id'], encoder_settings=settings)
+        return settings
+
+    async def update_status(self, job_id: int, status: str, progress: float = None, error: str = None):
+        """Write a status change to the database, then to the job view"""
+        await self.db.update_job_status(job_id, status, progress, error)
+        if status == 'processing':
+            if progress is not None:
+                self.view.set_progress(job_id, progress)
+        else:
+            await self.view.refresh(job_id)
+
+    async def record_queue_wait(self, job: Dict):
+        """Record time between submission and a worker picking the job up"""
+        created_at = _utc_timestamp(job['created_at'])
+        now = time.time()
+        metrics.STAGE_DURATION.observe(now - created_at, stage='queue_wait')
+        await self.db.add_job_event(job['id'], 'queue_wait', created_at, now)
+
+    async def job_recipients(self, job: Dict) -> List[int]:
+        """Get the owner of a job followed by its subscribers"""
+        try:
+            return [job['user_id']] + await self.db.get_job_subscribers(job['id'])
         except Exception as e:
-            logger.error(f"Error processing job {job['id']}: {e}")
-            await self.db.update_job_status(job['id'], 'failed', 0.0, str(e))
+            logger.error(f"Failed to load subscribers of job {job['id']}: {e}")
+            return [job['user_id']]
+
+    async def notify_user_completion(self, user_id: int, channel_messages: List, job: Dict):
+        """Queue a job's channel messages for delivery to the user"""
+        self.pending_deliveries.setdefault(user_id, []).append((job, channel_messages))
+        await self.deliver_if_ready(user_id, job['file_unique_id'])
 
-    async def notify_user_completion(self, user_id: int, channel_message, job: Dict):
-        """Notify user that their video is ready"""
-        # This would send a message to the user via Pyrogram
+    async def restore_deliveries(self):
+        """Buffer again the results a previous run completed but never sent, and send those that are ready"""
+        undelivered = await self.db.get_undelivered_jobs()
+        messages = {}  # job_id -> channel messages, shared by the job's recipients
+        for user_id, job in undelivered:
+            if job['id'] not in messages:
+                messages[job['id']] = await self.load_channel_messages(job)
+            if messages[job['id']]:
+                self.pending_deliveries.setdefault(user_id, []).append((job, messages[job['id']]))
+        if undelivered:
+            logger.info(f"Restored {len(undelivered)} undelivered result(s) of {len(messages)} job(s)")
+        for user_id, file_unique_id in {(user_id, job['file_unique_id']) for user_id, job in undelivered}:
+            await self.deliver_if_ready(user_id, file_unique_id)
+
+    async def load_channel_messages(self, job: Dict) -> List:
+        """Fetch the channel messages holding a completed job's output"""
+        placements = job['storage_messages'] or [{'message_id': job['channel_message_id'], 'channel': None}]
+        channel_messages = []
+        for placement in placements:
+            message = await self.uploader.get_file_from_channel(placement['message_id'], placement['channel'])
+            if message:
+                channel_messages.append(message)
+        if len(channel_messages) < len(placements):
+            logger.error(f"Job {job['id']}: {len(placements) - len(channel_messages)} channel message(s) are gone")
+        return channel_messages
+
+    async def deliver_if_ready(self, user_id: int, file_unique_id: str):
+        """Send everything buffered for a user as one album once no rendition of the file is still queued"""
+        if user_id not in self.pending_deliveries:
+            return
+        if await self.db.get_active_job_count_for_file(user_id, file_unique_id) > 0:
+            return
+        
+        # Pop before sending so a concurrent completion cannot deliver twice
+        deliveries = self.pending_deliveries.pop(user_id, [])
+        if not deliveries:
+            return
+        
+        messages = [message for _, channel_messages in deliveries for message in channel_messages]
+        filenames = sorted({job['original_filename'] for job, _ in deliveries})
+        resolutions = ', '.join(job['target_resolution'] for job, _ in deliveries)
+        caption = f"✅ Your video is ready: {', '.join(filenames)} ({resolutions})"
+        
         try:
-            logger.info(f"Notified user {user_id} about completion of job {job['id']}")
+            await self.uploader.send_media_group_to_user(messages, user_id, caption)
+            await self.db.mark_jobs_delivered(user_id, [job['id'] for job, _ in deliveries])
+            logger.info(f"Delivered {len(messages)} file(s) to user {user_id} for jobs {[job['id'] for job, _ in deliveries]}")
         except Exception as e:
             logger.error(f"Error notifying user {user_id}: {e}")
 
-    async def add_job(self, user_id: int, file_id: str, filename: str, size: int, resolution: str) -> int:
-        """Add a job to the queue"""
-        job_id = await self.db.add_to_queue(user_id, file_id, filename, size, resolution)
+    async def add_job(self, user_id: int, file_id: str, filename: str, size: int, resolution: str,
+                      file_unique_id: str = None, priority: int = PRIORITY_NORMAL,
+                      estimated_cost: float = None) -> int:
+        """Add a job to the queue, or attach to an identical job already in flight"""
+        job_id = await self.db.add_to_queue(
+            user_id, file_id, filename, size, resolution, file_unique_id, priority, estimated_cost
+        )
+        job = await self.db.get_job_by_id(job_id)
+        if job:
+            self.view.add(job, user_id)
         logger.info(f"Added job {job_id} for user {user_id}")
+        self.work_available.set()
+        if priority > PRIORITY_NORMAL and job_id not in self.running_jobs:
+            await self.preempt_for(priority)
         return job_id
+
+    async def add_jobs(self, jobs: List[Dict]) -> List[int]:
+        """Add many jobs in one transaction and wake the workers once (deduplicated like ``add_job``)"""
+        if not jobs:
+            return []
+        job_ids = await self.db.add_jobs(jobs)
+        added = {job['id']: job for job in await self.db.get_jobs(job_ids)}
+        for job_id, job in zip(job_ids, jobs):
+            if job_id in added:
+                self.view.add(added[job_id], job['user_id'])
+        logger.info(f"Added {len(job_ids)} jobs ({job_ids[0]}-{job_ids[-1]})")
+        self.work_available.set()
+        priority = max(job.get('priority', PRIORITY_NORMAL) for job in jobs)
+        if priority > PRIORITY_NORMAL and not all(job_id in self.running_jobs for job_id in job_ids):
+            await self.preempt_for(priority)
+        return job_ids
+
     async def get_user_queue_position(self, user_id: int, job_id: int) -> tuple:
-        """Get user's position in queue"""
-        all_pending = await self.db.get_pending_jobs()
-        user_jobs = [job for job in all_pending if job['user_id'] == user_id]
-        
-        # Find the position of the specific job
-        position = None
-        for i, job in enumerate(all_pending):
-            if job['id'] == job_id:
-                position = i + 1
-                break
-        
-        return position, len(all_pending)
+        """Get a job's position in the queue and the queue length"""
+        return self.view.queue_position(job_id), self.view.pending_count
 
     async def get_job_progress(self, job_id: int) -> float:
         """Get progress for a specific job"""
-        job = await self.db.get_job_by_id(job_id)
+        job = self.view.get(job_id) or await self.db.get_job_by_id(job_id)
         if job:
             return job['progress']
         return 0.0
+
+    async def collect_metrics(self):
+        """Refresh scrape-time queue gauges"""
+        counts = await self.db.get_status_counts()
+        for status in ('pending', 'processing', 'completed', 'failed', 'cancelled'):
+            metrics.QUEUE_DEPTH.set(counts.get(status, 0), status=status)
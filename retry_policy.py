@@ -0,0 +1,52 @@
+import logging
+from typing import Optional
+from pyrogram.errors import RPCError, Flood, FloodWait, InternalServerError, ServiceUnavailable
+from config import MAX_JOB_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+
+logger = logging.getLogger(__name__)
+
+class TransientJobError(Exception):
+    """A failure that may not happen again (network, Telegram hiccup, stall)"""
+
+class PermanentJobError(Exception):
+    """A failure that will happen again on retry (unreadable source, bad request)"""
+
+class DurationLimitError(PermanentJobError):
+    """The downloaded video is longer than MAX_DURATION; the message is shown to the user"""
+
+class StageStalled(TransientJobError):
+    """A pipeline stage made no progress for longer than the stall timeout"""
+
+# Programming errors repeat on every attempt
+PERMANENT_ERRORS = (PermanentJobError, TypeError, ValueError, KeyError, AttributeError)
+# Telegram rate limits and server-side errors clear up by themselves
+TRANSIENT_RPC_ERRORS = (Flood, InternalServerError, ServiceUnavailable)
+
+class RetryPolicy:
+    """Decide whether a failed job is retried and after how long (exponential backoff, capped)"""
+
+    def __init__(self, max_attempts: int = MAX_JOB_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_transient(self, error: BaseException) -> bool:
+        if isinstance(error, TransientJobError):
+            return True
+        if isinstance(error, PERMANENT_ERRORS):
+            return False
+        if isinstance(error, RPCError):
+            return isinstance(error, TRANSIENT_RPC_ERRORS)
+        # I/O, timeouts and unknown errors
+        return True
+
+    def retry_delay(self, error: BaseException, attempts: int) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None if the job should fail; ``attempts`` includes the failed one"""
+        if attempts >= self.max_attempts or not self.is_transient(error):
+            return None
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        if isinstance(error, FloodWait):
+            # Never sooner than Telegram asked
+            delay = max(delay, error.value)
+        return delay
@@ -0,0 +1,105 @@
+import asyncio
+import shutil
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+from config import (
+    TEMP_DIR, RESOLUTIONS, TEMP_DISK_QUOTA, TEMP_MIN_FREE_SPACE,
+    TEMP_ORPHAN_TTL, TEMP_SWEEP_INTERVAL
+)
+from utils import clean_temp_files, format_bytes
+
+logger = logging.getLogger(__name__)
+
+# Extra headroom on top of the estimate (container overhead, thumbnails, logs)
+ESTIMATE_MARGIN = 1.1
+
+class StorageManager:
+    """Per-job working directories with disk reservations and orphan sweeping"""
+
+    def __init__(self, temp_dir: str = TEMP_DIR, quota: int = TEMP_DISK_QUOTA,
+                 min_free_space: int = TEMP_MIN_FREE_SPACE, orphan_ttl: int = TEMP_ORPHAN_TTL):
+        self.temp_dir = Path(temp_dir)
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.quota = quota
+        self.min_free_space = min_free_space
+        self.orphan_ttl = orphan_ttl
+        self.reservations: Dict[int, int] = {}  # job_id -> reserved bytes
+        self.sweeper_task: Optional[asyncio.Task] = None
+
+    def job_dir(self, job_id: int) -> Path:
+        """Get (and create) the working directory of a job"""
+        path = self.temp_dir / f"job_{job_id}"
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def estimate_job_bytes(self, job: Dict) -> int:
+        """Estimate disk needed for a job: the source plus every rendition, each assumed no larger than the source"""
+        source_size = job.get('original_size') or 0
+        renditions = 1 if job.get('target_resolution') in RESOLUTIONS else len(RESOLUTIONS)
+        return int(source_size * (1 + renditions) * ESTIMATE_MARGIN)
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(self.reservations.values())
+
+    def can_ever_fit(self, needed: int) -> bool:
+        """Check if a job could run on an otherwise idle system"""
+        total = shutil.disk_usage(self.temp_dir).total - self.min_free_space
+        if self.quota:
+            total = min(total, self.quota)
+        return needed <= total
+
+    def reserve(self, job_id: int, needed: int) -> bool:
+        """Preflight check: reserve space for a job if quota and free disk allow it"""
+        if job_id in self.reservations:
+            return False
+
+        reserved = self.reserved_bytes
+        if self.quota and reserved + needed > self.quota:
+            logger.debug(f"Quota full: {format_bytes(reserved)} reserved, job {job_id} needs {format_bytes(needed)}")
+            return False
+
+        # Space already reserved by running jobs is partly written; count all of it as used
+        free = shutil.disk_usage(self.temp_dir).free - reserved - self.min_free_space
+        if needed > free:
+            logger.debug(f"Not enough free space for job {job_id}: needs {format_bytes(needed)}, {format_bytes(max(free, 0))} available")
+            return False
+
+        self.reservations[job_id] = needed
+        return True
+
+    async def release(self, job_id: int):
+        """Drop a job's reservation and delete its working directory"""
+        self.reservations.pop(job_id, None)
+        path = self.temp_dir / f"job_{job_id}"
+        if path.exists():
+            # Multi-GB deletes can take a while; keep them off the event loop
+            await asyncio.to_thread(shutil.rmtree, path, True)
+
+    async def sweep_orphans(self):
+        """Delete temp entries older than the TTL that belong to no active job"""
+        active = {f"job_{job_id}" for job_id in self.reservations}
+        removed = await asyncio.to_thread(clean_temp_files, self.orphan_ttl, active)
+        if removed:
+            logger.info(f"Swept {removed} orphaned temp entr{'y' if removed == 1 else 'ies'}")
+
+    async def start_sweeper(self, interval: int = TEMP_SWEEP_INTERVAL):
+        """Start the background orphan sweeper"""
+        if self.sweeper_task is None:
+            self.sweeper_task = asyncio.create_task(self._sweep_loop(interval))
+
+    async def stop_sweeper(self):
+        """Stop the background orphan sweeper"""
+        if self.sweeper_task:
+            self.sweeper_task.cancel()
+            await asyncio.gather(self.sweeper_task, return_exceptions=True)
+            self.sweeper_task = None
+
+    async def _sweep_loop(self, interval: int):
+        while True:
+            try:
+                await self.sweep_orphans()
+            except Exception as e:
+                logger.error(f"Temp sweep failed: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+import config
+from auth_manager import AuthManager
+from database import DatabaseManager
+
+ADMIN_ID = 1
+CONFIGURED_ID = 2
+USER_ID = 3
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager()
+    manager.db_path = str(tmp_path / 'queue.db')
+    asyncio.run(manager.initialize())
+    return manager
+
+@pytest.fixture
+def auth(db, monkeypatch):
+    monkeypatch.setattr(config, 'REQUIRE_AUTHENTICATION', True)
+    monkeypatch.setattr(config, 'ADMIN_USERS', str(ADMIN_ID))
+    monkeypatch.setattr(config, 'AUTHORIZED_USERS', f'{CONFIGURED_ID}, not-an-id')
+    return AuthManager(db)
+
+@pytest.fixture
+def user_reads(db, monkeypatch):
+    """Count the user lookups that reach the database"""
+    reads = []
+    get_user = db.get_user
+
+    async def counting_get_user(user_id):
+        reads.append(user_id)
+        return await get_user(user_id)
+    monkeypatch.setattr(db, 'get_user', counting_get_user)
+    return reads
+
+def user(user_id: int, username: str = 'someone') -> dict:
+    return {'id': user_id, 'username': username, 'first_name': 'Some', 'last_name': 'One'}
+
+def test_configured_users_never_read_the_database(auth, user_reads):
+    assert asyncio.run(auth.is_user_authorized(ADMIN_ID))
+    assert asyncio.run(auth.is_user_authorized(CONFIGURED_ID))
+    assert user_reads == []
+
+def test_decision_is_cached(auth, db, user_reads):
+    asyncio.run(db.add_user(user(USER_ID)))
+
+    async def check_twice():
+        return [await auth.is_user_authorized(USER_ID) for _ in range(2)]
+
+    assert asyncio.run(check_twice()) == [False, False]
+    assert user_reads == [USER_ID]
+
+def test_unregistered_users_are_not_cached(auth, user_reads):
+    async def check_twice():
+        return [(await auth.get_authorization_status(USER_ID))['message'] for _ in range(2)]
+
+    assert asyncio.run(check_twice()) == ['User not registered'] * 2
+    assert user_reads == [USER_ID, USER_ID]
+
+def test_authorization_change_takes_effect_at_once(auth, db):
+    asyncio.run(db.add_user(user(USER_ID)))
+
+    async def grant_then_revoke():
+        results = [await auth.is_user_authorized(USER_ID)]
+        await auth.add_authorized_user(ADMIN_ID, USER_ID)
+        results.append(await auth.is_user_authorized(USER_ID))
+        await auth.remove_authorized_user(ADMIN_ID, USER_ID)
+        results.append(await auth.is_user_authorized(USER_ID))
+        return results
+
+    assert asyncio.run(grant_then_revoke()) == [False, True, False]
+
+def test_only_admins_change_authorization(auth, db):
+    asyncio.run(db.add_user(user(USER_ID)))
+    assert not asyncio.run(auth.add_authorized_user(CONFIGURED_ID, USER_ID))
+    assert not asyncio.run(auth.is_user_authorized(USER_ID))
+
+def test_expired_decision_is_read_again(auth, db, user_reads):
+    auth.cache_ttl = 0
+    asyncio.run(db.add_user(user(USER_ID)))
+    asyncio.run(auth.is_user_authorized(USER_ID))
+    asyncio.run(auth.is_user_authorized(USER_ID))
+    assert user_reads == [USER_ID, USER_ID]
+
+def test_cache_is_bounded(auth, db):
+    auth.cache_size = 3
+    for user_id in range(10, 20):
+        asyncio.run(db.add_user(user(user_id)))
+        asyncio.run(auth.is_user_authorized(user_id))
+    assert list(auth.cache) == [17, 18, 19]
+
+def test_repeat_sender_is_not_written_again(auth, db, monkeypatch):
+    writes = []
+    add_user = db.add_user
+
+    async def counting_add_user(user_data):
+        writes.append(user_data['id'])
+        return await add_user(user_data)
+    monkeypatch.setattr(db, 'add_user', counting_add_user)
+
+    async def register():
+        return [
+            await auth.register_user(user(USER_ID)),
+            await auth.register_user(user(USER_ID)),
+            await auth.register_user(user(USER_ID, 'renamed'))
+        ]
+
+    assert asyncio.run(register()) == [True, False, True]
+    assert writes == [USER_ID, USER_ID]
+
+def test_configured_user_is_registered_authorized(auth, db):
+    asyncio.run(auth.register_user(user(CONFIGURED_ID)))
+    assert asyncio.run(db.get_user(CONFIGURED_ID))['is_authorized']
@@ -0,0 +1,107 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from database import DatabaseManager, PENDING_JOBS_QUERY
+
+def make_jobs(count: int):
+    return [
+        {'user_id': i % 50, 'file_id': f'file{i}', 'filename': f'video{i}.mp4', 'size': 1000,
+         'resolution': '720p', 'priority': i % 3}
+        for i in range(count)
+    ]
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager()
+    manager.db_path = str(tmp_path / 'queue.db')
+    asyncio.run(manager.initialize())
+    return manager
+
+def query_plan(db_path: str, sql: str) -> str:
+    with sqlite3.connect(db_path) as conn:
+        return '\n'.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}'))
+
+@pytest.mark.parametrize('analyzed', [False, True])
+def test_pending_jobs_use_priority_index(db, analyzed):
+    # A mostly finished queue, as in production, before and after the first ANALYZE
+    asyncio.run(db.add_jobs(make_jobs(2000)))
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("""
+            UPDATE video_queue SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+            WHERE id % 20 != 0
+        """)
+    if analyzed:
+        asyncio.run(db.optimize())
+
+    plan = query_plan(db.db_path, PENDING_JOBS_QUERY)
+    assert 'idx_pending_priority' in plan
+    assert 'TEMP B-TREE' not in plan
+
+def test_pending_jobs_order(db):
+    asyncio.run(db.add_jobs(make_jobs(6)))
+    jobs = asyncio.run(db.get_pending_jobs())
+    assert [job['file_id'] for job in jobs] == ['file2', 'file5', 'file1', 'file4', 'file0', 'file3']
+
+def test_optimize_returns_free_pages(db):
+    asyncio.run(db.add_jobs(make_jobs(3000)))
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute('DELETE FROM video_queue')
+        assert conn.execute('PRAGMA freelist_count').fetchone()[0] > 0
+    asyncio.run(db.optimize())
+    with sqlite3.connect(db.db_path) as conn:
+        assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
+
+def test_optimize_without_incremental_vacuum(tmp_path):
+    manager = DatabaseManager()
+    manager.db_path = str(tmp_path / 'plain.db')
+    with sqlite3.connect(manager.db_path) as conn:
+        conn.execute('CREATE TABLE t (x)')
+        conn.executemany('INSERT INTO t VALUES (?)', [(b'x' * 1000,)] * 1000)
+        conn.execute('DELETE FROM t')
+    asyncio.run(asyncio.wait_for(manager.optimize(), 10))
+
+def test_stage_percentiles(db):
+    durations = [float(i) for i in range(1, 201)]
+    with sqlite3.connect(db.db_path) as conn:
+        conn.executemany(
+            'INSERT INTO job_events (job_id, stage, started_at, ended_at, duration) VALUES (?, ?, ?, ?, ?)',
+            [(i, 'encode', 1000.0, 1000.0 + i, duration) for i, duration in enumerate(reversed(durations))]
+            + [(1, 'upload', 0.0, 10.0, 99.0)]  # ended before the window
+        )
+    stats = asyncio.run(db.get_stage_percentiles(500.0))
+
+    assert set(stats) == {'encode'}
+    assert stats['encode']['count'] == 200
+    # Nearest rank: the value at index int(n * pct / 100) of the sorted durations
+    assert stats['encode']['percentiles'] == {50: 101.0, 90: 181.0, 99: 199.0}
+
+def test_slowest_jobs_include_archive(db):
+    asyncio.run(db.add_jobs(make_jobs(4)))
+    with sqlite3.connect(db.db_path) as conn:
+        for job_id, minutes in ((1, 5), (2, 30), (3, 10), (4, 60)):
+            conn.execute(f"""
+                UPDATE video_queue SET status = 'completed', completed_at = datetime('now'),
+                                       created_at = datetime('now', '-{minutes} minutes')
+                WHERE id = ?
+            """, (job_id,))
+        # Archived early, as with a short JOB_ARCHIVE_AGE
+        conn.execute('INSERT INTO video_queue_archive SELECT * FROM video_queue WHERE id = 2')
+        conn.execute('DELETE FROM video_queue WHERE id = 2')
+
+    slowest = asyncio.run(db.get_slowest_jobs(hours=24, limit=3))
+    assert [job['id'] for job in slowest] == [4, 2, 3]
+    assert round(slowest[0]['total_seconds']) == 3600
+
+def test_add_user_writes_only_changes(db):
+    profile = {'id': 7, 'username': 'someone', 'first_name': 'Some', 'last_name': None}
+    assert asyncio.run(db.add_user(profile))
+    assert not asyncio.run(db.add_user(profile))
+    asyncio.run(db.authorize_user(7))
+    assert asyncio.run(db.add_user({**profile, 'username': 'renamed'}))
+
+    user = asyncio.run(db.get_user(7))
+    assert user['username'] == 'renamed'
+    # A profile refresh keeps the authorization
+    assert user['is_authorized']
@@ -0,0 +1,116 @@
+import asyncio
+import os
+
+import pytest
+from pyrogram.errors import FloodWait
+
+import multipart_upload
+from multipart_upload import BIG_FILE_SIZE, MultipartUpload
+
+PART_SIZE = 64 * 1024
+
+class FakeInvoke:
+    """Stands in for Session.invoke: records every SaveBigFilePart and can fail chosen parts"""
+
+    def __init__(self, failures: dict = None, delay: float = 0):
+        self.failures = dict(failures or {})  # part -> exception, or number of ConnectionErrors to raise
+        self.delay = delay
+        self.parts = {}
+        self.calls = []
+
+    async def __call__(self, request):
+        self.calls.append(request.file_part)
+        await asyncio.sleep(self.delay)
+        failure = self.failures.get(request.file_part)
+        if isinstance(failure, Exception):
+            raise failure
+        if failure:
+            self.failures[request.file_part] -= 1
+            raise ConnectionError("connection reset")
+        self.parts[request.file_part] = (request.file_total_parts, request.bytes)
+        return True
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(multipart_upload, 'PART_RETRY_DELAY', 0)
+
+@pytest.fixture
+def big_file(tmp_path):
+    path = tmp_path / 'output.mp4'
+    path.write_bytes(os.urandom(BIG_FILE_SIZE + 3 * PART_SIZE + 123))
+    return str(path)
+
+def reassemble(invoke: FakeInvoke) -> bytes:
+    return b''.join(invoke.parts[part][1] for part in sorted(invoke.parts))
+
+def test_parts_reassemble_to_file(big_file):
+    invokers = [FakeInvoke(), FakeInvoke()]
+    stats = asyncio.run(MultipartUpload(invokers, parallelism=4, part_size=PART_SIZE).upload(big_file, 1))
+
+    total_parts = stats['parts']
+    assert total_parts == -(-os.path.getsize(big_file) // PART_SIZE)
+    assert stats['input_file'].parts == total_parts
+    # Every part is sent exactly once, over both connections
+    assert sorted(invokers[0].calls + invokers[1].calls) == list(range(total_parts))
+    assert all(invoke.calls for invoke in invokers)
+
+    received = {}
+    for invoke in invokers:
+        received.update(invoke.parts)
+    assert {total for total, _ in received.values()} == {total_parts}
+    with open(big_file, 'rb') as f:
+        assert b''.join(received[part][1] for part in range(total_parts)) == f.read()
+
+def test_failed_part_is_retried(big_file):
+    invoke = FakeInvoke(failures={3: 2})
+    asyncio.run(MultipartUpload([invoke], parallelism=2, part_size=PART_SIZE).upload(big_file, 1))
+
+    assert invoke.calls.count(3) == 3
+    with open(big_file, 'rb') as f:
+        assert reassemble(invoke) == f.read()
+
+def test_part_failing_every_attempt_fails_upload(big_file):
+    invoke = FakeInvoke(failures={5: multipart_upload.PART_ATTEMPTS})
+    with pytest.raises(ConnectionError, match='part 5'):
+        asyncio.run(MultipartUpload([invoke], parallelism=2, part_size=PART_SIZE).upload(big_file, 1))
+    assert invoke.calls.count(5) == multipart_upload.PART_ATTEMPTS
+
+def test_flood_wait_is_not_retried(big_file):
+    invoke = FakeInvoke(failures={0: FloodWait(value=30)})
+    with pytest.raises(FloodWait):
+        asyncio.run(MultipartUpload([invoke], parallelism=1, part_size=PART_SIZE).upload(big_file, 1))
+    assert invoke.calls == [0]
+
+def test_failure_stops_other_workers(big_file):
+    invoke = FakeInvoke(failures={2: ValueError("bad part")}, delay=0.001)
+    with pytest.raises(ConnectionError):
+        asyncio.run(MultipartUpload([invoke], parallelism=4, part_size=PART_SIZE, attempts=1).upload(big_file, 1))
+    # Only the parts already in flight when part 2 failed were sent
+    assert len(invoke.calls) < 10
+
+def test_cancel_stops_upload(big_file):
+    invoke = FakeInvoke(delay=0.01)
+
+    async def cancel_midway():
+        task = asyncio.create_task(MultipartUpload([invoke], parallelism=2, part_size=PART_SIZE).upload(big_file, 1))
+        while len(invoke.calls) < 4:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        sent = len(invoke.calls)
+        await asyncio.sleep(0.05)
+        return sent
+
+    sent = asyncio.run(cancel_midway())
+    assert len(invoke.calls) == sent < 10
+
+def test_missing_parts_are_uploaded_again(big_file):
+    invoke = FakeInvoke()
+    upload = MultipartUpload([invoke], parallelism=2, part_size=PART_SIZE)
+    stats = asyncio.run(upload.upload(big_file, 1))
+    del invoke.parts[7]
+
+    asyncio.run(upload.upload_parts(big_file, 1, [7], part_size=stats['part_size']))
+    with open(big_file, 'rb') as f:
+        assert reassemble(invoke) == f.read()
@@ -0,0 +1,360 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import queue_manager
+import video_processor
+from database import DatabaseManager
+from preemption import PreemptionPolicy, PRIORITY_HIGH
+from queue_manager import QueueManager, CANCEL_STOPPED, _utc_timestamp
+from retry_policy import PermanentJobError, RetryPolicy, TransientJobError
+from storage_manager import StorageManager
+from video_processor import VideoProcessor
+
+class FakeUploader:
+    """Stands in for ChannelUploader: downloads write a small file, uploads post numbered channel messages"""
+
+    def __init__(self):
+        self.started = False
+        self.messages = {}  # message id -> channel message
+        self.delivered = []  # (user_id, message ids)
+
+    def message(self, message_id: int):
+        return SimpleNamespace(id=message_id, chat=SimpleNamespace(id=-100), video=None, caption='')
+
+    async def download(self, file_id, file_path, progress=None):
+        if not self.started:
+            raise AttributeError("'NoneType' object has no attribute 'execute'")  # Pyrogram before start()
+        with open(file_path, 'wb') as f:
+            f.write(b'source')
+        return file_path
+
+    async def upload_to_channel(self, file_path, caption='', progress_callback=None, metadata=None, placements=None):
+        message = self.message(len(self.messages) + 1)
+        self.messages[message.id] = message
+        if placements is not None:
+            placements.append({'message_id': message.id, 'channel': message.chat.id, 'client': 'bot'})
+        return message
+
+    async def get_file_from_channel(self, message_id, channel_id=None):
+        return self.messages.get(message_id)
+
+    async def send_media_group_to_user(self, messages, user_chat_id, additional_caption=''):
+        self.delivered.append((user_chat_id, [message.id for message in messages]))
+        return messages
+
+class FakeProcessor:
+    """Stands in for VideoProcessor: every encode takes ``delay`` seconds and yields one small output"""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.runs = []  # job directory of every encode started
+
+    async def process_video_with_progress(self, input_path, resolution, progress_callback=None, output_dir=None,
+                                          encoder_settings=None, heartbeat=None):
+        self.runs.append(Path(output_dir).name)
+        await asyncio.sleep(self.delay)
+        path = f"{output_dir}/{resolution}.mp4"
+        with open(path, 'wb') as f:
+            f.write(b'output')
+        return [{'path': path, 'size': 6, 'resolution': resolution}]
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager()
+    manager.db_path = str(tmp_path / 'queue.db')
+    asyncio.run(manager.initialize())
+    return manager
+
+@pytest.fixture
+def make_queue(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'TEMP_DIR', str(tmp_path / 'temp'))
+
+    async def no_maintenance():
+        pass
+    # Tested in test_database; stopping it mid-connect would leave an aiosqlite thread running
+    monkeypatch.setattr(db, 'start_maintenance', no_maintenance)
+
+    def make_queue(processor=None, uploader=None, workers: int = 1, quota: int = 0, **kwargs):
+        monkeypatch.setattr(queue_manager, 'MAX_CONCURRENT_PROCESSES', workers)
+        return QueueManager(
+            db, processor or FakeProcessor(), uploader or FakeUploader(),
+            storage=StorageManager(str(tmp_path / 'temp'), quota=quota, min_free_space=0), **kwargs
+        )
+    return make_queue
+
+def add_jobs(db: DatabaseManager, count: int, user_id: int = 1, **fields):
+    jobs = [
+        dict({'user_id': user_id, 'file_id': f'file{i}', 'file_unique_id': f'unique{i}', 'filename': f'video{i}.mp4',
+              'size': 1000, 'resolution': '720p'}, **fields)
+        for i in range(count)
+    ]
+    return asyncio.run(db.add_jobs(jobs))
+
+def set_status(db: DatabaseManager, status: str, job_ids):
+    with sqlite3.connect(db.db_path) as conn:
+        conn.executemany('UPDATE video_queue SET status = ? WHERE id = ?', [(status, job_id) for job_id in job_ids])
+
+async def wait_until(condition, timeout: float = 10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+async def statuses(db: DatabaseManager, job_ids) -> list:
+    return [job['status'] for job in sorted(await db.get_jobs(job_ids), key=lambda job: job['id'])]
+
+def test_restart_resumes_processing_jobs(db, make_queue):
+    # The previous run died with both jobs processing
+    job_ids = add_jobs(db, 2)
+    set_status(db, 'processing', job_ids)
+    uploader = FakeUploader()
+    queue = make_queue(uploader=uploader, workers=2)
+
+    async def restart():
+        # Started the way app.py does: clients first, then the queue
+        uploader.started = True
+        await queue.start_processing()
+        try:
+            await wait_until(delivered(uploader, 2))
+        finally:
+            await queue.stop_processing(grace_period=0)
+        return await statuses(db, job_ids)
+
+    assert asyncio.run(restart()) == ['completed', 'completed']
+    assert sorted(user for user, _ in uploader.delivered) == [1, 1]
+
+def delivered(uploader: FakeUploader, count: int = 1):
+    async def condition():
+        return len(uploader.delivered) >= count
+    return condition
+
+def complete_job(db: DatabaseManager, job_id: int, message_id: int):
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute('''
+            UPDATE video_queue SET status = 'completed', completed_at = CURRENT_TIMESTAMP, channel_message_id = ?,
+                storage_messages = ? WHERE id = ?
+        ''', (message_id, f'[{{"message_id": {message_id}, "channel": -100, "client": "bot"}}]', job_id))
+
+def test_restart_delivers_buffered_results(db, make_queue):
+    # The 480p rendition was done but waiting for the 720p one when the previous run stopped
+    first, second = asyncio.run(db.add_jobs([
+        {'user_id': 1, 'file_id': 'file', 'file_unique_id': 'same', 'filename': 'video.mp4', 'size': 1000,
+         'resolution': resolution}
+        for resolution in ('480p', '720p')
+    ]))
+    set_status(db, 'processing', [second])
+    complete_job(db, first, 1)
+    uploader = FakeUploader()
+    uploader.messages[1] = uploader.message(1)
+    uploader.started = True
+    queue = make_queue(uploader=uploader)
+
+    async def restart():
+        await queue.start_processing()
+        try:
+            await wait_until(delivered(uploader))
+        finally:
+            await queue.stop_processing(grace_period=0)
+        return await db.get_undelivered_jobs()
+
+    assert asyncio.run(restart()) == []
+    # Both renditions still arrive together
+    assert uploader.delivered == [(1, [1, 2])]
+
+def test_delivered_results_are_not_sent_again(db, make_queue):
+    (job_id,) = add_jobs(db, 1)
+    asyncio.run(db.add_to_queue(2, 'file0', 'video0.mp4', 1000, '720p', 'unique0'))  # subscribes user 2
+    complete_job(db, job_id, 1)
+    asyncio.run(db.mark_jobs_delivered(1, [job_id]))
+    uploader = FakeUploader()
+    uploader.messages[1] = uploader.message(1)
+    uploader.started = True
+
+    async def restart_twice():
+        for _ in range(2):
+            queue = make_queue(uploader=uploader)
+            await queue.start_processing()
+            await queue.stop_processing(grace_period=0)
+
+    asyncio.run(restart_twice())
+    # Only the subscriber was still owed the result, and only once
+    assert uploader.delivered == [(2, [1])]
+
+def test_job_too_big_for_storage_releases_siblings(db, make_queue):
+    # The 480p rendition runs first; the 720p one can never fit and is rejected afterwards
+    small, big = asyncio.run(db.add_jobs([
+        {'user_id': 1, 'file_id': 'file', 'file_unique_id': 'same', 'filename': 'video.mp4', 'size': size,
+         'resolution': resolution, 'priority': priority}
+        for resolution, size, priority in (('480p', 1000, 1), ('720p', 10 ** 9, 0))
+    ]))
+    uploader = FakeUploader()
+    uploader.started = True
+    queue = make_queue(uploader=uploader, quota=10 ** 6)
+
+    async def run():
+        await queue.start_processing()
+        try:
+            await wait_until(delivered(uploader))
+        finally:
+            await queue.stop_processing(grace_period=0)
+        return await statuses(db, [small, big])
+
+    assert asyncio.run(run()) == ['completed', 'failed']
+    assert uploader.delivered == [(1, [1])]
+
+@pytest.mark.skipif(not hasattr(os, 'mkfifo') or not shutil.which('ffmpeg'), reason="needs FFmpeg and named pipes")
+def test_cancel_during_encode_kills_ffmpeg(db, make_queue, monkeypatch):
+    # The source is a pipe nobody writes to, so FFmpeg runs until it is killed
+    class PipeUploader(FakeUploader):
+        async def download(self, file_id, file_path, progress=None):
+            os.mkfifo(file_path)
+            return file_path
+
+    async def no_probe(path, timeout=None):
+        return {}
+    monkeypatch.setattr(video_processor, 'get_video_info', no_probe)
+    processes = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def recording_exec(*args, **kwargs):
+        process = await create_subprocess_exec(*args, **kwargs)
+        processes.append(process)
+        return process
+    monkeypatch.setattr(asyncio, 'create_subprocess_exec', recording_exec)
+
+    processor = VideoProcessor()
+    processor.analyzer.enabled = False
+    (job_id,) = add_jobs(db, 1)
+    queue = make_queue(processor=processor, uploader=PipeUploader())
+
+    async def cancel_encode():
+        await queue.start_processing()
+        try:
+            await wait_until(lambda: _has(processes))
+            result = await queue.cancel_job(job_id, 1)
+            await wait_until(lambda: _has_status(db, job_id, 'cancelled'))
+        finally:
+            await queue.stop_processing(grace_period=0)
+        return result
+
+    assert asyncio.run(cancel_encode()) == CANCEL_STOPPED
+    assert len(processes) == 1 and processes[0].returncode is not None
+    assert queue.running_jobs == {}
+
+def test_high_priority_job_preempts_running_job(db, make_queue):
+    processor = FakeProcessor(delay=0.5)
+    queue = make_queue(processor=processor, preemption_policy=PreemptionPolicy(enabled=True))
+    uploader = queue.uploader
+    uploader.started = True
+    (low,) = add_jobs(db, 1)
+
+    async def preempt():
+        await queue.start_processing()
+        try:
+            await wait_until(lambda: _has(processor.runs))
+            high = await queue.add_job(2, 'urgent', 'urgent.mp4', 1000, '720p', 'urgent', priority=PRIORITY_HIGH)
+            await wait_until(delivered(uploader, 2))
+        finally:
+            await queue.stop_processing(grace_period=0)
+        return high, await statuses(db, [low, high])
+
+    high, final = asyncio.run(preempt())
+    # The normal job was requeued, the urgent one ran, then the normal one started over
+    assert processor.runs == [f'job_{low}', f'job_{high}', f'job_{low}']
+    assert final == ['completed', 'completed']
+
+async def _has(items) -> bool:
+    return bool(items)
+
+async def _has_status(db: DatabaseManager, job_id: int, status: str) -> bool:
+    return (await db.get_job_by_id(job_id))['status'] == status
+
+class FailingProcessor(FakeProcessor):
+    def __init__(self, error: Exception):
+        super().__init__()
+        self.error = error
+
+    async def process_video_with_progress(self, *args, **kwargs):
+        await super().process_video_with_progress(*args, **kwargs)
+        raise self.error
+
+def run_failing_job(db, make_queue, error: Exception) -> tuple:
+    processor = FailingProcessor(error)
+    queue = make_queue(processor=processor, retry_policy=RetryPolicy(max_attempts=3, base_delay=60))
+    queue.uploader.started = True
+    (job_id,) = add_jobs(db, 1)
+
+    async def run():
+        await queue.start_processing()
+        try:
+            await wait_until(lambda: _left_processing(db, job_id, processor))
+            # Give a worker the chance to pick a retried job up too early
+            await asyncio.sleep(0.2)
+        finally:
+            await queue.stop_processing(grace_period=0)
+        return await db.get_job_by_id(job_id)
+
+    return asyncio.run(run()), processor
+
+@pytest.mark.parametrize('error', [AttributeError("'NoneType' object has no attribute 'x'"), PermanentJobError("bad input")])
+def test_permanent_failure_fails_job_at_once(db, make_queue, error):
+    job, processor = run_failing_job(db, make_queue, error)
+    assert job['status'] == 'failed'
+    assert job['error_message'] == str(error)
+    assert job['attempts'] == 0
+    assert len(processor.runs) == 1
+
+def test_transient_failure_requeues_job_with_backoff(db, make_queue):
+    job, processor = run_failing_job(db, make_queue, TransientJobError("connection reset"))
+    assert job['status'] == 'pending'
+    assert job['attempts'] == 1
+    assert job['error_message'] == "connection reset"
+    assert 50 < _utc_timestamp(job['retry_at']) - time.time() <= 60
+    # Not claimed again before its retry time
+    assert len(processor.runs) == 1
+
+async def _left_processing(db: DatabaseManager, job_id: int, processor: FakeProcessor) -> bool:
+    return bool(processor.runs) and (await db.get_job_by_id(job_id))['status'] != 'processing'
+
+def test_job_view_matches_database(db, make_queue):
+    queue = make_queue()
+    view = queue.view
+
+    async def check(job_ids):
+        for job_id in job_ids:
+            assert view.get(job_id) == await db.get_job_by_id(job_id)
+        pending = [job['id'] for job in await db.get_pending_jobs()]
+        assert [view.queue_position(job_id) for job_id in pending] == list(range(1, len(pending) + 1))
+        assert view.pending_count == len(pending)
+        assert [job['id'] for job in await view.user_jobs(1)] == [job['id'] for job in await db.get_user_jobs(1)]
+
+    async def lifecycle():
+        await view.user_jobs(1)  # Loaded, so the user's finished jobs stay in the view
+        job_ids = await queue.add_jobs([
+            {'user_id': 1, 'file_id': f'file{i}', 'file_unique_id': f'unique{i}', 'filename': f'video{i}.mp4',
+             'size': 1000, 'resolution': '720p', 'priority': i}
+            for i in range(3)
+        ])
+        await check(job_ids)
+
+        claimed = await queue.claim_next_job(await db.get_pending_jobs())
+        assert claimed['id'] == job_ids[2]  # Highest priority first
+        await queue.update_status(claimed['id'], 'processing', 40.0)
+        await check(job_ids)
+
+        await queue.update_status(claimed['id'], 'completed', 100.0)
+        await check(job_ids)
+
+        assert await queue.cancel_job(job_ids[1], 1) == CANCEL_STOPPED
+        await check(job_ids)
+        return [view.get(job_id)['status'] for job_id in job_ids]
+
+    assert asyncio.run(lifecycle()) == ['pending', 'cancelled', 'completed']
@@ -0,0 +1,36 @@
+import pytest
+from pyrogram.errors import FloodWait, InternalServerError, MessageIdInvalid
+
+from retry_policy import DurationLimitError, PermanentJobError, RetryPolicy, StageStalled, TransientJobError
+
+@pytest.mark.parametrize('error', [
+    PermanentJobError("unreadable source"), DurationLimitError("too long"), AttributeError("bug"),
+    TypeError("bug"), ValueError("bug"), KeyError("bug"), MessageIdInvalid()
+])
+def test_permanent_errors_are_not_retried(error):
+    policy = RetryPolicy(max_attempts=3)
+    assert not policy.is_transient(error)
+    assert policy.retry_delay(error, 1) is None
+
+@pytest.mark.parametrize('error', [
+    TransientJobError("killed"), StageStalled("no progress"), ConnectionError("reset"), OSError("I/O"),
+    TimeoutError(), InternalServerError(), FloodWait(value=5)
+])
+def test_transient_errors_are_retried(error):
+    policy = RetryPolicy(max_attempts=3)
+    assert policy.is_transient(error)
+    assert policy.retry_delay(error, 1) is not None
+
+def test_backoff_doubles_up_to_the_cap():
+    policy = RetryPolicy(max_attempts=10, base_delay=60, max_delay=300)
+    delays = [policy.retry_delay(ConnectionError(), attempts) for attempts in range(1, 6)]
+    assert delays == [60, 120, 240, 300, 300]
+
+def test_no_retry_after_the_last_attempt():
+    policy = RetryPolicy(max_attempts=3, base_delay=1)
+    assert policy.retry_delay(ConnectionError(), 2) == 2
+    assert policy.retry_delay(ConnectionError(), 3) is None
+
+def test_flood_wait_is_honoured():
+    policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=10)
+    assert policy.retry_delay(FloodWait(value=600), 1) == 600
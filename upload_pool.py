@@ -0,0 +1,57 @@
+import time
+from typing import Iterable, List, Tuple
+from config import UPLOAD_COOLDOWN
+
+class PoolMember:
+    """A client or storage channel uploads are spread over"""
+
+    def __init__(self, name: str, value):
+        self.name = name
+        self.value = value
+        self.active = 0  # uploads in progress
+        self.uploads = 0  # uploads completed
+        self.failures = 0  # failures since the last success
+        self.unavailable_until = 0.0  # monotonic time
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unavailable_until
+
+class UploadPool:
+    """Pick the client and the storage channel of each upload by load and health"""
+
+    def __init__(self, clients: List[Tuple[str, object]], channels: List, cooldown: int = UPLOAD_COOLDOWN):
+        self.clients = [PoolMember(name, client) for name, client in clients]
+        self.channels = [PoolMember(str(channel), channel) for channel in channels]
+        self.cooldown = cooldown
+
+    @staticmethod
+    def pick(members: List[PoolMember], exclude: Iterable[PoolMember] = ()) -> PoolMember:
+        """Choose among ``members``, avoiding ``exclude`` (already tried) when others are left"""
+        exclude = set(exclude)
+        candidates = [member for member in members if member not in exclude] or members
+        healthy = [member for member in candidates if member.healthy]
+        if not healthy:
+            return min(candidates, key=lambda member: member.unavailable_until)
+        # Fewest uploads in progress, then fewest recent failures, then least used
+        return min(healthy, key=lambda member: (member.active, member.failures, member.uploads))
+
+    @staticmethod
+    def has_alternative(members: List[PoolMember], tried: Iterable[PoolMember]) -> bool:
+        """Whether a healthy member that hasn't been tried is left"""
+        tried = set(tried)
+        return any(member.healthy and member not in tried for member in members)
+
+    def bench(self, member: PoolMember, seconds: float = None):
+        """Stop choosing a member that failed for ``seconds`` (default: the cooldown)"""
+        member.failures += 1
+        member.unavailable_until = time.monotonic() + (self.cooldown if seconds is None else seconds)
+
+    def succeeded(self, *members: PoolMember):
+        for member in members:
+            member.uploads += 1
+            member.failures = 0
+
+    def remove_client(self, name: str):
+        """Drop a client that couldn't be started"""
+        self.clients = [member for member in self.clients if member.name != name]
@@ -1,36 +1,100 @@
-import subprocess
 import json
 import os
 import asyncio
-from typing import Dict, Optional
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional
 import logging
 import aiofiles
 from pathlib import Path
+import config
 
 logger = logging.getLogger(__name__)
 
-def get_video_info(file_path: str) -> Dict:
-    """Get video information using ffprobe"""
+def _stream_summary(stream: Dict) -> Dict:
+    """Reduce an ffprobe stream entry to what stream planning needs"""
+    # Matroska stores per-stream bitrates as a BPS tag
+    bit_rate = stream.get('bit_rate') or stream.get('tags', {}).get('BPS')
+    return {
+        'index': stream['index'],
+        'type': stream.get('codec_type'),
+        'codec': stream.get('codec_name', 'unknown'),
+        'bit_rate': int(bit_rate) if bit_rate and str(bit_rate).isdigit() else None,
+        'channels': stream.get('channels')
+    }
+
+def _parse_rate(rate: Optional[str]) -> float:
+    """Convert an ffprobe rate such as "30000/1001" to frames per second; 0 if unknown"""
+    num, _, den = (rate or '').partition('/')
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+def _parse_probe(info: Dict) -> Dict:
+    """Convert ffprobe's JSON output to the video info dict"""
+    video_stream = next((stream for stream in info['streams'] if stream['codec_type'] == 'video'), None)
+    
+    return {
+        'duration': float(info['format'].get('duration', 0)),
+        'size': int(info['format'].get('size', 0)),
+        'width': int(video_stream['width']) if video_stream else 0,
+        'height': int(video_stream['height']) if video_stream else 0,
+        'codec': video_stream.get('codec_name', 'unknown') if video_stream else 'unknown',
+        'frame_rate': _parse_rate(video_stream.get('avg_frame_rate')) if video_stream else 0.0,
+        'bit_rate': info['format'].get('bit_rate', 'N/A'),
+        'streams': [_stream_summary(stream) for stream in info['streams']]
+    }
+
+async def get_video_info(file_path: str, timeout: float = None) -> Dict:
+    """Get video information using ffprobe; {} if it fails or runs over ``timeout`` seconds"""
     try:
-        result = subprocess.run([
-            'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', file_path
-        ], capture_output=True, text=True, check=True)
-        
-        info = json.loads(result.stdout)
-        video_stream = next((stream for stream in info['streams'] if stream['codec_type'] == 'video'), None)
-        
-        return {
-            'duration': float(info['format'].get('duration', 0)),
-            'size': int(info['format'].get('size', 0)),
-            'width': int(video_stream['width']) if video_stream else 0,
-            'height': int(video_stream['height']) if video_stream else 0,
-            'codec': video_stream.get('codec_name', 'unknown'),
-            'bit_rate': info['format'].get('bit_rate', 'N/A')
-        }
-    except Exception as e:
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', file_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    except OSError as e:
+        logger.error(f"Error getting video info: {e}")
+        return {}
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.CancelledError:
+        await kill_process(process)
+        raise
+    except asyncio.TimeoutError:
+        await kill_process(process)
+        logger.error(f"Error getting video info: ffprobe ran over {timeout}s on {file_path}")
+        return {}
+    try:
+        return _parse_probe(json.loads(stdout))
+    except (ValueError, KeyError) as e:
         logger.error(f"Error getting video info: {e}")
         return {}
 
+async def probe_header(data: bytes) -> Dict:
+    """Get video information from the first bytes of a file; {} if they don't say (index at the end)"""
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', '-i', 'pipe:0',
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        stdout, _ = await process.communicate(data)
+    except asyncio.CancelledError:
+        await kill_process(process)
+        raise
+    except (BrokenPipeError, ConnectionResetError):
+        # ffprobe stops reading once it has seen enough
+        stdout = await process.stdout.read()
+        await process.wait()
+    try:
+        return _parse_probe(json.loads(stdout))
+    except (ValueError, KeyError) as e:
+        logger.debug(f"Header probe gave no video info: {e}")
+        return {}
+
 def format_bytes(bytes_value: int) -> str:
     """Convert bytes to human readable format"""
     for unit in ['B', 'KB', 'MB', 'GB']:
@@ -46,26 +110,38 @@ def format_duration(seconds: float) -> str:
     seconds = int(seconds % 60)
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
-async def check_ffmpeg():
-    """Check if FFmpeg is installed"""
-    try:
-        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
-        return True
-    except FileNotFoundError:
-        return False
+async def kill_process(process: asyncio.subprocess.Process):
+    """Kill a subprocess whose task was cancelled and reap it"""
+    if process.returncode is None:
+        process.kill()
+    await process.wait()
+
+def split_list(value: str) -> List[str]:
+    """Split a comma-separated setting into its non-empty items"""
+    return [item.strip() for item in value.split(',') if item.strip()]
 
 def ensure_temp_dir():
     """Ensure temp directory exists"""
     Path(config.TEMP_DIR).mkdir(parents=True, exist_ok=True)
 
-async def clean_temp_files():
-    """Clean up temporary files"""
+def clean_temp_files(max_age: float = 0, keep: Iterable[str] = ()) -> int:
+    """Delete temp entries older than ``max_age`` seconds except those in ``keep``; returns how many were removed"""
     temp_path = Path(config.TEMP_DIR)
+    keep = set(keep)
+    now = time.time()
+    removed = 0
     for file_path in temp_path.glob('*'):
         try:
-            file_path.unlink()
+            if file_path.name in keep or now - file_path.stat().st_mtime < max_age:
+                continue
+            if file_path.is_dir():
+                shutil.rmtree(file_path)
+            else:
+                file_path.unlink()
+            removed += 1
         except Exception as e:
             logger.error(f"Error deleting temp file {file_path}: {e}")
+    return removed
 
 def format_queue_position(position: int, total: int) -> str:
     """Format queue position display"""
@@ -1,10 +1,14 @@
 import ffmpeg
+import json
 import os
 import asyncio
 import logging
 from typing import Dict, Optional, List, Callable
-from config import RESOLUTIONS, TEMP_DIR
-from utils import get_video_info
+from config import RESOLUTIONS, TEMP_DIR, MAX_DURATION
+from utils import get_video_info, kill_process, format_duration
+from content_analysis import ContentAnalyzer
+from retry_policy import DurationLimitError, PermanentJobError, TransientJobError
+import metrics
 from pathlib import Path
 import tempfile
 import threading
@@ -12,116 +16,338 @@ import time
 
 logger = logging.getLogger(__name__)
 
+THUMBNAIL_WIDTH = 320
+# x264 threads per encode; several jobs encode at once
+ENCODE_THREADS = 2
+
+# Share of the size limit a part may reach by packet offsets; each part
+# gets its own moov atom and the offsets ignore it
+SPLIT_MARGIN = 0.95
+# Tolerance when matching cut times to keyframe timestamps (edit lists and
+# B-frame delay shift them slightly); far smaller than any keyframe interval
+SEGMENT_TIME_DELTA = 0.05
+
+# Audio profile of the outputs; compliant source audio is copied as is
+TARGET_AUDIO_CODEC = 'aac'
+TARGET_AUDIO_BITRATE = 128_000  # bits/s
+# Subtitle codecs MP4 can carry (as-is) or that convert cheaply to mov_text
+MP4_SUBTITLE_CODECS = {'mov_text'}
+TEXT_SUBTITLE_CODECS = {'subrip', 'ass', 'ssa', 'webvtt', 'text'}
+
+# FFmpeg errors caused by the machine rather than the input
+TRANSIENT_FFMPEG_ERRORS = (
+    'No space left on device', 'Input/output error', 'Cannot allocate memory', 'Resource temporarily unavailable'
+)
+
+def ffmpeg_error(tool: str, returncode: int, stderr: bytes) -> Exception:
+    """Classify a failed FFmpeg run: killed or out of resources is transient, anything else blames the input"""
+    message = stderr.decode(errors='replace').strip() or f"{tool} exited with {returncode}"
+    if returncode < 0 or any(marker in message for marker in TRANSIENT_FFMPEG_ERRORS):
+        return TransientJobError(message)
+    return PermanentJobError(message)
+
+def plan_streams(streams: List[Dict]) -> List[Dict]:
+    """Decide per source stream whether to transcode, copy or drop it (first video always transcoded)"""
+    plan = []
+    video_seen = False
+    for stream in streams:
+        entry = {'index': stream['index'], 'type': stream['type'], 'codec': stream['codec']}
+        if stream['type'] == 'video' and not video_seen:
+            video_seen = True
+            entry.update(action='transcode', reason='scaled')
+        elif stream['type'] == 'audio':
+            if stream['codec'] != TARGET_AUDIO_CODEC:
+                entry.update(action='transcode', reason=f"{stream['codec']} is not {TARGET_AUDIO_CODEC}")
+            elif not stream['bit_rate']:
+                entry.update(action='transcode', reason='unknown bitrate')
+            elif stream['bit_rate'] > TARGET_AUDIO_BITRATE:
+                entry.update(action='transcode', reason=f"{stream['bit_rate'] // 1000}k above target")
+            else:
+                entry.update(action='copy', reason=f"{stream['codec']} {stream['bit_rate'] // 1000}k already compliant")
+        elif stream['type'] == 'subtitle' and stream['codec'] in MP4_SUBTITLE_CODECS:
+            entry.update(action='copy', reason='supported by MP4')
+        elif stream['type'] == 'subtitle' and stream['codec'] in TEXT_SUBTITLE_CODECS:
+            entry.update(action='transcode', reason='text subtitles converted to mov_text')
+        else:
+            entry.update(action='drop', reason='not supported in MP4 output')
+        plan.append(entry)
+    return plan
+
+def plan_split_points(keyframes: List[tuple], file_size: int, limit: int) -> List[float]:
+    """Choose keyframe times to cut at so every part stays under ``limit`` bytes; ValueError if one GOP is too big"""
+    budget = limit * SPLIT_MARGIN
+    cuts = []
+    part_start = 0
+    previous = None
+    for time_point, pos in keyframes:
+        if pos - part_start > budget:
+            if previous is None or previous[1] <= part_start:
+                raise ValueError(f"Keyframe interval at {time_point:.1f}s exceeds the part size limit")
+            cuts.append(previous[0])
+            part_start = previous[1]
+        previous = (time_point, pos)
+    if file_size - part_start > budget:
+        if previous is None or previous[1] <= part_start:
+            raise ValueError("Last keyframe interval exceeds the part size limit")
+        cuts.append(previous[0])
+    return cuts
+
 class VideoProcessor:
-    def __init__(self):
+    def __init__(self, capabilities: Dict = None):
+        # From ffmpeg_capabilities.probe_capabilities; empty when not probed (benchmarks)
+        self.capabilities = capabilities or {}
+        # Pick the most representative frame when the build has the filter, else the first one
+        self.thumbnail_filter = self.has_filter('thumbnail')
         self.resolutions = RESOLUTIONS
         self.temp_dir = Path(TEMP_DIR)
         self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.analyzer = ContentAnalyzer()
+
+    def has_filter(self, name: str) -> bool:
+        """Whether FFmpeg has a filter; assumed when capabilities weren't probed"""
+        return not self.capabilities or name in self.capabilities['filters']
 
     async def compress_video_with_progress(self, input_path: str, output_path: str, 
                                          width: int, height: int, bitrate: str = '5M',
-                                         progress_callback: Callable[[float], None] = None) -> bool:
-        """Compress video with progress tracking"""
+                                         progress_callback: Callable[[float], None] = None,
+                                         duration: float = 0, preset: str = 'medium',
+                                         crf_offset: int = 0, complexity: Dict = None,
+                                         stream_plan: List[Dict] = None,
+                                         heartbeat: Callable[[], None] = None,
+                                         frame_rate: float = 0, threads: int = ENCODE_THREADS) -> Dict:
+        """Encode one rendition and its thumbnail in a single FFmpeg run; returns metadata ready for ``send_video``"""
+        logger.info(f"Starting compression: {input_path} -> {output_path} (preset {preset}, CRF +{crf_offset})")
+        
+        # Calculate CRF value based on bitrate
+        crf_value = 23
+        if bitrate.endswith('M'):
+            bitrate_num = float(bitrate[:-1])
+            if bitrate_num <= 2:
+                crf_value = 28
+            elif bitrate_num >= 8:
+                crf_value = 18
+        rate_control = self.analyzer.choose_rate_control(complexity, crf_value, bitrate, width, height)
+        crf_value = min(51, rate_control['crf'] + crf_offset)
+        rate_control['crf'] = crf_value
+        
+        thumb_path = str(Path(output_path).with_suffix('.jpg'))
+        
+        # Scale once and split: one branch is encoded, the other feeds the thumbnail
+        stream = ffmpeg.input(input_path)
+        scaled = stream.video.filter('scale', width, height).split()
+        streams, stream_args = self._map_streams(stream, stream_plan)
+        video = ffmpeg.output(
+            scaled[0],
+            *streams,
+            output_path,
+            vcodec='libx264',
+            preset=preset,
+            crf=crf_value,
+            # CRF with a VBV cap: the rate follows the content but never exceeds the ladder
+            maxrate=rate_control['maxrate'],
+            bufsize=rate_control['maxrate'] * 2,
+            movflags='+faststart',
+            threads=threads,
+            **stream_args
+        )
+        # Telegram thumbnails must be JPEG, at most 320px wide
+        thumb_source = scaled[1].filter('scale', THUMBNAIL_WIDTH, -2)
+        if self.thumbnail_filter:
+            thumb_source = thumb_source.filter('thumbnail')
+        thumb = ffmpeg.output(thumb_source, thumb_path, vframes=1)
+        cmd = ffmpeg.merge_outputs(video, thumb).global_args(
+            '-progress', 'pipe:1', '-nostats', '-loglevel', 'error'
+        ).overwrite_output().compile()
+        
+        # Run the compression
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
         try:
-            logger.info(f"Starting compression: {input_path} -> {output_path}")
-            
-            # Calculate CRF value based on bitrate
-            crf_value = 23
-            if bitrate.endswith('M'):
-                bitrate_num = int(bitrate[:-1])
-                if bitrate_num <= 2:
-                    crf_value = 28
-                elif bitrate_num >= 8:
-                    crf_value = 18
-            
-            # Use FFmpeg with memory-efficient settings
-            stream = ffmpeg.input(input_path)
-            stream = ffmpeg.filter(stream, 'scale', width, height)
-            stream = ffmpeg.output(
-                stream,
-                output_path,
-                vcodec='libx264',
-                acodec='aac',
-                video_bitrate=bitrate,
-                audio_bitrate='128k',
-                preset='medium',
-                crf=crf_value,
-                movflags='+faststart',
-                threads=2            ).overwrite_output()
-            
-            # Run the compression
-            ffmpeg.run(stream, quiet=True, overwrite_output=True)
-            
-            # Report 100% completion
-            if progress_callback:
-                progress_callback(100.0)
+            with metrics.STAGE_DURATION.time(stage='encode'):
+                _, stderr = await asyncio.gather(
+                    self._read_progress(process.stdout, duration, progress_callback, f"{height}p", heartbeat, frame_rate),
+                    process.stderr.read()
+                )
+                await process.wait()
+        except asyncio.CancelledError:
+            # The job was cancelled: stop FFmpeg now rather than letting it run to the end
+            await kill_process(process)
+            raise
+        
+        if process.returncode != 0:
+            raise ffmpeg_error('ffmpeg', process.returncode, stderr)
+        
+        # Report 100% completion
+        if progress_callback:
+            progress_callback(100.0)
+        
+        logger.info(f"Successfully compressed to: {output_path}")
+        # FFmpeg's out_time spans both outputs and ends at the thumbnail's; ask the file itself
+        output_info = await get_video_info(output_path)
+        return {
+            'path': output_path,
+            'thumbnail': thumb_path if os.path.exists(thumb_path) else None,
+            'duration': output_info.get('duration') or duration,
+            'width': width,
+            'height': height,
+            'size': os.path.getsize(output_path),
+            'rate_control': rate_control
+        }
+
+    def _map_streams(self, stream, stream_plan: Optional[List[Dict]]) -> tuple:
+        """Get the non-video streams to map and their per-stream codec options"""
+        audio_args = {'c:a': TARGET_AUDIO_CODEC, 'b:a': f"{TARGET_AUDIO_BITRATE // 1000}k"}
+        if stream_plan is None:
+            return [stream['a?']], audio_args
+        
+        mapped, args = [], {}
+        counters = {'audio': 0, 'subtitle': 0}
+        for entry in stream_plan:
+            if entry['type'] not in counters or entry['action'] == 'drop':
+                continue
+            # Options address output streams by type-relative index
+            n = counters[entry['type']]
+            counters[entry['type']] += 1
+            mapped.append(stream[str(entry['index'])])
+            if entry['type'] == 'audio':
+                args[f'c:a:{n}'] = 'copy' if entry['action'] == 'copy' else audio_args['c:a']
+                if entry['action'] != 'copy':
+                    args[f'b:a:{n}'] = audio_args['b:a']
+            else:
+                args[f'c:s:{n}'] = 'copy' if entry['action'] == 'copy' else 'mov_text'
+        return mapped, args
+
+    async def _read_progress(self, stdout: asyncio.StreamReader, duration: float,
+                             progress_callback: Callable[[float], None] = None,
+                             resolution: str = '', heartbeat: Callable[[], None] = None,
+                             frame_rate: float = 0) -> Dict:
+        """Parse FFmpeg ``-progress`` output and forward percentages"""
+        stats = {'out_time': 0.0, 'fps': 0.0}
+        last_reported = -1
+        
+        while True:
+            line = await stdout.readline()
+            if not line:
+                break
+            if heartbeat:
+                heartbeat()
             
-            logger.info(f"Successfully compressed to: {output_path}")
-            return True
+            key, _, value = line.decode(errors='replace').strip().partition('=')
+            try:
+                # out_time follows the slowest output (the thumbnail); frame counts the encoded video
+                if key == 'frame' and frame_rate:
+                    stats['out_time'] = int(value) / frame_rate
+                elif key == 'out_time_us' and not frame_rate:
+                    stats['out_time'] = max(stats['out_time'], int(value) / 1_000_000)
+                elif key == 'fps':
+                    stats['fps'] = float(value)
+                    metrics.FFMPEG_FPS.set(stats['fps'], resolution=resolution)
+            except ValueError:
+                continue
             
-        except Exception as e:
-            logger.error(f"Compression failed: {e}")
-            return False
+            # Only report whole-percent changes to avoid flooding the callback
+            if key == 'progress' and progress_callback and duration > 0:
+                percent = int(min(stats['out_time'] / duration * 100, 99))
+                if percent > last_reported:
+                    last_reported = percent
+                    progress_callback(float(percent))
+        
+        return stats
 
     async def process_video_with_progress(self, input_path: str, target_resolution: str = None, 
-                                        progress_callback: Callable[[float], None] = None) -> List[str]:
-        """Process video with progress tracking"""
-        try:
-            # Get video info
-            video_info = get_video_info(input_path)
-            logger.info(f"Video info: {video_info}")
-            
-            compressed_files = []
+                                        progress_callback: Callable[[float], None] = None,
+                                        output_dir: str = None, encoder_settings: Dict = None,
+                                        heartbeat: Callable[[], None] = None) -> List[Dict]:
+        """Encode the requested rendition (or all of them) into ``output_dir``; returns one metadata dict per output"""
+        output_dir = Path(output_dir) if output_dir else self.temp_dir
+        encoder_settings = encoder_settings or {}
+        preset = encoder_settings.get('preset', 'medium')
+        crf_offset = encoder_settings.get('crf_offset', 0)
+        threads = encoder_settings.get('threads', ENCODE_THREADS)
+        # Get video info
+        with metrics.STAGE_DURATION.time(stage='probe'):
+            # Not time-limited here: the job's stall watchdog cancels it, which kills ffprobe
+            video_info = await get_video_info(input_path)
+        logger.info(f"Video info: {video_info}")
+        # Admission could not see the duration of every upload (see AdmissionControl)
+        if video_info.get('duration', 0) > MAX_DURATION:
+            raise DurationLimitError(
+                f"Video too long! {format_duration(video_info['duration'])} exceeds the "
+                f"{format_duration(MAX_DURATION)} limit."
+            )
+        
+        stream_plan = None
+        if video_info.get('streams'):
+            stream_plan = plan_streams(video_info['streams'])
+            for entry in stream_plan:
+                metrics.STREAM_DECISIONS.inc(type=entry['type'], action=entry['action'])
+            skipped = [f"#{entry['index']} {entry['type']} ({entry['reason']})" for entry in stream_plan if entry['action'] != 'transcode']
+            logger.info(f"Stream plan: {len(stream_plan) - len(skipped)} transcoded, not transcoded: {', '.join(skipped) or 'none'}")
+        
+        with metrics.STAGE_DURATION.time(stage='analyze'):
+            complexity = await self.analyzer.analyze(input_path, video_info)
+        if complexity:
+            logger.info(f"Content complexity: {complexity}")
+        
+        compressed_files = []
+        
+        if target_resolution:
+            # Single resolution
+            res_params = self.resolutions[target_resolution]
+            output_path = output_dir / f"compressed_{target_resolution}_{Path(input_path).stem}.mp4"
             
-            if target_resolution:
-                # Single resolution
-                res_params = self.resolutions[target_resolution]
-                output_path = self.temp_dir / f"compressed_{target_resolution}_{Path(input_path).stem}.mp4"
+            output = await self.compress_video_with_progress(
+                input_path, str(output_path),
+                res_params['width'], res_params['height'],
+                res_params['bitrate'],
+                progress_callback,
+                video_info.get('duration', 0),
+                preset, crf_offset, complexity, stream_plan, heartbeat,
+                frame_rate=video_info.get('frame_rate', 0), threads=threads
+            )
+            output['resolution'] = target_resolution
+            output['complexity'] = complexity
+            output['streams'] = stream_plan
+            compressed_files.append(output)
+        else:
+            # All resolutions
+            total_resolutions = len(self.resolutions)
+            for i, (res_name, res_params) in enumerate(self.resolutions.items()):
+                output_path = output_dir / f"compressed_{res_name}_{Path(input_path).stem}.mp4"
                 
-                success = await self.compress_video_with_progress(
+                # Calculate progress for this resolution
+                base_progress = (i / total_resolutions) * 100
+                next_progress = ((i + 1) / total_resolutions) * 100
+                
+                def res_progress_callback(p, base=base_progress, next=next_progress):
+                    if progress_callback:
+                        calculated = base + (p * (next - base) / 100)
+                        progress_callback(calculated)
+                
+                output = await self.compress_video_with_progress(
                     input_path, str(output_path),
                     res_params['width'], res_params['height'],
                     res_params['bitrate'],
-                    progress_callback
+                    res_progress_callback,
+                    video_info.get('duration', 0),
+                    preset, crf_offset, complexity, stream_plan, heartbeat,
+                    frame_rate=video_info.get('frame_rate', 0), threads=threads
                 )
-                
-                if success:
-                    compressed_files.append(str(output_path))
-            else:
-                # All resolutions
-                total_resolutions = len(self.resolutions)
-                for i, (res_name, res_params) in enumerate(self.resolutions.items()):
-                    output_path = self.temp_dir / f"compressed_{res_name}_{Path(input_path).stem}.mp4"
-                    
-                    # Calculate progress for this resolution
-                    base_progress = (i / total_resolutions) * 100
-                    next_progress = ((i + 1) / total_resolutions) * 100
-                                        def res_progress_callback(p, base=base_progress, next=next_progress):
-                        if progress_callback:
-                            calculated = base + (p * (next - base) / 100)
-                            progress_callback(calculated)
-                    
-                    success = await self.compress_video_with_progress(
-                        input_path, str(output_path),
-                        res_params['width'], res_params['height'],
-                        res_params['bitrate'],
-                        res_progress_callback
-                    )
-                    
-                    if success:
-                        compressed_files.append(str(output_path))
-            
-            return compressed_files
-            
-        except Exception as e:
-            logger.error(f"Error processing video: {e}")
-            return []
+                output['resolution'] = res_name
+                output['complexity'] = complexity
+                output['streams'] = stream_plan
+                compressed_files.append(output)
+        
+        return compressed_files
 
-    def get_file_metadata(self, file_path: str) -> Dict:
+    async def get_file_metadata(self, file_path: str) -> Dict:
         """Get file metadata for channel upload"""
         try:
             stat = os.stat(file_path)
-            video_info = get_video_info(file_path)
+            video_info = await get_video_info(file_path)
             
             return {
                 'size': stat.st_size,
@@ -133,3 +359,93 @@ class VideoProcessor:
         except Exception as e:
             logger.error(f"Error getting meta {e}")
             return {}
+
+    async def _keyframe_index(self, file_path: str) -> List[tuple]:
+        """Read (pts_time, byte offset) of every video keyframe from the packet index"""
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,pos,flags', '-of', 'json', file_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            await kill_process(process)
+            raise
+        if process.returncode != 0:
+            raise ffmpeg_error('ffprobe', process.returncode, stderr)
+        
+        keyframes = []
+        for packet in json.loads(stdout).get('packets', []):
+            if 'K' in packet.get('flags', '') and packet.get('pos', 'N/A') != 'N/A' and packet.get('pts_time', 'N/A') != 'N/A':
+                keyframes.append((float(packet['pts_time']), int(packet['pos'])))
+        return sorted(keyframes, key=lambda keyframe: keyframe[1])
+
+    async def split_output(self, output: Dict, limit: int, heartbeat: Callable[[], None] = None) -> List[Dict]:
+        """Cut an output into parts under ``limit`` bytes at keyframes by stream copy; the original is removed"""
+        keyframes = await self._keyframe_index(output['path'])
+        cuts = plan_split_points(keyframes, output['size'], limit)
+        if not cuts:
+            return [output]
+        
+        logger.info(f"Splitting {output['path']} ({output['size']} bytes) at {cuts}")
+        source = Path(output['path'])
+        pattern = str(source.with_name(f"{source.stem}_part%03d{source.suffix}"))
+        cmd = (
+            ffmpeg.input(output['path'])
+            .output(
+                pattern,
+                format='segment',
+                segment_times=','.join(f"{cut:.6f}" for cut in cuts),
+                segment_time_delta=SEGMENT_TIME_DELTA,
+                reset_timestamps=1,
+                segment_format_options='movflags=+faststart',
+                # Each finished part is listed on stdout
+                segment_list='pipe:1',
+                segment_list_type='flat',
+                c='copy',
+                map='0'
+            )
+            .global_args('-loglevel', 'error')
+            .overwrite_output()
+            .compile()
+        )
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        
+        async def watch_parts():
+            async for _ in process.stdout:
+                if heartbeat:
+                    heartbeat()
+        
+        try:
+            _, stderr = await asyncio.gather(watch_parts(), process.stderr.read())
+            await process.wait()
+        except asyncio.CancelledError:
+            await kill_process(process)
+            raise
+        if process.returncode != 0:
+            raise ffmpeg_error('ffmpeg', process.returncode, stderr)
+        
+        bounds = [0.0] + cuts + [output['duration']]
+        parts = []
+        for i in range(len(cuts) + 1):
+            path = pattern % i
+            size = os.path.getsize(path)
+            if size > limit:
+                raise PermanentJobError(f"Part {i + 1} is {size} bytes, over the {limit} byte limit")
+            parts.append({
+                **output,
+                'path': path,
+                'duration': max(0.0, bounds[i + 1] - bounds[i]),
+                'size': size,
+                'part': i + 1,
+                'parts': len(cuts) + 1
+            })
+        
+        os.remove(output['path'])
+        return parts